@@ -0,0 +1,416 @@
+# Agent Metrics
+#
+# Latency and token instrumentation for agent runs. Every model call (one
+# agent turn) records model time and input/output tokens, every function tool
+# call records tool time, and handoffs requested by a model are counted.
+# Complex-case steps additionally record wall time and what happened inside
+# them. Everything goes into in-process histograms that can be exported in the
+# Prometheus text format (HTTP endpoint or file); the handled case also gets a
+# per-case summary as `result.metrics`.
+#
+# Histograms are sharded per thread: a thread only ever writes its own shard,
+# so recording takes no lock, and readers sum the shards when exporting.
+import bisect
+import contextlib
+import contextvars
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agents import FunctionTool
+from openai.types.responses import ResponseCompletedEvent
+
+from model_wrappers import WrappedModel, usage_from_response, wrap_agent_models
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+
+# Metrics of the case (and step) being handled by the current task
+current_case_metrics = contextvars.ContextVar("current_case_metrics", default=None)
+current_step_metrics = contextvars.ContextVar("current_step_metrics", default=None)
+# Agent whose model produced the tool calls now running
+current_agent_name = contextvars.ContextVar("current_agent_name", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one lock-free shard per writing thread"""
+
+    kind = "histogram"
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # One count per bucket plus +Inf, then the running sum
+            shard = self._local.shard = [0] * (len(self.buckets) + 1) + [0.0]
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def snapshot(self):
+        """(per-bucket counts including +Inf, sum) over all shards"""
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for index in range(len(counts)):
+                counts[index] += shard[index]
+            total += shard[-1]
+        return counts, total
+
+
+class Counter:
+    """Monotonic counter with one lock-free shard per writing thread"""
+
+    kind = "counter"
+
+    def __init__(self):
+        self._shards = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = [0]
+            with self._lock:
+                self._shards.append(shard)
+        shard[0] += amount
+
+    @property
+    def value(self):
+        with self._lock:
+            shards = list(self._shards)
+        return sum(shard[0] for shard in shards)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class MetricsRegistry:
+    """Named, labelled histograms and counters"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, help, labels, factory):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = factory()
+                    self._help.setdefault(name, help)
+        return metric
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS, **labels):
+        return self._get(name, help, labels, lambda: Histogram(buckets))
+
+    def counter(self, name, help="", **labels):
+        return self._get(name, help, labels, Counter)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            items = sorted(self._metrics.items(), key=lambda item: item[0])
+        lines = []
+        previous_name = None
+        for (name, labels), metric in items:
+            if name != previous_name:
+                lines.append(f"# HELP {name} {self._help.get(name, '')}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                previous_name = name
+            if metric.kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+                continue
+            counts, total = metric.snapshot()
+            cumulative = 0
+            for bound, count in zip(list(metric.buckets) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+# Default registry used by the instrumentation below
+registry = MetricsRegistry()
+
+
+class StepMetrics:
+    """What happened during one complex-case step"""
+
+    def __init__(self, step, title, agent):
+        self.step = step
+        self.title = title
+        self.agent = agent
+        self.wall_seconds = 0.0
+        self.model_seconds = 0.0
+        self.tool_seconds = 0.0
+        self.turns = 0
+        self.tool_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.handoffs = 0
+
+    def as_dict(self):
+        return {key: round(value, 4) if isinstance(value, float) else value for key, value in vars(self).items()}
+
+
+class CaseMetrics:
+    """Per-case accumulation of agent turns, tool calls, handoffs and steps"""
+
+    def __init__(self, case_id):
+        self.case_id = case_id
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.steps = []
+        self.agents = {}
+        self._lock = threading.Lock()
+
+    def _agent(self, name):
+        stats = self.agents.get(name)
+        if stats is None:
+            stats = self.agents[name] = {"turns": 0, "model_seconds": 0.0, "input_tokens": 0, "output_tokens": 0,
+                                         "tool_calls": 0, "tool_seconds": 0.0, "handoffs": 0}
+        return stats
+
+    def record_turn(self, agent, seconds, input_tokens, output_tokens):
+        with self._lock:
+            stats = self._agent(agent)
+            stats["turns"] += 1
+            stats["model_seconds"] += seconds
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+
+    def record_tool(self, agent, seconds):
+        with self._lock:
+            stats = self._agent(agent)
+            stats["tool_calls"] += 1
+            stats["tool_seconds"] += seconds
+
+    def record_handoff(self, agent):
+        with self._lock:
+            self._agent(agent)["handoffs"] += 1
+
+    def add_step(self, step):
+        with self._lock:
+            self.steps.append(step)
+
+    @property
+    def wall_seconds(self):
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    def summary(self):
+        with self._lock:
+            agents = {name: {key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()}
+                      for name, stats in self.agents.items()}
+            steps = [step.as_dict() for step in sorted(self.steps, key=lambda step: step.step)]
+        totals = {key: sum(stats[key] for stats in agents.values())
+                  for key in ("turns", "input_tokens", "output_tokens", "tool_calls", "handoffs")}
+        totals["model_seconds"] = round(sum(stats["model_seconds"] for stats in agents.values()), 4)
+        totals["tool_seconds"] = round(sum(stats["tool_seconds"] for stats in agents.values()), 4)
+        if not agents:
+            # Models are not instrumented; fall back to the token counts of the step results
+            totals["input_tokens"] = sum(step["input_tokens"] for step in steps)
+            totals["output_tokens"] = sum(step["output_tokens"] for step in steps)
+        return {"case_id": self.case_id, "wall_seconds": round(self.wall_seconds, 4),
+                "totals": totals, "agents": agents, "steps": steps}
+
+
+@contextlib.contextmanager
+def case_metrics(case_id, registry=registry):
+    """Collect metrics of everything run inside this block (and tasks it spawns) for `case_id`"""
+    metrics = CaseMetrics(case_id)
+    token = current_case_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        current_case_metrics.reset(token)
+        metrics.finished_at = time.perf_counter()
+        registry.histogram("support_case_seconds", "Wall time of handling one support case").observe(metrics.wall_seconds)
+
+
+def _record_turn(registry, agent, model, seconds, usage, handoffs):
+    input_tokens = usage.input_tokens if usage is not None else 0
+    output_tokens = usage.output_tokens if usage is not None else 0
+    registry.histogram("agent_model_seconds", "Model call latency per agent turn", agent=agent, model=model).observe(seconds)
+    registry.histogram("agent_input_tokens", "Input tokens per agent turn", TOKEN_BUCKETS, agent=agent).observe(input_tokens)
+    registry.histogram("agent_output_tokens", "Output tokens per agent turn", TOKEN_BUCKETS, agent=agent).observe(output_tokens)
+    for target in handoffs:
+        registry.counter("agent_handoffs_total", "Handoffs requested by an agent", source=agent, target=target).inc()
+    case = current_case_metrics.get()
+    if case is not None:
+        case.record_turn(agent, seconds, input_tokens, output_tokens)
+        for _ in handoffs:
+            case.record_handoff(agent)
+    step = current_step_metrics.get()
+    if step is not None:
+        step.turns += 1
+        step.model_seconds += seconds
+
+
+def _requested_handoffs(output, handoffs):
+    """Targets of the handoff tool calls in a model response"""
+    targets = {getattr(handoff, "tool_name", None): getattr(handoff, "agent_name", None) for handoff in handoffs or ()}
+    return [targets[item.name] for item in output
+            if getattr(item, "type", None) == "function_call" and getattr(item, "name", None) in targets]
+
+
+class InstrumentedModel(WrappedModel):
+    """Records latency, token usage and requested handoffs of every model call"""
+
+    def __init__(self, inner, agent_name, registry=registry):
+        super().__init__(inner, agent_name)
+        self.registry = registry
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs):
+        current_agent_name.set(self.agent_name)
+        start = time.perf_counter()
+        response = await self.inner.get_response(
+            system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs
+        )
+        _record_turn(self.registry, self.agent_name, self.model_name, time.perf_counter() - start,
+                     response.usage, _requested_handoffs(response.output, handoffs))
+        return response
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs):
+        current_agent_name.set(self.agent_name)
+        start = time.perf_counter()
+        completed = None
+        async for event in self.inner.stream_response(
+            system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs
+        ):
+            if isinstance(event, ResponseCompletedEvent):
+                completed = event.response
+            yield event
+        usage = usage_from_response(completed) if completed is not None else None
+        requested = _requested_handoffs(completed.output, handoffs) if completed is not None else []
+        _record_turn(self.registry, self.agent_name, self.model_name, time.perf_counter() - start, usage, requested)
+
+
+def _instrument_tool(tool, registry):
+    """Time a FunctionTool's invocations; the agent label comes from the model turn that called it"""
+    if getattr(tool, "_metrics_instrumented", False):
+        return
+    invoke = tool.on_invoke_tool
+
+    async def timed_invoke(ctx, input):
+        start = time.perf_counter()
+        try:
+            return await invoke(ctx, input)
+        finally:
+            seconds = time.perf_counter() - start
+            agent = current_agent_name.get() or "unknown"
+            registry.histogram("agent_tool_seconds", "Function tool execution time", agent=agent, tool=tool.name).observe(seconds)
+            case = current_case_metrics.get()
+            if case is not None:
+                case.record_tool(agent, seconds)
+            step = current_step_metrics.get()
+            if step is not None:
+                step.tool_calls += 1
+                step.tool_seconds += seconds
+
+    tool.on_invoke_tool = timed_invoke
+    tool._metrics_instrumented = True
+
+
+def enable_metrics(agents, registry=registry, provider=None):
+    """Instrument every agent's model and function tools; returns the registry.
+
+    Safe to call again: agents and tools that are already instrumented are
+    left as they are.
+    """
+    wrap_agent_models(agents, lambda inner, agent: InstrumentedModel(inner, agent.name, registry), InstrumentedModel, provider)
+    for agent in agents:
+        for tool in agent.tools:
+            if isinstance(tool, FunctionTool):
+                _instrument_tool(tool, registry)
+    return registry
+
+
+def record_step(step, title, agent_name, seconds, result, registry=registry):
+    """Record a finished case step from its wall time and run result"""
+    metrics = current_step_metrics.get()
+    if metrics is None or metrics.step != step:
+        metrics = StepMetrics(step, title, agent_name)
+    metrics.wall_seconds = seconds
+    for response in getattr(result, "raw_responses", None) or ():
+        metrics.input_tokens += response.usage.input_tokens
+        metrics.output_tokens += response.usage.output_tokens
+    metrics.handoffs = sum(1 for item in getattr(result, "new_items", None) or () if item.type == "handoff_output_item")
+    registry.histogram("case_step_seconds", "Wall time of a support case step", step=step, agent=agent_name).observe(seconds)
+    registry.histogram("case_step_input_tokens", "Input tokens of a support case step", TOKEN_BUCKETS, step=step, agent=agent_name).observe(metrics.input_tokens)
+    registry.histogram("case_step_output_tokens", "Output tokens of a support case step", TOKEN_BUCKETS, step=step, agent=agent_name).observe(metrics.output_tokens)
+    case = current_case_metrics.get()
+    if case is not None:
+        case.add_step(metrics)
+    return metrics
+
+
+def timed_step(run_step, registry=registry):
+    """Wrap a handle_complex_case `run_step` so every step is recorded"""
+    async def run(step, title, agent, prompt, label):
+        token = current_step_metrics.set(StepMetrics(step, title, agent.name))
+        start = time.perf_counter()
+        try:
+            result = await run_step(step, title, agent, prompt, label)
+            record_step(step, title, agent.name, time.perf_counter() - start, result, registry)
+            return result
+        finally:
+            current_step_metrics.reset(token)
+    return run
+
+
+def write_metrics_file(path, registry=registry):
+    """Write the Prometheus text export to `path` atomically (for node_exporter's textfile collector)"""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(temporary, path)
+
+
+def start_metrics_server(port=9464, host="127.0.0.1", registry=registry):
+    """Serve GET /metrics from a daemon thread; returns the server (call shutdown() to stop)"""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
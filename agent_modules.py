@@ -0,0 +1,33 @@
+# Loaders for the agent scripts whose file names are not importable
+#
+# ecommerce-agents.py and travel-agents.py contain hyphens, so `import` cannot
+# reach them. These helpers load each script once under an importable module
+# name; the `if __name__ == "__main__"` demos are not run.
+import importlib.util
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_script(filename, module_name):
+    """Load a script from this directory as `module_name`, reusing it if already loaded"""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(BASE_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    return module
+
+
+def load_ecommerce_agents():
+    return load_script("ecommerce-agents.py", "ecommerce_agents")
+
+
+def load_travel_agents():
+    return load_script("travel-agents.py", "travel_agents")
@@ -0,0 +1,80 @@
+# Long-lived Agent Runtime
+#
+# Runs all agent work on one persistent event loop in a background thread.
+# Synchronous callers (the Streamlit script, worker threads) submit coroutines
+# and get concurrent.futures.Future objects back. Because the loop and the
+# OpenAI client outlive each submission, keep-alive HTTP connections are
+# reused across requests and sessions instead of being torn down every run.
+import asyncio
+import os
+import threading
+
+from model_client import install_shared_client
+
+
+class AgentRuntime:
+    """A background thread running one event loop forever"""
+
+    def __init__(self, name="agent-runtime"):
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        self.loop.run_forever()
+
+    @property
+    def running(self):
+        return self._thread.is_alive() and self.loop.is_running()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the runtime loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the runtime loop and block until it finishes"""
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen, timeout=None):
+        """Consume an async generator on the runtime loop from synchronous code.
+
+        Each item is fetched with its own future, so the caller can render
+        items as they arrive. Leaving the loop early closes the generator.
+        """
+        try:
+            while True:
+                try:
+                    yield self.submit(agen.__anext__()).result(timeout)
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.submit(agen.aclose()).result(timeout)
+
+    def stop(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+_runtime = None
+_runtime_pid = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime():
+    """The process-wide runtime, created on first use (and again after a fork).
+
+    The first call also installs the shared model client (model_client.py)
+    as the SDK default, so every agent shares its connection pool.
+    """
+    global _runtime, _runtime_pid
+    with _runtime_lock:
+        if _runtime is None or _runtime_pid != os.getpid() or not _runtime.running:
+            _runtime = AgentRuntime()
+            _runtime_pid = os.getpid()
+            install_shared_client()
+        return _runtime
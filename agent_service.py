@@ -0,0 +1,418 @@
+# Agent HTTP Service
+#
+# JSON endpoints for the support, e-commerce and travel entry points, served by
+# Starlette under uvicorn. Every worker process imports the agent graphs once
+# and shares them, and the process-wide model client, across all requests.
+#
+#   GET  /healthz                         liveness
+#   GET  /metrics                         Prometheus metrics
+#   POST /support/cases                   {"case_id", "query"?, "concurrent"?}  → result
+#   POST /ecommerce/queries               {"query", "session_id"?}              → result
+#   POST /travel/plans                    {"prompt"}                            → result
+#   POST /jobs/{support|ecommerce|travel} same body                             → 202 {"job_id"}
+#   GET  /jobs/{job_id}                   job status and, once finished, its result
+#   GET  /jobs/{job_id}/events            server-sent events of the job as it runs
+#
+# Jobs and their events are kept in SQLite in the data directory, so with
+# several worker processes any worker can answer a poll or stream for a job
+# another worker is running. Support jobs stream their steps, tool calls,
+# handoffs and text as they happen (see support_streaming.py). Job writes run
+# in a thread, off the event loop, and events are written in batches at most
+# every EVENT_POLL_INTERVAL. When a worker starts, jobs left queued or running
+# by a worker process that is gone are marked failed.
+#
+#   python agent_service.py --workers 4 --port 8000
+#
+# With AGENT_SERVICE_OFFLINE=1 the agents run against the scripted models of
+# offline_bench.py (median latency AGENT_SERVICE_OFFLINE_LATENCY seconds), for
+# load tests without network access.
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+from agent_metrics import enable_metrics, registry
+from agent_modules import load_ecommerce_agents, load_travel_agents
+from storage import connect_sqlite, data_path
+
+MAX_IN_FLIGHT = int(os.environ.get("AGENT_SERVICE_MAX_IN_FLIGHT", 32))
+# Seconds between checks for new events of a job being streamed
+EVENT_POLL_INTERVAL = 0.1
+
+
+class JobStore:
+    """Jobs and their event logs, shared by the worker processes of one host"""
+
+    def __init__(self, path=None):
+        self.path = path or data_path("agent_jobs.sqlite3")
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                worker INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_events (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                event TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def create(self, kind, payload):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, payload, status, worker, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            (job_id, kind, json.dumps(payload, ensure_ascii=False), os.getpid(), now, now),
+        )
+        return job_id
+
+    def update(self, job_id, status, result=None, error=None):
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id),
+        )
+
+    def get(self, job_id):
+        row = self._conn().execute(
+            "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, result, error, created_at, updated_at = row
+        return {"job_id": job_id, "kind": kind, "status": status, "result": json.loads(result) if result else None,
+                "error": error, "created_at": created_at, "updated_at": updated_at}
+
+    def add_events(self, job_id, events):
+        """Append (seq, event) pairs to a job's event log in one transaction"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                             [(job_id, seq, json.dumps(event, ensure_ascii=False, default=str)) for seq, event in events])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def fail_orphaned(self):
+        """Mark failed the unfinished jobs of worker processes that no longer exist; returns their IDs.
+
+        Called when a worker starts, so jobs of an earlier process with the
+        same PID count as orphaned too.
+        """
+        conn = self._conn()
+        orphaned = []
+        for job_id, worker in conn.execute("SELECT id, worker FROM jobs WHERE status IN ('queued', 'running')").fetchall():
+            if worker != os.getpid() and _process_alive(worker):
+                continue
+            error = f"worker process {worker} exited before the job finished"
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                    "WHERE id = ? AND status IN ('queued', 'running')",
+                    (error, time.time(), job_id),
+                )
+                if cursor.rowcount == 1:
+                    seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+                    conn.execute("INSERT INTO job_events (job_id, seq, event) VALUES (?, ?, ?)",
+                                 (job_id, seq + 1, json.dumps({"type": "job_failed", "error": error})))
+                    orphaned.append(job_id)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return orphaned
+
+    def events_after(self, job_id, seq):
+        rows = self._conn().execute(
+            "SELECT seq, event FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq", (job_id, seq)
+        ).fetchall()
+        return [(seq, json.loads(event)) for seq, event in rows]
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _output(value):
+    return value.model_dump() if hasattr(value, "model_dump") else value
+
+
+def _handoff(item):
+    if isinstance(item, dict):
+        return item
+    return {"source_agent": {"name": item.source_agent.name}, "target_agent": {"name": item.target_agent.name},
+            "tool_name": getattr(item, "tool_name", None)}
+
+
+def serialize_result(result):
+    """JSON body for a run result (None when the entry point gave up on the request)"""
+    if result is None:
+        return {"final_output": None}
+    handoffs = getattr(result, "all_handoffs", None)
+    if handoffs is None:
+        handoffs = [item for item in getattr(result, "new_items", None) or () if item.type == "handoff_output_item"]
+    body = {"final_output": _output(result.final_output), "handoffs": [_handoff(item) for item in handoffs]}
+    for field in ("budget_exhausted", "budget_reason", "budget", "metrics", "compaction"):
+        if getattr(result, field, None) is not None:
+            body[field] = getattr(result, field)
+    return body
+
+
+class AgentService:
+    """The agent graphs of one worker process and the jobs it runs"""
+
+    def __init__(self, jobs=None):
+        import support_agents
+        import support_streaming
+        self.support = support_agents
+        self.streaming = support_streaming
+        self.ecommerce = load_ecommerce_agents()
+        self.travel = load_travel_agents()
+        if os.environ.get("AGENT_SERVICE_OFFLINE") == "1":
+            self._use_offline_models()
+        # Per-turn model, token, handoff and tool metrics for /metrics; outermost, so they see what callers see
+        for module in (self.support, self.ecommerce, self.travel):
+            enable_metrics(module.all_agents)
+        self.jobs = jobs or JobStore()
+        orphaned = self.jobs.fail_orphaned()
+        if orphaned:
+            print(f"Marked {len(orphaned)} jobs of exited workers as failed")
+        self.in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        self._tasks = set()
+
+    def _use_offline_models(self):
+        from case_budget import enable_budget_metering, enable_case_budgets
+        from offline_bench import ECOMMERCE_SCRIPTS, SUPPORT_SCRIPTS, TRAVEL_SCRIPTS
+        from rate_limiter import enable_rate_limits
+        from resilience import enable_resilience
+        from scripted_model import ScriptedModelProvider, lognormal_latency, use_scripted_models
+        latency = float(os.environ.get("AGENT_SERVICE_OFFLINE_LATENCY", 0.05))
+        model_latency = lognormal_latency(latency) if latency > 0 else None
+        for module, scripts in ((self.support, SUPPORT_SCRIPTS), (self.ecommerce, ECOMMERCE_SCRIPTS), (self.travel, TRAVEL_SCRIPTS)):
+            use_scripted_models(module.all_agents, ScriptedModelProvider(scripts, model_latency, os.getpid()))
+            enable_rate_limits(module.all_agents)
+            if module is self.support:
+                enable_budget_metering(module.all_agents)
+            enable_resilience(module.all_agents)
+        enable_case_budgets(self.support.all_agents)
+
+    def validate(self, kind, body):
+        """Raise ValueError unless `body` is a complete request for entry point `kind`"""
+        required = {"support": "case_id", "ecommerce": "query", "travel": "prompt"}[kind]
+        if not body.get(required):
+            raise ValueError(f"{required} is required")
+
+    def call(self, kind, body):
+        """Coroutine running entry point `kind` for a validated request body"""
+        if kind == "support":
+            return self.support.handle_support_case(body["case_id"], body.get("query"),
+                                                    concurrent=body.get("concurrent", True), raise_errors=True)
+        if kind == "ecommerce":
+            return self.ecommerce.handle_customer_query(body["query"], session_id=body.get("session_id"))
+        return self.travel.plan_trip(body["prompt"])
+
+    async def run(self, kind, body):
+        async with self.in_flight:
+            return serialize_result(await self.call(kind, body))
+
+    async def submit(self, kind, body):
+        """Start a job for a validated request in this process; returns its ID"""
+        job_id = await asyncio.to_thread(self.jobs.create, kind, body)
+        task = asyncio.ensure_future(self._run_job(job_id, kind, body))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job_id
+
+    async def _run_job(self, job_id, kind, body):
+        seq = 0
+        pending = []
+        flushed_at = time.monotonic()
+
+        def emit(event):
+            nonlocal seq
+            seq += 1
+            pending.append((seq, event))
+
+        async def flush(force=False):
+            # Readers poll every EVENT_POLL_INTERVAL, so events are written at most that often
+            nonlocal flushed_at
+            if pending and (force or time.monotonic() - flushed_at >= EVENT_POLL_INTERVAL):
+                batch = pending[:]
+                pending.clear()
+                flushed_at = time.monotonic()
+                await asyncio.to_thread(self.jobs.add_events, job_id, batch)
+
+        async with self.in_flight:
+            await asyncio.to_thread(self.jobs.update, job_id, "running")
+            emit({"type": "job_started", "job_id": job_id})
+            await flush(force=True)
+            try:
+                if kind == "support":
+                    result = None
+                    async for event in self.streaming.stream_support_case(body["case_id"], body.get("query"),
+                                                                          body.get("concurrent", True)):
+                        if event["type"] == "case_completed":
+                            result = serialize_result(event["result"])
+                        elif event["type"] == "error":
+                            raise event["error"]
+                        else:
+                            emit(event)
+                            await flush()
+                else:
+                    result = serialize_result(await self.call(kind, body))
+            except Exception as e:
+                await flush(force=True)
+                await asyncio.to_thread(self.jobs.update, job_id, "failed", error=str(e))
+                emit({"type": "job_failed", "error": str(e)})
+                await flush(force=True)
+                return
+            await flush(force=True)
+            await asyncio.to_thread(self.jobs.update, job_id, "done", result)
+            emit({"type": "job_completed", "result": result})
+            await flush(force=True)
+
+    async def events(self, job_id):
+        """Server-sent events of a job, from its first event until it finishes"""
+        seq = 0
+        while True:
+            for seq, event in await asyncio.to_thread(self.jobs.events_after, job_id, seq):
+                yield f"id: {seq}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                if event["type"] in ("job_completed", "job_failed"):
+                    return
+            await asyncio.sleep(EVENT_POLL_INTERVAL)
+
+
+service = None
+
+ENTRY_POINTS = {"/support/cases": "support", "/ecommerce/queries": "ecommerce", "/travel/plans": "travel"}
+
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ValueError("request body must be JSON")
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    return body
+
+
+async def run_entry_point(request):
+    kind = ENTRY_POINTS[request.url.path]
+    try:
+        body = await _json_body(request)
+        service.validate(kind, body)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    try:
+        return JSONResponse(await service.run(kind, body))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def submit_job(request):
+    kind = request.path_params["kind"]
+    if kind not in ENTRY_POINTS.values():
+        return JSONResponse({"error": f"unknown entry point '{kind}'"}, status_code=404)
+    try:
+        body = await _json_body(request)
+        service.validate(kind, body)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    job_id = await service.submit(kind, body)
+    return JSONResponse({"job_id": job_id, "status": "queued", "poll": f"/jobs/{job_id}",
+                         "events": f"/jobs/{job_id}/events"}, status_code=202)
+
+
+async def get_job(request):
+    job = await asyncio.to_thread(service.jobs.get, request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return JSONResponse(job)
+
+
+async def job_events(request):
+    job_id = request.path_params["job_id"]
+    if await asyncio.to_thread(service.jobs.get, job_id) is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return StreamingResponse(service.events(job_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+async def healthz(request):
+    return JSONResponse({"status": "ok", "pid": os.getpid()})
+
+
+async def metrics(request):
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # One agent graph and model client per worker process, built once it starts
+    global service
+    service = AgentService()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/healthz", healthz),
+        Route("/metrics", metrics),
+        *(Route(path, run_entry_point, methods=["POST"]) for path in ENTRY_POINTS),
+        Route("/jobs/{kind}", submit_job, methods=["POST"]),
+        Route("/jobs/{job_id}", get_job),
+        Route("/jobs/{job_id}/events", job_events),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the agent entry points over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--offline", action="store_true", help="use the scripted offline models")
+    args = parser.parse_args()
+    if args.offline:
+        os.environ["AGENT_SERVICE_OFFLINE"] = "1"
+    uvicorn.run("agent_service:app", host=args.host, port=args.port, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
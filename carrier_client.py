@@ -0,0 +1,292 @@
+# 物流承运商查询
+#
+# get_tracking_info 需要向承运商 API 查询实时物流；热门订单常常被同时查询很多次。
+# 本模块提供：
+#   - CarrierClient：异步承运商客户端接口，附带本地桩实现（StubCarrierClient）和
+#     基于 httpx 的 HTTP 实现（HttpCarrierClient，连接池有上限）
+#   - TrackingService：放在客户端前面的缓存层
+#       * TTL 缓存：新鲜结果直接返回
+#       * 单飞合并：同一运单号的并发查询共享一次对外请求
+#       * 过期重验证（stale-while-revalidate）：结果过期但仍在 stale 窗口内时，
+#         先返回旧结果，同时在后台刷新；刷新失败时也用旧结果兜底
+#       * 每个承运商独立的超时和并发上限
+#     缓存是进程内共享的 LRU，有条目上限；客户端（HTTP 连接池）、并发信号量和
+#     进行中的查询都绑定在事件循环上，按运行中的事件循环在首次使用时创建，
+#     随事件循环一起回收
+#
+# 配置（环境变量）：
+#   CARRIER_CACHE_TTL        新鲜期，秒（默认 60）
+#   CARRIER_CACHE_SIZE       缓存的运单数上限（默认 10000）
+#   CARRIER_STALE_TTL        过期后仍可返回旧结果的时间，秒（默认 600）
+#   CARRIER_TIMEOUT          默认超时，秒（默认 3）
+#   CARRIER_TIMEOUTS         各承运商超时，'{"sf": 2, "yto": 5}'
+#   CARRIER_MAX_CONNECTIONS  每个承运商的并发请求上限（默认 10）
+#   CARRIER_API_BASE_URL     设置后使用 HTTP 客户端，否则使用本地桩
+#   CARRIER_STUB_LATENCY     本地桩的模拟延迟，秒（默认 0.05）
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import httpx
+
+# 运单号前缀 -> (承运商代码, 名称)
+CARRIER_PREFIXES = {
+    "SF": ("sf", "顺丰速运"),
+    "YT": ("yto", "圆通速递"),
+    "ZT": ("zto", "中通快递"),
+    "JD": ("jd", "京东物流"),
+    "EMS": ("ems", "中国邮政EMS"),
+}
+DEFAULT_CARRIER = ("other", "其他快递")
+
+
+def carrier_for(tracking_number):
+    """按运单号前缀识别承运商：(代码, 名称)"""
+    for prefix in sorted(CARRIER_PREFIXES, key=len, reverse=True):
+        if tracking_number.upper().startswith(prefix):
+            return CARRIER_PREFIXES[prefix]
+    return DEFAULT_CARRIER
+
+
+class TrackingInfo:
+    """一次物流查询结果"""
+
+    def __init__(self, tracking_number, carrier, status, location=None, updated_at=None, events=()):
+        self.tracking_number = tracking_number
+        self.carrier = carrier
+        self.status = status
+        self.location = location
+        self.updated_at = updated_at
+        self.events = list(events)
+        # 是否为过期后兜底返回的旧结果
+        self.stale = False
+
+    def describe(self):
+        text = f"承运商: {self.carrier}，状态: {self.status}"
+        if self.location:
+            text += f"，当前位置: {self.location}"
+        if self.updated_at:
+            text += f"，更新时间: {self.updated_at}"
+        if self.stale:
+            text += "（实时信息暂不可用，显示的是最近一次查询结果）"
+        return text
+
+
+class CarrierError(Exception):
+    """承运商查询失败"""
+
+
+class CarrierClient(ABC):
+    """承运商客户端接口"""
+
+    code = None
+    name = None
+
+    @abstractmethod
+    async def fetch(self, tracking_number):
+        """查询一个运单，返回 TrackingInfo"""
+
+    async def aclose(self):
+        pass
+
+
+class StubCarrierClient(CarrierClient):
+    """本地桩：按运单号确定性地生成物流状态，并模拟网络延迟"""
+
+    STATUSES = [("已揽收", "始发网点"), ("运输中", "上海转运中心"), ("运输中", "北京转运中心"), ("派送中", "派送网点"), ("已签收", "收件地址")]
+
+    def __init__(self, code, name, latency=0.05):
+        self.code = code
+        self.name = name
+        self.latency = latency
+        self.calls = 0
+
+    async def fetch(self, tracking_number):
+        self.calls += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        stage = int(hashlib.md5(tracking_number.encode("utf-8")).hexdigest(), 16) % len(self.STATUSES)
+        events = [{"status": status, "location": location} for status, location in self.STATUSES[:stage + 1]]
+        status, location = self.STATUSES[stage]
+        return TrackingInfo(tracking_number, self.name, status, location, time.strftime("%Y-%m-%d %H:%M"), events)
+
+
+class HttpCarrierClient(CarrierClient):
+    """通过 HTTP 查询承运商：GET {base_url}/tracking/{运单号}?carrier={代码}，连接池有上限"""
+
+    def __init__(self, code, name, base_url, max_connections=10, api_key=None):
+        self.code = code
+        self.name = name
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def fetch(self, tracking_number):
+        try:
+            response = await self.client.get(f"/tracking/{tracking_number}", params={"carrier": self.code})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise CarrierError(f"{self.name} 查询失败: {e}") from e
+        data = response.json()
+        return TrackingInfo(tracking_number, self.name, data.get("status", "未知"), data.get("location"),
+                            data.get("updated_at"), data.get("events", ()))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class _LoopScope:
+    """一个事件循环内的承运商客户端、并发信号量和进行中的查询"""
+
+    def __init__(self, clients, max_concurrency):
+        self.clients = clients
+        self.max_concurrency = max_concurrency
+        self.limits = {}
+        self.inflight = {}
+
+    def limit(self, code):
+        if code not in self.limits:
+            self.limits[code] = asyncio.Semaphore(self.max_concurrency)
+        return self.limits[code]
+
+
+class TrackingService:
+    """承运商客户端前的 TTL 缓存 + 单飞合并 + 过期重验证
+
+    `clients` 是 {承运商代码: CarrierClient}，或者返回这样一个字典的函数；
+    客户端绑定事件循环时（如 HttpCarrierClient）应传函数，每个事件循环各建一套。
+    """
+
+    def __init__(self, clients, ttl=60.0, stale_ttl=600.0, timeout=3.0, timeouts=None, max_concurrency=10,
+                 cache_size=10000):
+        self._make_clients = clients if callable(clients) else (lambda: dict(clients))
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.max_concurrency = max_concurrency
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # 事件循环 -> _LoopScope；弱引用，事件循环被回收时一并清除
+        self._scopes = weakref.WeakKeyDictionary()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0, "fetches": 0, "errors": 0,
+                      "evictions": 0}
+
+    @classmethod
+    def from_env(cls):
+        max_connections = int(os.environ.get("CARRIER_MAX_CONNECTIONS", 10))
+        base_url = os.environ.get("CARRIER_API_BASE_URL")
+        carriers = list(CARRIER_PREFIXES.values()) + [DEFAULT_CARRIER]
+
+        def make_clients():
+            if base_url:
+                return {code: HttpCarrierClient(code, name, base_url, max_connections, os.environ.get("CARRIER_API_KEY"))
+                        for code, name in carriers}
+            return {code: StubCarrierClient(code, name, float(os.environ.get("CARRIER_STUB_LATENCY", 0.05)))
+                    for code, name in carriers}
+
+        timeouts = json.loads(os.environ["CARRIER_TIMEOUTS"]) if os.environ.get("CARRIER_TIMEOUTS") else {}
+        return cls(make_clients,
+                   ttl=float(os.environ.get("CARRIER_CACHE_TTL", 60)),
+                   stale_ttl=float(os.environ.get("CARRIER_STALE_TTL", 600)),
+                   timeout=float(os.environ.get("CARRIER_TIMEOUT", 3)),
+                   timeouts=timeouts,
+                   max_concurrency=max_connections,
+                   cache_size=int(os.environ.get("CARRIER_CACHE_SIZE", 10000)))
+
+    def _scope(self):
+        """当前事件循环的 _LoopScope，首次使用时创建"""
+        loop = asyncio.get_running_loop()
+        scope = self._scopes.get(loop)
+        if scope is None:
+            scope = self._scopes[loop] = _LoopScope(self._make_clients(), self.max_concurrency)
+        return scope
+
+    def _cached(self, tracking_number):
+        with self._cache_lock:
+            cached = self._cache.get(tracking_number)
+            if cached is not None:
+                self._cache.move_to_end(tracking_number)
+            return cached
+
+    def _store(self, tracking_number, info):
+        with self._cache_lock:
+            self._cache[tracking_number] = (info, time.monotonic())
+            self._cache.move_to_end(tracking_number)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    async def _fetch(self, scope, tracking_number):
+        code, _ = carrier_for(tracking_number)
+        client = scope.clients.get(code) or scope.clients[DEFAULT_CARRIER[0]]
+        async with scope.limit(code):
+            self.stats["fetches"] += 1
+            try:
+                info = await asyncio.wait_for(client.fetch(tracking_number), self.timeouts.get(code, self.timeout))
+            except asyncio.TimeoutError:
+                raise CarrierError(f"{client.name} 查询超时")
+        self._store(tracking_number, info)
+        return info
+
+    def _single_flight(self, tracking_number):
+        """同一运单号在同一事件循环里只有一个进行中的查询，其余调用共享它的结果"""
+        scope = self._scope()
+        task = scope.inflight.get(tracking_number)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return task
+        task = asyncio.ensure_future(self._fetch(scope, tracking_number))
+        scope.inflight[tracking_number] = task
+
+        def done(finished):
+            scope.inflight.pop(tracking_number, None)
+            if not finished.cancelled() and finished.exception() is not None:
+                self.stats["errors"] += 1
+
+        task.add_done_callback(done)
+        return task
+
+    async def get(self, tracking_number):
+        """查询运单；新鲜缓存直接返回，过期缓存先返回并在后台刷新，查询失败时用旧结果兜底"""
+        cached = self._cached(tracking_number)
+        age = time.monotonic() - cached[1] if cached is not None else None
+        if cached is not None and age <= self.ttl:
+            self.stats["hits"] += 1
+            return cached[0]
+        if cached is not None and age <= self.ttl + self.stale_ttl:
+            self.stats["stale_hits"] += 1
+            self._single_flight(tracking_number)
+            return cached[0]
+        self.stats["misses"] += 1
+        try:
+            # shield：某个调用方被取消时，不影响共享同一查询的其他调用方
+            return await asyncio.shield(self._single_flight(tracking_number))
+        except CarrierError:
+            if cached is None:
+                raise
+            stale = TrackingInfo(**{key: value for key, value in vars(cached[0]).items() if key != "stale"})
+            stale.stale = True
+            return stale
+
+    async def aclose(self):
+        """关闭当前事件循环的客户端"""
+        scope = self._scopes.pop(asyncio.get_running_loop(), None)
+        if scope is not None:
+            for client in scope.clients.values():
+                await client.aclose()
+
+
+def create_tracking_service():
+    """按 CARRIER_* 环境变量创建物流查询服务"""
+    return TrackingService.from_env()
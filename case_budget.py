@@ -0,0 +1,446 @@
+# Per-Case Budget
+#
+# Bounds what a single support case may spend: model calls, input and output
+# tokens, estimated cost and wall time. Every agent run of a case goes through
+# CaseBudget.wrap_step, which
+#   - reserves the run's turns out of the model calls that remain, so runs in
+#     flight at the same time can never take more calls than are left,
+#   - bounds it by the remaining wall time, and
+#   - makes the budget current for the model calls of the run.
+# Every model call then passes the BudgetedModel layer (enable_case_budgets),
+# which checks the call's own input and its output cap against what is left
+# before it is sent, lowers the call's max_tokens to the output tokens that
+# remain, and counts it as one of the case's model calls. The tokens and cost
+# are charged by the MeteredModel layer (enable_budget_metering), which sits
+# beneath the resilience layer so that every request actually sent is paid
+# for: retries, attempts that timed out and hedges that lost as well as the
+# response that won. A completed attempt is charged its actual usage, one that
+# was cancelled after it was sent its input tokens, and one that failed
+# nothing. Usage is priced at the model that answered (the agent handed off
+# to, not the one the run started with). Without the metering layer the
+# BudgetedModel layer charges the usage of the response it returns.
+# When the budget runs out a BudgetExceeded is raised; the case handlers catch
+# it and degrade to the best answer produced so far.
+import asyncio
+import contextvars
+import dataclasses
+import json
+import os
+import time
+
+from agents import MaxTurnsExceeded
+from openai.types.responses import ResponseCompletedEvent
+
+from context_compaction import count_tokens
+from model_wrappers import WrappedModel, model_name, usage_from_response, wrap_agent_models
+
+DEFAULT_MAX_TURNS = 10
+DEFAULT_MODEL = "gpt-4o"
+# Output tokens one model call may produce unless its model settings ask for fewer
+DEFAULT_MAX_OUTPUT_TOKENS_PER_CALL = 4096
+
+# USD per million (input, output) tokens
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+# Complex-case steps whose output can stand in for the final answer, best first
+ANSWER_PREFERENCE = (10, 1, 7, 4, 6, 3, 5, 2)
+
+# Turn cap of the agent run being started by the current task
+current_max_turns = contextvars.ContextVar("current_max_turns", default=DEFAULT_MAX_TURNS)
+# Budget and run reservation the model calls of the current task are checked against
+current_budget = contextvars.ContextVar("current_budget", default=None)
+current_reservation = contextvars.ContextVar("current_reservation", default=None)
+# Meter the attempts of the budgeted model call in progress are charged to
+current_meter = contextvars.ContextVar("current_meter", default=None)
+
+
+def max_turns():
+    """max_turns for the Runner.run about to start"""
+    return current_max_turns.get()
+
+
+def estimate_cost(model, input_tokens, output_tokens):
+    input_price, output_price = MODEL_PRICES.get(model, MODEL_PRICES[DEFAULT_MODEL])
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def _env_number(name, cast):
+    value = os.environ.get(name)
+    return cast(value) if value not in (None, "") else None
+
+
+class BudgetExceeded(Exception):
+    """A case ran out of model calls, tokens, cost or time"""
+
+
+class DegradedResult:
+    """Stands in for a run result when a case ran out of budget before any answer was produced"""
+
+    def __init__(self, final_output, reason, budget):
+        self.final_output = final_output
+        self.new_items = []
+        self.all_handoffs = []
+        self.budget_exhausted = True
+        self.budget_reason = reason
+        self.budget = budget
+
+
+class RunReservation:
+    """Turns reserved for one agent run and the model calls it has been charged for"""
+
+    def __init__(self, turns):
+        self.turns = turns
+        self.calls = 0
+
+
+class CaseBudget:
+    """Limits for one case; None means unlimited"""
+
+    def __init__(self, max_model_calls=40, max_input_tokens=200_000, max_output_tokens=40_000,
+                 max_wall_seconds=300.0, max_cost=None, max_turns_per_run=DEFAULT_MAX_TURNS,
+                 max_output_tokens_per_call=DEFAULT_MAX_OUTPUT_TOKENS_PER_CALL):
+        self.max_model_calls = max_model_calls
+        self.max_input_tokens = max_input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.max_wall_seconds = max_wall_seconds
+        self.max_cost = max_cost
+        self.max_turns_per_run = max_turns_per_run
+        self.max_output_tokens_per_call = max_output_tokens_per_call
+        self.started_at = time.perf_counter()
+        self.model_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+        self.exhausted = None
+        self.completed_steps = {}
+        # Turns reserved by runs in flight and not used yet, and what calls in flight may still spend,
+        # so concurrent runs and calls cannot all be admitted into the same headroom
+        self._reserved_turns = 0
+        self._reserved_input = 0
+        self._reserved_output = 0
+        self._reserved_cost = 0.0
+        self._turns_released = asyncio.Event()
+
+    @classmethod
+    def from_env(cls):
+        """Limits from CASE_MAX_MODEL_CALLS, CASE_MAX_INPUT_TOKENS, CASE_MAX_OUTPUT_TOKENS,
+        CASE_MAX_WALL_SECONDS, CASE_MAX_COST_USD, CASE_MAX_TURNS_PER_RUN and
+        CASE_MAX_OUTPUT_TOKENS_PER_CALL"""
+        budget = cls()
+        overrides = {
+            "max_model_calls": _env_number("CASE_MAX_MODEL_CALLS", int),
+            "max_input_tokens": _env_number("CASE_MAX_INPUT_TOKENS", int),
+            "max_output_tokens": _env_number("CASE_MAX_OUTPUT_TOKENS", int),
+            "max_wall_seconds": _env_number("CASE_MAX_WALL_SECONDS", float),
+            "max_cost": _env_number("CASE_MAX_COST_USD", float),
+            "max_turns_per_run": _env_number("CASE_MAX_TURNS_PER_RUN", int),
+            "max_output_tokens_per_call": _env_number("CASE_MAX_OUTPUT_TOKENS_PER_CALL", int),
+        }
+        for name, value in overrides.items():
+            if value is not None:
+                setattr(budget, name, value)
+        return budget
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def remaining_seconds(self):
+        return None if self.max_wall_seconds is None else self.max_wall_seconds - self.elapsed
+
+    def _exceed(self, reason):
+        self.exhausted = self.exhausted or reason
+        raise BudgetExceeded(reason)
+
+    def _check_open(self):
+        if self.exhausted:
+            raise BudgetExceeded(self.exhausted)
+        remaining = self.remaining_seconds()
+        if remaining is not None and remaining <= 0:
+            self._exceed(f"wall time limit of {self.max_wall_seconds}s reached")
+
+    async def admit(self):
+        """Reserve the turns of a run before it starts; returns its RunReservation.
+
+        While runs in flight hold the turns a new run may need, it waits for
+        them to give back what they did not use instead of starting short.
+        """
+        while True:
+            self._check_open()
+            if self.max_output_tokens is not None and self.output_tokens >= self.max_output_tokens:
+                self._exceed(f"output token limit of {self.max_output_tokens} reached")
+            turns = self.max_turns_per_run
+            if self.max_model_calls is not None:
+                available = self.max_model_calls - self.model_calls - self._reserved_turns
+                if available < turns and self._reserved_turns > 0:
+                    try:
+                        await asyncio.wait_for(self._turns_released.wait(), self.remaining_seconds())
+                    except asyncio.TimeoutError:
+                        self._exceed(f"wall time limit of {self.max_wall_seconds}s reached")
+                    continue
+                turns = min(turns, available)
+                if turns < 1:
+                    self._exceed(f"model call limit of {self.max_model_calls} reached")
+            self._reserved_turns += turns
+            return RunReservation(turns)
+
+    def release(self, run):
+        """Give back the turns a finished run did not use and wake the runs waiting for them"""
+        self._reserved_turns -= max(0, run.turns - run.calls)
+        released, self._turns_released = self._turns_released, asyncio.Event()
+        released.set()
+
+    def admit_call(self, model, system_instructions, input, model_settings):
+        """Check one model call against what is left before it is sent.
+
+        Returns the reservation to pass to settle_call and the model settings
+        to send, with max_tokens lowered to the output tokens that remain.
+        """
+        self._check_open()
+        text = input if isinstance(input, str) else json.dumps(input, default=str, ensure_ascii=False)
+        input_tokens = count_tokens(system_instructions or "") + count_tokens(text)
+        if self.max_input_tokens is not None and self.input_tokens + self._reserved_input + input_tokens > self.max_input_tokens:
+            self._exceed(f"input token limit of {self.max_input_tokens} would be exceeded")
+        max_tokens = getattr(model_settings, "max_tokens", None) or self.max_output_tokens_per_call
+        if self.max_output_tokens is not None:
+            max_tokens = min(max_tokens, self.max_output_tokens - self.output_tokens - self._reserved_output)
+            if max_tokens <= 0:
+                self._exceed(f"output token limit of {self.max_output_tokens} reached")
+        cost = estimate_cost(model, input_tokens, max_tokens)
+        if self.max_cost is not None and self.cost + self._reserved_cost + cost > self.max_cost:
+            self._exceed(f"cost limit of ${self.max_cost:.4f} would be exceeded")
+        self._reserved_input += input_tokens
+        self._reserved_output += max_tokens
+        self._reserved_cost += cost
+        if model_settings is not None and getattr(model_settings, "max_tokens", None) != max_tokens:
+            model_settings = dataclasses.replace(model_settings, max_tokens=max_tokens)
+        return (input_tokens, max_tokens, cost), model_settings
+
+    def settle_call(self, model, reservation, usage, meter=None):
+        """Release a call's reservation and count it (usage is None if it failed)
+
+        Its tokens are charged here only when no attempt of it was metered.
+        """
+        input_tokens, max_tokens, cost = reservation
+        self._reserved_input -= input_tokens
+        self._reserved_output -= max_tokens
+        self._reserved_cost -= cost
+        if usage is None:
+            return
+        if meter is None or not meter.attempts:
+            self._charge_tokens(model, usage.input_tokens, usage.output_tokens)
+        self._count_call()
+
+    def _charge(self, model, input_tokens, output_tokens):
+        self._charge_tokens(model, input_tokens, output_tokens)
+        self._count_call()
+
+    def _charge_tokens(self, model, input_tokens, output_tokens):
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cost += estimate_cost(model, input_tokens, output_tokens)
+
+    def _count_call(self):
+        self.model_calls += 1
+        run = current_reservation.get()
+        if run is not None:
+            run.calls += 1
+            if run.calls <= run.turns:
+                self._reserved_turns -= 1
+
+    def charge_unmetered(self, agent, result, run):
+        """Charge responses of a run that no BudgetedModel saw, at the model of the agent it started with"""
+        model = model_name(agent.model) if agent.model is not None else DEFAULT_MODEL
+        for response in list(getattr(result, "raw_responses", None) or ())[run.calls:]:
+            self._charge(model, response.usage.input_tokens, response.usage.output_tokens)
+
+    def wrap_step(self, run_step):
+        """Wrap a handle_complex_case `run_step` so every run is admitted, capped and charged"""
+        async def run(step, title, agent, prompt, label):
+            reservation = await self.admit()
+            tokens = (current_max_turns.set(reservation.turns), current_budget.set(self), current_reservation.set(reservation))
+            try:
+                # The step runs as its own task, so a TimeoutError raised inside it (a model call out
+                # of attempts, say) is told apart from the case running out of wall time
+                task = asyncio.ensure_future(run_step(step, title, agent, prompt, label))
+                try:
+                    done, _ = await asyncio.wait({task}, timeout=self.remaining_seconds())
+                finally:
+                    if not task.done():
+                        task.cancel()
+                        await asyncio.gather(task, return_exceptions=True)
+                if not done:
+                    self._exceed(f"wall time limit of {self.max_wall_seconds}s reached during step {step}")
+                try:
+                    result = task.result()
+                except MaxTurnsExceeded:
+                    self._exceed(f"turn limit reached during step {step}")
+                self.charge_unmetered(agent, result, reservation)
+            finally:
+                for var, token in zip((current_max_turns, current_budget, current_reservation), tokens):
+                    var.reset(token)
+                self.release(reservation)
+            self.completed_steps[step] = result
+            return result
+        return run
+
+    def best_result(self, preference=ANSWER_PREFERENCE):
+        for step in preference:
+            if step in self.completed_steps:
+                return self.completed_steps[step]
+        return None
+
+    def degraded_result(self, reason, preference=ANSWER_PREFERENCE):
+        """The best answer so far, marked as cut short, or a DegradedResult when there is none"""
+        result = self.best_result(preference)
+        if result is None:
+            return DegradedResult(
+                "We could not finish handling this case within its processing budget. "
+                "An engineer will follow up with you shortly.",
+                reason, self.summary())
+        result.budget_exhausted = True
+        result.budget_reason = reason
+        result.budget = self.summary()
+        return result
+
+    def summary(self):
+        return {
+            "model_calls": self.model_calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost, 6),
+            "wall_seconds": round(self.elapsed, 3),
+            "exhausted": self.exhausted,
+            "limits": {
+                "max_model_calls": self.max_model_calls,
+                "max_input_tokens": self.max_input_tokens,
+                "max_output_tokens": self.max_output_tokens,
+                "max_wall_seconds": self.max_wall_seconds,
+                "max_cost_usd": self.max_cost,
+                "max_turns_per_run": self.max_turns_per_run,
+                "max_output_tokens_per_call": self.max_output_tokens_per_call,
+            },
+        }
+
+
+class CallMeter:
+    """Charges the attempts of one budgeted model call to its case budget"""
+
+    def __init__(self, budget, model, input_tokens):
+        self.budget = budget
+        self.model = model
+        self.input_tokens = input_tokens
+        self.attempts = 0
+
+    def charge(self, usage):
+        """Charge one attempt: its usage, or its input tokens if it was sent but never answered"""
+        self.attempts += 1
+        if usage is None:
+            self.budget._charge_tokens(self.model, self.input_tokens, 0)
+        else:
+            self.budget._charge_tokens(self.model, usage.input_tokens, usage.output_tokens)
+
+
+class BudgetedModel(WrappedModel):
+    """Checks every call against the budget of the case being handled and counts it"""
+
+    async def get_response(self, system_instructions, input, model_settings, *args, **kwargs):
+        budget = current_budget.get()
+        if budget is None:
+            return await self.inner.get_response(system_instructions, input, model_settings, *args, **kwargs)
+        model = self.model_name
+        reservation, model_settings = budget.admit_call(model, system_instructions, input, model_settings)
+        meter = CallMeter(budget, model, reservation[0])
+        token = current_meter.set(meter)
+        usage = None
+        try:
+            response = await self.inner.get_response(system_instructions, input, model_settings, *args, **kwargs)
+            usage = response.usage
+            return response
+        finally:
+            current_meter.reset(token)
+            budget.settle_call(model, reservation, usage, meter)
+
+    async def stream_response(self, system_instructions, input, model_settings, *args, **kwargs):
+        budget = current_budget.get()
+        if budget is None:
+            async for event in self.inner.stream_response(system_instructions, input, model_settings, *args, **kwargs):
+                yield event
+            return
+        model = self.model_name
+        reservation, model_settings = budget.admit_call(model, system_instructions, input, model_settings)
+        meter = CallMeter(budget, model, reservation[0])
+        # The inner stream is started, and its attempts take their meter, on the first iteration
+        stream = self.inner.stream_response(system_instructions, input, model_settings, *args, **kwargs)
+        usage = None
+        try:
+            while True:
+                token = current_meter.set(meter)
+                try:
+                    event = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    current_meter.reset(token)
+                if isinstance(event, ResponseCompletedEvent):
+                    usage = usage_from_response(event.response)
+                yield event
+        finally:
+            await stream.aclose()
+            budget.settle_call(model, reservation, usage, meter)
+
+
+class MeteredModel(WrappedModel):
+    """Charges every request sent by the wrapped model to the budgeted call it belongs to"""
+
+    async def get_response(self, *args, **kwargs):
+        meter = current_meter.get()
+        if meter is None:
+            return await self.inner.get_response(*args, **kwargs)
+        try:
+            response = await self.inner.get_response(*args, **kwargs)
+        except asyncio.CancelledError:
+            # Cancelled after it was sent, such as a hedge that lost or an attempt that timed out
+            meter.charge(None)
+            raise
+        meter.charge(response.usage)
+        return response
+
+    async def stream_response(self, *args, **kwargs):
+        meter = current_meter.get()
+        if meter is None:
+            async for event in self.inner.stream_response(*args, **kwargs):
+                yield event
+            return
+        usage = None
+        charged = False
+        try:
+            async for event in self.inner.stream_response(*args, **kwargs):
+                if isinstance(event, ResponseCompletedEvent):
+                    usage = usage_from_response(event.response)
+                    meter.charge(usage)
+                    charged = True
+                yield event
+        except Exception:
+            charged = True
+            raise
+        finally:
+            # Closed or cancelled before it completed: the request was sent all the same
+            if not charged:
+                meter.charge(None)
+
+
+def enable_case_budgets(agents, provider=None):
+    """Check and count every model call of `agents` against the budget of the case being handled"""
+    return wrap_agent_models(agents, lambda inner, agent: BudgetedModel(inner, agent.name), BudgetedModel, provider)
+
+
+def enable_budget_metering(agents, provider=None):
+    """Charge every request `agents` send to the case budget; install beneath the resilience layer"""
+    return wrap_agent_models(agents, lambda inner, agent: MeteredModel(inner, agent.name), MeteredModel, provider)
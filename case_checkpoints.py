@@ -0,0 +1,164 @@
+# Case Checkpoints
+#
+# Persists the output and trace items of every completed workflow step, keyed
+# by case ID and step, so a complex case that fails part-way (for example on a
+# transient API error in step 9) resumes from its first incomplete step instead
+# of paying for every model call again. Checkpoints of a case are dropped once
+# it completes.
+#
+# Checkpoints belong to one run definition: the playbook, case details and
+# customer query are hashed into a run key, and a changed query starts over.
+import hashlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from storage import connect_sqlite, data_path
+
+
+def run_key(playbook_name, case_details, customer_query=None):
+    """Identifies the inputs a set of checkpoints was produced from"""
+    payload = json.dumps([playbook_name, case_details, customer_query or ""], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def handoff_records(result):
+    """The handoffs of a run result as plain dicts (the form the UI and checkpoints share)"""
+    records = list(getattr(result, "handoff_records", None) or ())
+    for item in getattr(result, "new_items", None) or ():
+        if item.type == "handoff_output_item":
+            records.append({
+                "source_agent": {"name": item.source_agent.name},
+                "target_agent": {"name": item.target_agent.name},
+                "tool_name": getattr(item, "tool_name", None)
+            })
+    return records
+
+
+class CheckpointedResult:
+    """A completed step restored from a checkpoint, standing in for its run result"""
+
+    def __init__(self, final_output, handoffs, trace):
+        self.final_output = final_output
+        self.new_items = []
+        self.raw_responses = []
+        self.handoff_records = handoffs
+        self.trace = trace
+        self.restored = True
+
+
+class CheckpointStore(ABC):
+    """Interface shared by the checkpoint store implementations"""
+
+    @abstractmethod
+    def load(self, case_id, key):
+        """{step_id: CheckpointedResult} saved for a case under run key `key`"""
+
+    @abstractmethod
+    def save(self, case_id, key, step_id, final_output, handoffs, trace):
+        """Store the result of a completed step"""
+
+    @abstractmethod
+    def clear(self, case_id):
+        """Drop every checkpoint of a case"""
+
+
+class InMemoryCheckpointStore(CheckpointStore):
+    """Checkpoints for retries within one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checkpoints = {}
+
+    def load(self, case_id, key):
+        with self._lock:
+            saved = self._checkpoints.get((case_id, key), {})
+            return {step_id: CheckpointedResult(*entry) for step_id, entry in saved.items()}
+
+    def save(self, case_id, key, step_id, final_output, handoffs, trace):
+        with self._lock:
+            self._checkpoints.setdefault((case_id, key), {})[step_id] = (final_output, list(handoffs), dict(trace))
+
+    def clear(self, case_id):
+        with self._lock:
+            for stored in [stored for stored in self._checkpoints if stored[0] == case_id]:
+                del self._checkpoints[stored]
+
+
+class SQLiteCheckpointStore(CheckpointStore):
+    """Durable checkpoints that survive a restart; one connection per thread"""
+
+    def __init__(self, path=None):
+        self.path = path or data_path("checkpoints.sqlite3")
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS step_checkpoints (
+                case_id TEXT NOT NULL,
+                run_key TEXT NOT NULL,
+                step_id TEXT NOT NULL,
+                final_output TEXT NOT NULL,
+                handoffs TEXT NOT NULL,
+                trace TEXT NOT NULL,
+                saved_at TEXT NOT NULL,
+                PRIMARY KEY (case_id, run_key, step_id)
+            )
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def load(self, case_id, key):
+        rows = self._conn().execute(
+            "SELECT step_id, final_output, handoffs, trace FROM step_checkpoints WHERE case_id = ? AND run_key = ?",
+            (case_id, key),
+        ).fetchall()
+        return {step_id: CheckpointedResult(json.loads(output), json.loads(handoffs), json.loads(trace))
+                for step_id, output, handoffs, trace in rows}
+
+    def save(self, case_id, key, step_id, final_output, handoffs, trace):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO step_checkpoints (case_id, run_key, step_id, final_output, handoffs, trace, saved_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (case_id, key, step_id, json.dumps(final_output, ensure_ascii=False), json.dumps(handoffs, ensure_ascii=False),
+             json.dumps(trace, ensure_ascii=False), datetime.now().isoformat()),
+        )
+
+    def clear(self, case_id):
+        self._conn().execute("DELETE FROM step_checkpoints WHERE case_id = ?", (case_id,))
+
+
+class CaseCheckpoint:
+    """The checkpoints of one case run, as used by run_workflow"""
+
+    def __init__(self, store, case_id, key):
+        self.store = store
+        self.case_id = case_id
+        self.key = key
+        self.restored = store.load(case_id, key)
+
+    def get(self, step_id):
+        return self.restored.get(step_id)
+
+    def put(self, step, result, trace):
+        output = result.final_output
+        if not isinstance(output, (str, int, float, bool, type(None))):
+            output = str(output)
+        self.store.save(self.case_id, self.key, step.id, output, handoff_records(result), trace)
+
+    def clear(self):
+        self.store.clear(self.case_id)
+
+
+def create_checkpoint_store():
+    """Store selected by CHECKPOINT_STORE ("sqlite", the default, at CHECKPOINT_STORE_PATH, or "memory" for tests)"""
+    kind = os.environ.get("CHECKPOINT_STORE", "sqlite").lower()
+    if kind == "sqlite":
+        return SQLiteCheckpointStore(os.environ.get("CHECKPOINT_STORE_PATH"))
+    if kind == "memory":
+        return InMemoryCheckpointStore()
+    raise ValueError(f"Unknown CHECKPOINT_STORE '{kind}', expected 'sqlite' or 'memory'")
@@ -0,0 +1,311 @@
+# Support Case Intake
+#
+# A durable priority queue of support cases and a worker pool that drains it,
+# so cases can be fed continuously instead of being handled ad hoc.
+#
+# Cases are queued in SQLite with a priority derived from the case itself:
+# urgency wording ("blocking our business operations", "outage", "urgent")
+# and enterprise products raise it, so urgent cases overtake bulk ones.
+# Workers lease the most urgent case for a visibility timeout and keep the
+# lease alive while they work on it; a case whose worker crashed becomes
+# visible again once its lease expires. Workers only lease when they are idle,
+# and the queue refuses new cases beyond `max_depth`, so a backlog never piles
+# up in memory. Results are written back to the case record.
+#
+#   python case_intake.py enqueue CASE004 "This is blocking our business operations"
+#   python case_intake.py work --workers 4
+#   python case_intake.py stats
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import threading
+import time
+from datetime import datetime
+
+from storage import connect_sqlite, data_path
+from support_agents import case_store, handle_support_case
+
+# Wording that marks a case as urgent, with the priority it adds
+URGENCY_PATTERNS = [
+    (re.compile(r"blocking (?:our|the) (?:business|operations|production)|business operations", re.IGNORECASE), 50),
+    (re.compile(r"\b(?:outage|down for|production (?:is )?down|data loss|security)\b", re.IGNORECASE), 40),
+    (re.compile(r"\b(?:urgent|urgently|asap|critical|immediately|emergency)\b", re.IGNORECASE), 30),
+    (re.compile(r"\b(?:all (?:users|customers)|every (?:user|customer)|cannot|can't|unable to)\b", re.IGNORECASE), 10),
+]
+ENTERPRISE_PRIORITY = 20
+
+
+class QueueFull(Exception):
+    """The intake queue already holds `max_depth` waiting cases"""
+
+
+def case_priority(case, query=None):
+    """Priority of a case record (higher is served first) from its wording and product"""
+    text = " ".join(str(part) for part in (case.get("title"), case.get("description"), query) if part)
+    priority = sum(weight for pattern, weight in URGENCY_PATTERNS if pattern.search(text))
+    if "enterprise" in str(case.get("product", "")).lower():
+        priority += ENTERPRISE_PRIORITY
+    return priority
+
+
+class IntakeItem:
+    """A leased queue entry"""
+
+    def __init__(self, id, case_id, query, priority, attempts, leased_by=None):
+        self.id = id
+        self.case_id = case_id
+        self.query = query
+        self.priority = priority
+        self.attempts = attempts
+        self.leased_by = leased_by
+
+    def __repr__(self):
+        return f"IntakeItem({self.id}, {self.case_id}, priority={self.priority}, attempt={self.attempts})"
+
+
+class IntakeQueue:
+    """SQLite-backed priority queue with leases.
+
+    A leased item stays invisible to other workers for `visibility_timeout`
+    seconds unless its lease is extended. Items whose lease expired are leased
+    again, up to `max_attempts` times in total; after that they are failed.
+    """
+
+    def __init__(self, path=None, visibility_timeout=300.0, max_attempts=3, max_depth=10000):
+        self.path = path or data_path("intake.sqlite3")
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(self.path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS intake_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                case_id TEXT NOT NULL,
+                query TEXT,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                leased_by TEXT,
+                lease_expires_at REAL,
+                enqueued_at REAL NOT NULL,
+                finished_at REAL,
+                result TEXT,
+                error TEXT
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_intake_ready ON intake_queue (status, priority DESC, id)")
+
+    def enqueue(self, case_id, query=None, priority=0):
+        """Queue a case; returns its item ID. Raises QueueFull when `max_depth` cases are waiting"""
+        with self._lock:
+            waiting = self._conn.execute("SELECT COUNT(*) FROM intake_queue WHERE status = 'queued'").fetchone()[0]
+            if waiting >= self.max_depth:
+                raise QueueFull(f"Intake queue is full ({waiting} cases waiting)")
+            cursor = self._conn.execute(
+                "INSERT INTO intake_queue (case_id, query, priority, status, enqueued_at) VALUES (?, ?, ?, 'queued', ?)",
+                (case_id, query, priority, time.time()),
+            )
+            return cursor.lastrowid
+
+    def lease(self, worker_id):
+        """Lease the most urgent visible item, oldest first among equals; None if there is none"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Items whose worker vanished after their last allowed attempt are given up on
+                self._conn.execute(
+                    "UPDATE intake_queue SET status = 'failed', finished_at = ?, error = ? "
+                    "WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?",
+                    (now, "lease expired on the last attempt", now, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    "SELECT id, case_id, query, priority, attempts FROM intake_queue "
+                    "WHERE status = 'queued' OR (status = 'leased' AND lease_expires_at < ?) "
+                    "ORDER BY priority DESC, id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE intake_queue SET status = 'leased', attempts = attempts + 1, leased_by = ?, "
+                        "lease_expires_at = ? WHERE id = ?",
+                        (worker_id, now + self.visibility_timeout, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        item_id, case_id, query, priority, attempts = row
+        return IntakeItem(item_id, case_id, query, priority, attempts + 1, worker_id)
+
+    def extend(self, item, worker_id):
+        """Keep a lease alive; returns False if the item was reclaimed by another worker"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE intake_queue SET lease_expires_at = ? WHERE id = ? AND status = 'leased' AND leased_by = ?",
+                (time.time() + self.visibility_timeout, item.id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, item, result):
+        """Record the result of a leased item; returns False if its lease was lost to another worker"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE intake_queue SET status = 'done', finished_at = ?, result = ?, error = NULL "
+                "WHERE id = ? AND status = 'leased' AND leased_by = ?",
+                (time.time(), json.dumps(result, ensure_ascii=False), item.id, item.leased_by),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, item, error):
+        """Record a failed attempt; the item is queued again until it has used `max_attempts`.
+
+        Returns the item's new status, or None if its lease was lost to another worker.
+        """
+        status = "queued" if item.attempts < self.max_attempts else "failed"
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE intake_queue SET status = ?, leased_by = NULL, lease_expires_at = NULL, error = ?, "
+                "finished_at = CASE WHEN ? = 'failed' THEN ? END "
+                "WHERE id = ? AND status = 'leased' AND leased_by = ?",
+                (status, str(error), status, time.time(), item.id, item.leased_by),
+            )
+        return status if cursor.rowcount == 1 else None
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM intake_queue GROUP BY status").fetchall()
+        counts = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+
+def result_summary(result):
+    """What is stored about a handled case: its answer and whether it was cut short"""
+    if result is None:
+        return {"final_output": None}
+    return {
+        "final_output": str(result.final_output),
+        "budget_exhausted": getattr(result, "budget_exhausted", False),
+    }
+
+
+def record_case_result(case_id, summary):
+    """Write a handled case's outcome back to its case record"""
+    case_store.update(case_id, status="Resolved" if summary.get("final_output") else "Needs Attention",
+                      resolution=summary.get("final_output"), resolved_at=datetime.now().isoformat())
+
+
+def enqueue_case(queue, case_id, query=None):
+    """Queue a known case with the priority derived from its record and query"""
+    priority = case_priority(case_store.get(case_id, {}), query)
+    item_id = queue.enqueue(case_id, query, priority)
+    print(f"Queued {case_id} (item {item_id}, priority {priority})")
+    return item_id
+
+
+class IntakeWorkerPool:
+    """`workers` asyncio workers that lease cases from `queue` and handle them"""
+
+    def __init__(self, queue, workers=4, handler=handle_support_case, poll_interval=1.0):
+        self.queue = queue
+        self.workers = workers
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self.processed = 0
+        self.failed = 0
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        """Let the workers finish their current case and exit"""
+        self._stopping.set()
+
+    async def _keep_leased(self, item, worker_id):
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            if not self.queue.extend(item, worker_id):
+                print(f"[{worker_id}] lost the lease on {item.case_id}")
+                return
+
+    async def _handle(self, item, worker_id):
+        keep_leased = asyncio.ensure_future(self._keep_leased(item, worker_id))
+        start = time.perf_counter()
+        try:
+            result = await self.handler(item.case_id, item.query, raise_errors=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            status = self.queue.fail(item, e)
+            if status is None:
+                print(f"[{worker_id}] {item.case_id} failed on attempt {item.attempts} after its lease was lost: {e}")
+            else:
+                print(f"[{worker_id}] {item.case_id} failed on attempt {item.attempts} ({status}): {e}")
+            return
+        finally:
+            keep_leased.cancel()
+        summary = result_summary(result)
+        if not self.queue.complete(item, summary):
+            # Another worker holds the case now and will record its own result
+            print(f"[{worker_id}] {item.case_id} finished after its lease was lost; result discarded")
+            return
+        record_case_result(item.case_id, summary)
+        self.processed += 1
+        print(f"[{worker_id}] {item.case_id} done in {time.perf_counter() - start:.2f}s (priority {item.priority})")
+
+    async def _worker(self, number, stop_when_empty):
+        worker_id = f"{self.worker_prefix}-{number}"
+        while not self._stopping.is_set():
+            item = self.queue.lease(worker_id)
+            if item is None:
+                if stop_when_empty:
+                    return
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._handle(item, worker_id)
+
+    async def run(self, stop_when_empty=False):
+        """Work until stop() is called, or until no case is left when `stop_when_empty`"""
+        await asyncio.gather(*(self._worker(number, stop_when_empty) for number in range(1, self.workers + 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queue support cases and work through them by priority")
+    parser.add_argument("--db", help="queue database (default: intake.sqlite3 in the data directory)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="queue a case")
+    enqueue.add_argument("case_id")
+    enqueue.add_argument("query", nargs="?")
+    work = commands.add_parser("work", help="handle queued cases")
+    work.add_argument("--workers", type=int, default=4)
+    work.add_argument("--visibility-timeout", type=float, default=300.0)
+    work.add_argument("--until-empty", action="store_true", help="exit once the queue is drained")
+    commands.add_parser("stats", help="show queue counts")
+    args = parser.parse_args()
+
+    queue = IntakeQueue(args.db, visibility_timeout=getattr(args, "visibility_timeout", 300.0))
+    if args.command == "enqueue":
+        try:
+            enqueue_case(queue, args.case_id, args.query)
+        except QueueFull as e:
+            print(f"Could not queue {args.case_id}: {e}")
+            raise SystemExit(1)
+    elif args.command == "work":
+        pool = IntakeWorkerPool(queue, workers=args.workers)
+        asyncio.run(pool.run(stop_when_empty=args.until_empty))
+        print(f"Processed {pool.processed} cases, {pool.failed} failed attempts")
+    else:
+        print(queue.stats())
+
+if __name__ == "__main__":
+    main()
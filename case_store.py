@@ -0,0 +1,192 @@
+# Support Case Store
+#
+# Case records in SQLite (WAL mode), shared by every process on the host and
+# kept across restarts. Cases are looked up by their primary key and listed by
+# status, product and creation date through covering indexes, with keyset
+# (cursor) pagination so deep pages cost the same as the first one.
+#
+# Every statement is a fixed, parameterized SQL string, so sqlite3's statement
+# cache prepares each one once per connection; with one connection per thread
+# a lookup is a single B-tree probe (a few microseconds at millions of cases).
+#
+# The database defaults to cases.sqlite3 in the data directory and can be
+# moved with CASE_STORE_PATH.
+import base64
+import json
+import os
+import threading
+
+from storage import connect_sqlite, data_path
+
+CASE_FIELDS = ("title", "description", "status", "customer_email", "created_at", "product", "service",
+               "resolution", "resolved_at")
+
+_COLUMNS = ", ".join(("case_id",) + CASE_FIELDS)
+_GET_SQL = f"SELECT {_COLUMNS} FROM cases WHERE case_id = ?"
+_UPSERT_SQL = (
+    f"INSERT INTO cases ({_COLUMNS}) VALUES ({', '.join('?' * (len(CASE_FIELDS) + 1))}) "
+    f"ON CONFLICT (case_id) DO UPDATE SET {', '.join(f'{field} = excluded.{field}' for field in CASE_FIELDS)}"
+)
+_INSERT_IGNORE_SQL = f"INSERT OR IGNORE INTO cases ({_COLUMNS}) VALUES ({', '.join('?' * (len(CASE_FIELDS) + 1))})"
+
+
+def _row_to_case(row):
+    return dict(zip(CASE_FIELDS, row[1:]))
+
+
+def _case_values(case_id, case):
+    return (case_id,) + tuple(case.get(field) for field in CASE_FIELDS)
+
+
+def encode_cursor(created_at, case_id):
+    return base64.urlsafe_b64encode(json.dumps([created_at, case_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    created_at, case_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return created_at, case_id
+
+
+class CaseStore:
+    """SQLite-backed case repository; each thread uses its own connection"""
+
+    def __init__(self, path=None):
+        self.path = path or data_path("cases.sqlite3")
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS cases (
+                case_id TEXT PRIMARY KEY,
+                {', '.join(f'{field} TEXT' for field in CASE_FIELDS)}
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cases_created_at ON cases (created_at, case_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cases_status ON cases (status, created_at, case_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cases_product ON cases (product, created_at, case_id)")
+        # Digest of each case's entry in the case file as last applied (see kb_snapshots.py)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS case_file_digests (
+                case_id TEXT PRIMARY KEY,
+                digest TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def get(self, case_id, default=None):
+        """The case record as a dict, or `default` if there is no such case"""
+        row = self._conn().execute(_GET_SQL, (case_id,)).fetchone()
+        return _row_to_case(row) if row is not None else default
+
+    def exists(self, case_id):
+        return self._conn().execute("SELECT 1 FROM cases WHERE case_id = ?", (case_id,)).fetchone() is not None
+
+    def put(self, case_id, case):
+        """Create or replace a case"""
+        self._conn().execute(_UPSERT_SQL, _case_values(case_id, case))
+
+    def update(self, case_id, **fields):
+        """Change some fields of an existing case; returns False if there is no such case"""
+        unknown = set(fields) - set(CASE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown case fields: {', '.join(sorted(unknown))}")
+        if not fields:
+            return self.exists(case_id)
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        cursor = self._conn().execute(f"UPDATE cases SET {assignments} WHERE case_id = ?",
+                                      tuple(fields.values()) + (case_id,))
+        return cursor.rowcount == 1
+
+    def import_cases(self, cases, replace=True, batch_size=10000):
+        """Bulk-load (case_id, case) pairs or a {case_id: case} dict; returns the number written.
+
+        Cases are written in batches of `batch_size`, one transaction each.
+        With replace=False, cases that already exist are left as they are.
+        """
+        items = cases.items() if isinstance(cases, dict) else cases
+        sql = _UPSERT_SQL if replace else _INSERT_IGNORE_SQL
+        conn = self._conn()
+        written = 0
+        batch = []
+
+        def flush():
+            nonlocal written
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = conn.total_changes
+                conn.executemany(sql, batch)
+                written += conn.total_changes - before
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            batch.clear()
+
+        for case_id, case in items:
+            batch.append(_case_values(case_id, case))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        return written
+
+    def file_digests(self):
+        """{case_id: digest} of the case file entries applied to this store"""
+        return dict(self._conn().execute("SELECT case_id, digest FROM case_file_digests"))
+
+    def record_file_digests(self, digests):
+        """Remember the case file entries that were applied, as {case_id: digest}"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR REPLACE INTO case_file_digests (case_id, digest) VALUES (?, ?)",
+                             digests.items())
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _filters(self, status, product, created_from, created_to):
+        clauses, params = [], []
+        for clause, value in (("status = ?", status), ("product = ?", product),
+                              ("created_at >= ?", created_from), ("created_at < ?", created_to)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return clauses, params
+
+    def list_cases(self, status=None, product=None, created_from=None, created_to=None, limit=50, cursor=None):
+        """One page of cases in creation order: ([(case_id, case), ...], cursor of the next page or None).
+
+        Filters combine; `created_to` is exclusive. Pass the returned cursor
+        back to read the next page.
+        """
+        clauses, params = self._filters(status, product, created_from, created_to)
+        if cursor is not None:
+            created_at, case_id = decode_cursor(cursor)
+            clauses.append("(created_at, case_id) > (?, ?)")
+            params.extend((created_at, case_id))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT {_COLUMNS} FROM cases {where} ORDER BY created_at, case_id LIMIT ?", params + [limit + 1]
+        ).fetchall()
+        page = [(row[0], _row_to_case(row)) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last_id, last_case = page[-1]
+            next_cursor = encode_cursor(last_case["created_at"], last_id)
+        return page, next_cursor
+
+    def count(self, status=None, product=None, created_from=None, created_to=None):
+        clauses, params = self._filters(status, product, created_from, created_to)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._conn().execute(f"SELECT COUNT(*) FROM cases {where}", params).fetchone()[0]
+
+
+def create_case_store():
+    """Case store at CASE_STORE_PATH (default: cases.sqlite3 in the data directory)"""
+    return CaseStore(os.environ.get("CASE_STORE_PATH"))
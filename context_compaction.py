@@ -0,0 +1,175 @@
+# Context Compaction
+#
+# Keeps the prompts of complex-case steps within a token budget. Prompts are
+# split into lines and sentences; structured facts (ticket IDs, severity,
+# status, product, error messages, URLs) are always kept verbatim, and the
+# remaining budget is filled with the most informative prose sentences in
+# their original order. Dropped stretches are marked with "[...]".
+#
+# Tokens are counted with tiktoken (a listed requirement). Without it, or
+# when its encoding cannot be loaded, counts fall back to an estimate and a
+# warning is issued once; the case budget, rate limiter and session summaries
+# count with the same function. Every compaction is recorded so a case can report how many
+# tokens it saved.
+import os
+import re
+import warnings
+
+try:
+    import tiktoken
+except ImportError:  # listed in requirements.txt; counts fall back to an estimate without it
+    tiktoken = None
+
+DEFAULT_STEP_BUDGET = 1500
+ELLIPSIS = "[...]"
+
+FACT_RE = re.compile(
+    r"\b(?:BUG|DOC|CASE)-?\d+\b"
+    r"|^\s*[-*]?\s*(?:Case ID|Ticket|Title|Product|Service|Severity|Priority|Status|Error|Version|Azure DevOps URL|URL)\s*:"
+    r"|https?://\S+",
+    re.IGNORECASE,
+)
+_SENTENCE_RE = re.compile(r"[^.!?。！？]+(?:[.!?。！？]+|$)")
+_INFORMATIVE_RE = re.compile(r"\d|\"|'|`|\b(?:because|cause|caused|root|fix|workaround|recommend|must|should)\b", re.IGNORECASE)
+
+_encoding = None
+_estimating = False
+
+
+def _load_encoding():
+    """The tiktoken encoding, or None (with a one-time warning) when counts must be estimated"""
+    global _encoding, _estimating
+    if _encoding is None and not _estimating:
+        reason = "tiktoken is not installed"
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                reason = f"the tiktoken encoding could not be loaded ({e})"
+        if _encoding is None:
+            _estimating = True
+            warnings.warn(f"{reason}; token counts are estimated at about 4 characters per token")
+    return _encoding
+
+
+def count_tokens(text):
+    """Token count with the local tokenizer, or roughly 4 characters per token (1 per CJK character)"""
+    encoding = _load_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _units(text):
+    """(line index, unit text, is_fact) for every sentence, facts as whole lines"""
+    units = []
+    for line_index, line in enumerate(text.splitlines()):
+        if not line.strip():
+            continue
+        if FACT_RE.search(line):
+            units.append((line_index, line, True))
+            continue
+        for sentence in _SENTENCE_RE.findall(line):
+            if sentence.strip():
+                units.append((line_index, sentence, False))
+    return units
+
+
+def compact_text(text, budget, count=count_tokens):
+    """`text` reduced to about `budget` tokens; facts are kept even if they alone exceed it"""
+    if count(text) <= budget:
+        return text
+    units = _units(text)
+    costs = [count(unit) for _, unit, _ in units]
+    keep = [is_fact for _, _, is_fact in units]
+    remaining = budget - sum(cost for cost, is_fact in zip(costs, keep) if is_fact)
+
+    # Leading sentences of a paragraph and sentences with numbers, quotes or conclusions carry the most
+    def score(index):
+        line_index, unit, _ = units[index]
+        leading = index == 0 or units[index - 1][0] != line_index
+        return (2 if leading else 0) + (1 if _INFORMATIVE_RE.search(unit) else 0)
+
+    for index in sorted((i for i in range(len(units)) if not keep[i]), key=lambda i: (-score(i), i)):
+        if costs[index] <= remaining:
+            keep[index] = True
+            remaining -= costs[index]
+
+    lines = {}
+    dropped = False
+    for index, (line_index, unit, _) in enumerate(units):
+        if not keep[index]:
+            dropped = True
+            continue
+        parts = lines.setdefault(line_index, [])
+        if dropped:
+            parts.append(ELLIPSIS)
+        dropped = False
+        parts.append(unit.strip())
+    if dropped:
+        lines.setdefault(max(lines) if lines else 0, []).append(ELLIPSIS)
+    return "\n".join(" ".join(parts) for _, parts in sorted(lines.items()))
+
+
+class CompactionReport:
+    """Tokens before and after compaction, per step and prompt part"""
+
+    def __init__(self, case_id=None):
+        self.case_id = case_id
+        self.entries = []
+
+    def record(self, step, part, original_tokens, compacted_tokens):
+        self.entries.append({"step": step, "part": part, "original_tokens": original_tokens,
+                             "compacted_tokens": compacted_tokens, "saved_tokens": original_tokens - compacted_tokens})
+
+    @property
+    def saved_tokens(self):
+        return sum(entry["saved_tokens"] for entry in self.entries)
+
+    def summary(self):
+        return {"case_id": self.case_id, "saved_tokens": self.saved_tokens,
+                "entries": sorted(self.entries, key=lambda entry: entry["step"])}
+
+    def print_summary(self):
+        print("\n===== Context Compaction =====")
+        for entry in sorted(self.entries, key=lambda entry: entry["step"]):
+            if entry["saved_tokens"]:
+                print(f"Step {entry['step']} {entry['part']}: {entry['original_tokens']} → {entry['compacted_tokens']} tokens")
+        print(f"Tokens saved for case {self.case_id}: {self.saved_tokens}")
+
+
+class ContextCompactor:
+    """Enforces a token budget per step and records the savings in `report`"""
+
+    def __init__(self, default_budget=DEFAULT_STEP_BUDGET, step_budgets=None, case_id=None):
+        self.default_budget = default_budget
+        self.step_budgets = dict(step_budgets or {})
+        self.report = CompactionReport(case_id)
+
+    @classmethod
+    def from_env(cls, case_id=None):
+        """Budget from CONTEXT_TOKEN_BUDGET, per-step overrides from CONTEXT_STEP_BUDGETS ("10=2000,2=800")"""
+        step_budgets = {}
+        for pair in os.environ.get("CONTEXT_STEP_BUDGETS", "").split(","):
+            if "=" in pair:
+                step, budget = pair.split("=", 1)
+                step_budgets[int(step)] = int(budget)
+        return cls(int(os.environ.get("CONTEXT_TOKEN_BUDGET", DEFAULT_STEP_BUDGET)), step_budgets, case_id)
+
+    def budget(self, step):
+        return self.step_budgets.get(step, self.default_budget)
+
+    def compact(self, step, part, text, budget=None):
+        """Compact one part of a step's prompt to `budget` (default: the step budget)"""
+        budget = self.budget(step) if budget is None else budget
+        original = count_tokens(text)
+        compacted = compact_text(text, budget) if original > budget else text
+        self.report.record(step, part, original, count_tokens(compacted) if compacted is not text else original)
+        return compacted
+
+    def wrap_step(self, run_step):
+        """Wrap a handle_complex_case `run_step` so every prompt is fitted to its step budget"""
+        async def run(step, title, agent, prompt, label):
+            return await run_step(step, title, agent, self.compact(step, "prompt", prompt), label)
+        return run
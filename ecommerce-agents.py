@@ -1,11 +1,23 @@
 # ------------------------------代码------------------------------
 # 模拟电商系统
-from agents import Agent, Runner, handoff, AsyncOpenAI, function_tool
+from agents import Agent, Runner, handoff, function_tool
 from agents.extensions.handoff_prompt import prompt_with_handoff_instructions
 import asyncio
+import os
+from agent_metrics import registry
+from carrier_client import CarrierError, carrier_for, create_tracking_service
+from ecommerce_router import COMPLAINT, ORDER, REFUND, QueryRouter
+from ecommerce_sessions import create_session_store
+from model_client import install_shared_client
+from order_store import MAX_BATCH, create_order_store, format_order_table
+from rate_limiter import enable_rate_limits
+from resilience import enable_resilience
 
-# 模拟数据库
-order_database = {
+# 所有代理共用进程内的共享客户端连接池
+install_shared_client()
+
+# 示例订单，首次启动时导入订单库
+sample_orders = {
     "ORD12345": {
         "status": "已发货",
         "date": "2025-03-05",
@@ -23,21 +35,52 @@ order_database = {
     }
 }
 
+# 订单库（SQLite，按订单号、客户邮箱和状态建索引，见 order_store.py）
+order_store = create_order_store()
+order_store.import_orders(sample_orders, replace=False)
+
+# 承运商物流查询（带缓存、并发合并和过期重验证，见 carrier_client.py）
+tracking_service = create_tracking_service()
+
 # 定义工具函数
 @function_tool
 def check_order_status(order_id: str) -> str:
     """查询订单状态"""
-    if order_id in order_database:
-        order = order_database[order_id]
+    order = order_store.get(order_id)
+    if order is not None:
         return f"订单 {order_id} 当前状态: {order['status']}，下单日期: {order['date']}，金额: ¥{order['total']}"
     return f"未找到订单 {order_id}"
 
 @function_tool
-def get_tracking_info(order_id: str) -> str:
+async def get_tracking_info(order_id: str) -> str:
     """获取物流信息"""
-    if order_id in order_database and order_database[order_id].get("tracking"):
-        return f"订单 {order_id} 的物流单号是: {order_database[order_id]['tracking']}"
-    return f"订单 {order_id} 暂无物流信息或订单不存在"
+    order = order_store.get(order_id)
+    if order is None or not order.get("tracking"):
+        return f"订单 {order_id} 暂无物流信息或订单不存在"
+    try:
+        info = await tracking_service.get(order["tracking"])
+    except CarrierError:
+        # 承运商不可用时仍然给出物流单号；失败次数按承运商计入指标
+        registry.counter("carrier_lookup_failures_total", "实时物流查询失败、只返回运单号的次数",
+                         carrier=carrier_for(order["tracking"])[0]).inc()
+        return f"订单 {order_id} 的物流单号是: {order['tracking']}（实时物流暂时查询不到）"
+    return f"订单 {order_id} 的物流单号是: {order['tracking']}，{info.describe()}"
+
+@function_tool
+def check_orders(order_ids: list[str]) -> str:
+    """一次查询多个订单的状态、金额和物流单号，返回一张表格。客户提到多个订单时用它代替逐个查询"""
+    order_ids = list(dict.fromkeys(order_ids))[:MAX_BATCH]
+    found = order_store.get_many(order_ids)
+    return format_order_table([(order_id, found[order_id]) for order_id in order_ids if order_id in found],
+                              [order_id for order_id in order_ids if order_id not in found])
+
+@function_tool
+def list_customer_orders(customer_email: str) -> str:
+    """按客户邮箱查询该客户的全部订单（最近的在前），返回一张表格"""
+    orders = order_store.by_customer(customer_email)
+    if not orders:
+        return f"没有找到邮箱 {customer_email} 的订单"
+    return format_order_table(orders)
 
 # 定义专业代理
 
@@ -47,11 +90,12 @@ order_agent = Agent(
     instructions="""
     你是电子商务平台的订单查询专员。你可以帮助客户查询订单状态和物流信息。
 
-    你需要获取订单号才能提供帮助。如果客户没有提供订单号，请礼貌地询问。
+    你需要获取订单号才能提供帮助。如果客户没有提供订单号，请礼貌地询问；客户提供了邮箱时，可以用 list_customer_orders 查出他的全部订单。
+    客户询问多个订单时，用 check_orders 一次查完，不要逐个调用 check_order_status。
 
-    请记住，你的职责只是查询和提供订单信息。如果客户提出其他需求（如退款或投诉），请向客户说明你只负责订单查询，并建议他们联系相关部门。
+    请记住，你的职责只是查询和提供订单信息。如果客户提出其他需求（如退款或投诉），请使用 transfer_back_to_front_desk 工具交回客服前台。
     """,
-    tools=[check_order_status, get_tracking_info]
+    tools=[check_order_status, get_tracking_info, check_orders, list_customer_orders]
 )
 
 # 退款处理代理
@@ -66,6 +110,7 @@ refund_agent = Agent(
     3. 解释退款流程和预计到账时间
 
     对于不符合退款条件的情况，请清楚解释原因并提供替代解决方案。
+    如果客户提出的是退款以外的需求（如查询订单、投诉），请使用 transfer_back_to_front_desk 工具交回客服前台。
     """,
     tools=[check_order_status]
 )
@@ -83,6 +128,7 @@ complaint_agent = Agent(
     4. 在适当的情况下提供补偿（如优惠券、积分等）
 
     对于特别严重或复杂的投诉，可以承诺由主管跟进处理。
+    如果客户提出的是投诉以外的需求（如查询订单、退款），请使用 transfer_back_to_front_desk 工具交回客服前台。
     """,
     tools=[check_order_status]
 )
@@ -143,15 +189,62 @@ main_agent.handoffs = [
     transfer_to_complaint_specialist  # 最不常见
 ]
 
+# 专员遇到职责以外的需求时交回客服前台重新分诊；
+# 会话续接时追问直接从专员开始，没有这条交接，换了话题的客户就会卡在原来的专员那里
+transfer_back_to_front_desk = handoff(
+    agent=main_agent,
+    tool_name_override="transfer_back_to_front_desk",
+    tool_description_override="当客户的需求不属于你的职责范围时使用此工具，交回客服前台重新分诊。例如订单查询专员遇到'我要退款'、退款专员遇到'我的包裹到哪了'等情况。"
+)
+for specialist in (order_agent, refund_agent, complaint_agent):
+    specialist.handoffs = [transfer_back_to_front_desk]
+
+# 系统中的全部代理，便于统一配置模型
+all_agents = [main_agent, order_agent, refund_agent, complaint_agent]
+
+# 每次模型调用的超时、退避重试和可选的对冲请求（见 resilience.py），
+# 每次尝试和对冲请求都按进程共享的每分钟请求数/令牌数配额排队（见 rate_limiter.py）
+enable_rate_limits(all_agents)
+resilience = enable_resilience(all_agents)
+
+# 本地预分类：意图明确的查询直接交给专员，省去客服前台的一轮模型调用
+# 设置 ECOMMERCE_LOCAL_ROUTING=0 可关闭，所有查询都经过客服前台
+LOCAL_ROUTING = os.environ.get("ECOMMERCE_LOCAL_ROUTING", "1") != "0"
+query_router = QueryRouter()
+specialists = {ORDER: order_agent, REFUND: refund_agent, COMPLAINT: complaint_agent}
+
+# 多轮会话：保存对话历史和上次负责的代理，追问直接由该代理继续（见 ecommerce_sessions.py）
+session_store = create_session_store()
+agents_by_name = {agent.name: agent for agent in all_agents}
+
 # 主函数
-async def handle_customer_query(query):
+async def handle_customer_query(query, local_routing=None, session_id=None):
     print(f"\n===== 新的客户查询 =====")
     print(f"客户: {query}")
 
     try:
-        result = await Runner.run(main_agent, query)
+        session = session_store.load(session_id) if session_id else None
+        start_agent = main_agent
+        routed_agent = None
+        if local_routing if local_routing is not None else LOCAL_ROUTING:
+            routed_agent, decision = query_router.route(query, specialists)
+            if routed_agent is not None:
+                start_agent = routed_agent
+                print(f"\n本地路由: {main_agent.name} → {routed_agent.name}（{decision.source}，置信度 {decision.confidence:.2f}）")
+        # 意图不明确的追问交给上一轮负责的代理，不再经过客服前台
+        if routed_agent is None and session is not None and session.last_agent in agents_by_name:
+            start_agent = agents_by_name[session.last_agent]
+            print(f"\n会话续接: {start_agent.name}（第 {session.turn_count + 1} 轮）")
+
+        run_input = session.input_items(query) if session is not None else query
+        result = await Runner.run(start_agent, run_input)
         print(f"\n客服回复: {result.final_output}")
 
+        if session is not None:
+            # 本轮新增的条目：客户的提问，以及代理的工具调用、交接和回答
+            turn = result.to_input_list()[len(run_input) - 1:]
+            session_store.record_turn(session, turn, result.last_agent.name)
+
         # 打印交接路径信息
         if hasattr(result, 'new_items') and result.new_items:
             handoffs_occurred = [item for item in result.new_items if item.type == "handoff_output_item"]
@@ -162,7 +255,7 @@ async def handle_customer_query(query):
                     # 打印使用的工具名称，帮助调试
                     if hasattr(handoff_item, 'tool_name') and handoff_item.tool_name:
                         print(f"   使用工具: {handoff_item.tool_name}")
-            else:
+            elif start_agent is main_agent:
                 # 如果没有交接发生，也打印出来便于调试
                 print("\n没有交接发生，主代理直接处理了请求")
 
@@ -173,16 +266,19 @@ async def handle_customer_query(query):
 
 # 示例查询
 async def run_demo():
+    # (会话, 查询)：同一会话中的追问由上一轮的专员直接继续
     queries = [
-        "你好，我想查询一下我的订单状态",
-        "我的订单号是ORD12345",
-        "我想申请退款，订单ORD12345中的耳机质量有问题",
-        "我对你们的配送速度非常不满，已经等了一周还没收到货！",
+        ("demo-order", "你好，我想查询一下我的订单状态"),
+        ("demo-order", "我的订单号是ORD12345"),
+        ("demo-refund", "我想申请退款，订单ORD12345中的耳机质量有问题"),
+        ("demo-complaint", "我对你们的配送速度非常不满，已经等了一周还没收到货！"),
     ]
+    for session_id in dict(queries):
+        session_store.clear(session_id)
 
-    for query in queries:
+    for session_id, query in queries:
         try:
-            await handle_customer_query(query)
+            await handle_customer_query(query, session_id=session_id)
         except Exception as e:
             print(f"处理查询'{query}'时出错: {e}")
         print("\n" + "=" * 50 + "\n")
@@ -0,0 +1,196 @@
+# 电商查询本地预分类器
+#
+# 大部分客户查询意图非常明确（如"查询订单状态"、"申请退款"），没必要先让客服前台
+# 的模型跑一轮再交接。本模块在本地先做一次分类：
+#   1. 关键词/正则规则：命中且只命中一个类别时直接路由；被否定的关键词
+#      （如"不想退款"）不算命中
+#   2. 字符 n-gram TF-IDF + 多分类逻辑回归：由带标签的示例查询训练，
+#      置信度高于阈值时路由
+# 其余情况（规则冲突、置信度不足、一般问题）返回 None，由客服前台处理。
+import math
+import re
+from collections import defaultdict
+
+ORDER = "order"
+REFUND = "refund"
+COMPLAINT = "complaint"
+GENERAL = "general"
+
+# 高精度关键词规则
+RULES = {
+    ORDER: re.compile(r"订单状态|查询订单|查订单|物流|快递|包裹|运单|发货了吗|到哪了?|什么时候到|配送进度"),
+    REFUND: re.compile(r"退款|退货|退钱|退回|换货|申请售后"),
+    COMPLAINT: re.compile(r"投诉|不满|太差|糟糕|差评|生气|失望|气死|态度恶劣|什么破"),
+}
+
+# 否定词：关键词前面同一分句内紧挨着（中间最多隔两个字）出现时，该关键词不算命中，
+# 如"不想退款"、"不是要投诉"；"是不是"是疑问，不算否定
+NEGATION_RE = re.compile(r"(?:不想|不要|(?<!是)不是|不用|不需要|无需|没打算|别)[^，。！？,.!?；;\s]{0,2}$")
+CLAUSE_RE = re.compile(r"[，。！？,.!?；;\s]")
+
+# 基本只报了订单号（去掉订单号后不超过8个字）时按订单查询处理（弱规则，仅在其他规则都未命中时生效）
+ORDER_ID_RE = re.compile(r"ORD\d+", re.IGNORECASE)
+
+# 训练用的带标签示例查询
+TRAINING_QUERIES = [
+    (ORDER, "你好，我想查询一下我的订单状态"),
+    (ORDER, "我的订单号是ORD12345"),
+    (ORDER, "帮我看看订单到哪了"),
+    (ORDER, "我的包裹什么时候能到"),
+    (ORDER, "能告诉我订单的物流信息吗"),
+    (ORDER, "我买的东西发货了吗"),
+    (ORDER, "查一下快递单号"),
+    (ORDER, "订单显示待付款是怎么回事"),
+    (ORDER, "我想知道订单的配送进度"),
+    (ORDER, "这个订单现在是什么状态"),
+    (ORDER, "请帮我查一下ORD67890"),
+    (ORDER, "我的快递停在中转站好几天了，能查一下吗"),
+    (REFUND, "我想申请退款"),
+    (REFUND, "我想申请退款，订单中的耳机质量有问题"),
+    (REFUND, "这个产品有问题，我要退货"),
+    (REFUND, "如何办理退款"),
+    (REFUND, "退款多久能到账"),
+    (REFUND, "收到的商品坏了，能退吗"),
+    (REFUND, "尺码不合适想退货"),
+    (REFUND, "我不想要了，可以退钱吗"),
+    (REFUND, "退货运费谁承担"),
+    (REFUND, "申请售后退款被拒绝了怎么办"),
+    (REFUND, "能不能把钱退回到原支付账户"),
+    (COMPLAINT, "我对你们的服务很不满"),
+    (COMPLAINT, "我要投诉"),
+    (COMPLAINT, "这个体验太糟糕了"),
+    (COMPLAINT, "我对你们的配送速度非常不满，已经等了一周还没收到货！"),
+    (COMPLAINT, "客服态度恶劣，我很生气"),
+    (COMPLAINT, "你们的快递员把包裹扔在门口，太差了"),
+    (COMPLAINT, "质量这么差，我要给差评"),
+    (COMPLAINT, "每次买东西都出问题，太让人失望了"),
+    (COMPLAINT, "我要找你们主管投诉"),
+    (COMPLAINT, "等了这么久没人理，什么破服务"),
+    (GENERAL, "你们的营业时间是什么时候"),
+    (GENERAL, "如何修改收货地址"),
+    (GENERAL, "你好"),
+    (GENERAL, "在吗"),
+    (GENERAL, "怎么开发票"),
+    (GENERAL, "会员积分怎么用"),
+    (GENERAL, "有没有优惠券"),
+    (GENERAL, "怎么联系人工客服"),
+    (GENERAL, "支持哪些支付方式"),
+    (GENERAL, "可以修改绑定的手机号吗"),
+    (GENERAL, "新用户有什么活动"),
+]
+
+
+def char_ngrams(text, sizes=(1, 2, 3)):
+    """去掉空白和标点后的字符 n-gram（中文无需分词）"""
+    text = re.sub(r"[\s，。！？、,.!?：:；;\"'“”‘’（）()]+", "", text.lower())
+    return [text[i:i + n] for n in sizes for i in range(len(text) - n + 1)]
+
+
+class TfidfLogisticClassifier:
+    """字符 n-gram TF-IDF 特征上的多分类逻辑回归（纯 Python，训练数据很小）"""
+
+    def __init__(self, examples, epochs=40, learning_rate=0.5, l2=1e-4):
+        self.labels = sorted({label for label, _ in examples})
+        document_frequency = defaultdict(int)
+        for _, text in examples:
+            for gram in set(char_ngrams(text)):
+                document_frequency[gram] += 1
+        total = len(examples)
+        self.idf = {gram: math.log((1 + total) / (1 + count)) + 1 for gram, count in document_frequency.items()}
+        self.weights = {label: defaultdict(float) for label in self.labels}
+        self.bias = {label: 0.0 for label in self.labels}
+
+        samples = [(label, self.features(text)) for label, text in examples]
+        for _ in range(epochs):
+            for label, features in samples:
+                probabilities = self._probabilities(features)
+                for candidate in self.labels:
+                    gradient = probabilities[candidate] - (1.0 if candidate == label else 0.0)
+                    weights = self.weights[candidate]
+                    for gram, value in features.items():
+                        weights[gram] -= learning_rate * (gradient * value + l2 * weights[gram])
+                    self.bias[candidate] -= learning_rate * gradient
+
+    def features(self, text):
+        """L2 归一化的 TF-IDF 向量；训练集中没出现过的 n-gram 直接忽略"""
+        counts = defaultdict(int)
+        for gram in char_ngrams(text):
+            if gram in self.idf:
+                counts[gram] += 1
+        vector = {gram: count * self.idf[gram] for gram, count in counts.items()}
+        norm = math.sqrt(sum(value * value for value in vector.values()))
+        return {gram: value / norm for gram, value in vector.items()} if norm else {}
+
+    def _probabilities(self, features):
+        scores = {label: self.bias[label] + sum(self.weights[label].get(gram, 0.0) * value for gram, value in features.items())
+                  for label in self.labels}
+        top = max(scores.values())
+        exponents = {label: math.exp(score - top) for label, score in scores.items()}
+        total = sum(exponents.values())
+        return {label: value / total for label, value in exponents.items()}
+
+    def predict(self, text):
+        """(类别, 置信度)"""
+        features = self.features(text)
+        if not features:
+            return GENERAL, 0.0
+        probabilities = self._probabilities(features)
+        label = max(probabilities, key=probabilities.get)
+        return label, probabilities[label]
+
+
+class RouteDecision:
+    """本地路由结果：目标类别、来源（rule/model）和置信度"""
+
+    def __init__(self, label, source, confidence):
+        self.label = label
+        self.source = source
+        self.confidence = confidence
+
+    def __repr__(self):
+        return f"RouteDecision({self.label}, {self.source}, {self.confidence:.2f})"
+
+
+def _negated(query, start):
+    """query[start:] 处的关键词是否被同一分句内紧挨着的否定词否定"""
+    clause = CLAUSE_RE.split(query[:start])[-1]
+    return NEGATION_RE.search(clause) is not None
+
+
+def rule_matches(query):
+    """(命中的类别, 只以否定形式出现的类别)"""
+    matched, negated = [], []
+    for label, pattern in RULES.items():
+        hits = [match.start() for match in pattern.finditer(query)]
+        if any(not _negated(query, start) for start in hits):
+            matched.append(label)
+        elif hits:
+            negated.append(label)
+    return matched, negated
+
+
+class QueryRouter:
+    """把意图明确的查询直接分派给专员；不确定时返回 None"""
+
+    def __init__(self, examples=TRAINING_QUERIES, threshold=0.7):
+        self.threshold = threshold
+        self.classifier = TfidfLogisticClassifier(examples)
+
+    def classify(self, query):
+        matched, negated = rule_matches(query)
+        if len(matched) == 1:
+            return RouteDecision(matched[0], "rule", 1.0)
+        if not matched and not negated and ORDER_ID_RE.search(query) and len(char_ngrams(ORDER_ID_RE.sub("", query), (1,))) <= 8:
+            return RouteDecision(ORDER, "rule", 1.0)
+        # 规则冲突或未命中时交给模型；冲突时模型结果必须是命中的类别之一，且不能是客户否定的类别
+        label, confidence = self.classifier.predict(query)
+        if label == GENERAL or confidence < self.threshold or (matched and label not in matched) or label in negated:
+            return None
+        return RouteDecision(label, "model", confidence)
+
+    def route(self, query, agents):
+        """返回 (代理, 决策)；agents 为 类别 -> 代理 的映射，不确定时返回 (None, None)"""
+        decision = self.classify(query)
+        if decision is None or decision.label not in agents:
+            return None, None
+        return agents[decision.label], decision
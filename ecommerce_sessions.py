@@ -0,0 +1,195 @@
+# 电商多轮会话
+#
+# 每个客户会话保存在 SQLite 中：最近几轮的完整对话（含工具调用）、更早对话的摘要，
+# 以及上一轮最后负责回答的代理。后续提问带上这段历史直接从该代理继续，
+# 不再经过客服前台重新分诊，订单号等信息也不必再问一遍；追问通常一轮模型调用就能完成。
+#
+# 历史按轮次裁剪（保留最近 SESSION_MAX_TURNS 轮，默认 6），工具调用和它的输出
+# 总在同一轮里，不会被拆开。被裁掉的轮次压缩成摘要：订单号、物流单号和邮箱原样保留，
+# 其余对话按 SESSION_SUMMARY_TOKENS（默认 300）的预算摘取，不额外调用模型。
+# 超过 SESSION_TTL 秒（默认 1800）未活动的会话视为过期，重新开始。
+#
+# 数据库默认位于数据目录下的 ecommerce_sessions.sqlite3，可用 SESSION_STORE_PATH 修改。
+import json
+import os
+import re
+import threading
+import time
+
+from context_compaction import compact_text
+from storage import connect_sqlite, data_path
+
+DEFAULT_MAX_TURNS = 6
+DEFAULT_SUMMARY_TOKENS = 300
+DEFAULT_TTL = 1800.0
+
+# 摘要中必须原样保留的关键信息
+# （中文与字母之间没有 \b 边界，所以这里用 ASCII 字符类划定边界）
+FACT_PATTERNS = [
+    ("订单号", re.compile(r"(?<![A-Za-z0-9])ORD\d+")),
+    ("物流单号", re.compile(r"(?<![A-Za-z0-9])(?:SF|YT|ZT|JD|EMS)\d{6,}")),
+    ("邮箱", re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)+")),
+]
+SUMMARY_PREFIX = "（以下是本次会话较早对话的摘要）"
+
+
+def _item_text(item):
+    """对话条目中的文字；工具调用返回空串，工具输出返回其结果"""
+    if item.get("type") == "function_call_output":
+        return str(item.get("output", ""))
+    content = item.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+
+def _turn_lines(turn):
+    """一轮对话的摘要行：客户的话和客服的回答"""
+    lines = []
+    for item in turn:
+        role = item.get("role")
+        if role in ("user", "assistant"):
+            text = " ".join(_item_text(item).split())
+            if text:
+                lines.append(f"{'客户' if role == 'user' else '客服'}: {text}")
+    return lines
+
+
+def summarize_turns(summary, turns, budget=DEFAULT_SUMMARY_TOKENS):
+    """把裁掉的轮次并入已有摘要：关键信息原样保留，对话内容压缩到约 `budget` 个令牌"""
+    facts, prose = {}, []
+    if summary:
+        for line in summary.splitlines():
+            if line.startswith("已知") or line == SUMMARY_PREFIX:
+                continue
+            prose.append(line)
+    texts = [summary or ""] + [_item_text(item) for turn in turns for item in turn]
+    for label, pattern in FACT_PATTERNS:
+        for text in texts:
+            for value in pattern.findall(text):
+                facts.setdefault(label, {})[value] = None
+    for turn in turns:
+        prose.extend(_turn_lines(turn))
+    lines = [SUMMARY_PREFIX]
+    lines.extend(f"已知{label}: {', '.join(values)}" for label, values in facts.items())
+    if prose:
+        lines.append(compact_text("\n".join(prose), budget))
+    return "\n".join(lines)
+
+
+class Session:
+    """一个客户会话：摘要、最近几轮对话和上次负责的代理"""
+
+    def __init__(self, session_id, summary=None, turns=None, last_agent=None, turn_count=0, updated_at=None):
+        self.session_id = session_id
+        self.summary = summary
+        self.turns = turns or []
+        self.last_agent = last_agent
+        self.turn_count = turn_count
+        self.updated_at = updated_at
+
+    def input_items(self, query):
+        """本轮发给代理的输入：摘要、最近几轮历史和新的提问"""
+        items = []
+        if self.summary:
+            items.append({"role": "system", "content": self.summary})
+        for turn in self.turns:
+            items.extend(turn)
+        items.append({"role": "user", "content": query})
+        return items
+
+
+class SessionStore:
+    """SQLite 会话库；每个线程使用自己的连接"""
+
+    def __init__(self, path=None, max_turns=DEFAULT_MAX_TURNS, summary_tokens=DEFAULT_SUMMARY_TOKENS, ttl=DEFAULT_TTL):
+        self.path = path or data_path("ecommerce_sessions.sqlite3")
+        self.max_turns = max_turns
+        self.summary_tokens = summary_tokens
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT,
+                turns TEXT NOT NULL,
+                last_agent TEXT,
+                turn_count INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def load(self, session_id):
+        """会话的当前状态；不存在或已过期时返回一个空会话"""
+        return self._read(self._conn(), session_id)
+
+    def _read(self, conn, session_id):
+        row = conn.execute(
+            "SELECT summary, turns, last_agent, turn_count, updated_at FROM sessions WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        if row is None or (self.ttl and time.time() - row[4] > self.ttl):
+            return Session(session_id)
+        summary, turns, last_agent, turn_count, updated_at = row
+        return Session(session_id, summary, json.loads(turns), last_agent, turn_count, updated_at)
+
+    def record_turn(self, session, turn, last_agent):
+        """追加一轮对话（该轮的全部输入输出条目）并保存；超出 max_turns 的旧轮次并入摘要
+
+        同一会话的并发请求各自基于 load 时的旧状态，所以这里在写事务内重新读取
+        最新状态再追加，避免后写入的一轮覆盖掉先写入的一轮；`session` 随后更新为保存后的状态。
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._read(conn, session.session_id)
+            current.turns.append(turn)
+            if len(current.turns) > self.max_turns:
+                dropped = current.turns[:-self.max_turns]
+                current.turns = current.turns[-self.max_turns:]
+                current.summary = summarize_turns(current.summary, dropped, self.summary_tokens)
+            current.last_agent = last_agent
+            current.turn_count += 1
+            current.updated_at = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, summary, turns, last_agent, turn_count, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (current.session_id, current.summary, json.dumps(current.turns, ensure_ascii=False, default=str),
+                 last_agent, current.turn_count, current.updated_at),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        session.summary, session.turns = current.summary, current.turns
+        session.last_agent, session.turn_count, session.updated_at = last_agent, current.turn_count, current.updated_at
+
+    def clear(self, session_id):
+        self._conn().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge_expired(self):
+        """删除已过期的会话，返回删除的数量"""
+        if not self.ttl:
+            return 0
+        cursor = self._conn().execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+
+def create_session_store():
+    """位于 SESSION_STORE_PATH（默认数据目录下的 ecommerce_sessions.sqlite3）的会话库"""
+    return SessionStore(
+        os.environ.get("SESSION_STORE_PATH"),
+        max_turns=int(os.environ.get("SESSION_MAX_TURNS", DEFAULT_MAX_TURNS)),
+        summary_tokens=int(os.environ.get("SESSION_SUMMARY_TOKENS", DEFAULT_SUMMARY_TOKENS)),
+        ttl=float(os.environ.get("SESSION_TTL", DEFAULT_TTL)),
+    )
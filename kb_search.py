@@ -0,0 +1,187 @@
+# Knowledge Base Search
+#
+# Inverted index with BM25 ranking over the knowledge base's common_issues and
+# troubleshooting entries, plus normalized and typo-tolerant product name
+# matching, so check_knowledge_base can answer "enterprise dashboard" or
+# "API gateway service" instead of reporting "not found".
+import heapq
+import math
+import re
+from collections import defaultdict
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can for from has have how i if in into is it its may my no not of on or our
+the their then there these they this to was we were what when which while who why will with you your
+""".split())
+
+# Words that say nothing about which product is meant ("API gateway service")
+GENERIC_PRODUCT_WORDS = frozenset(["service", "services", "product", "system", "platform", "tool", "app", "application", "the", "our", "my"])
+
+
+def tokenize(text):
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def normalize_product(name):
+    """Canonical form of a product name: lowercase words without generic filler"""
+    tokens = _TOKEN_RE.findall(name.lower())
+    meaningful = [token for token in tokens if token not in GENERIC_PRODUCT_WORDS]
+    return " ".join(meaningful or tokens)
+
+
+def _trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class KnowledgeBaseIndex:
+    """Immutable search index over a knowledge base dict.
+
+    Every common issue and troubleshooting step is one section (document).
+    Postings are stored impact-ordered: each term's list is sorted by the
+    section's precomputed BM25 contribution, so a query only walks the head of
+    each list (`max_postings_per_term`) and stays fast for frequent terms even
+    with hundreds of thousands of sections. Sections outside every head are
+    only missed when they rank below that many better sections for all query
+    terms.
+    """
+
+    SECTION_KINDS = (("common_issues", "Common issue"), ("troubleshooting", "Troubleshooting"))
+
+    def __init__(self, knowledge_base, k1=1.5, b=0.75, max_postings_per_term=256):
+        self.products = list(knowledge_base)
+        self.max_postings_per_term = max_postings_per_term
+        self.sections = []
+
+        term_frequencies = []
+        for product, entry in knowledge_base.items():
+            product_tokens = tokenize(product)
+            for field, kind in self.SECTION_KINDS:
+                for text in entry.get(field, []):
+                    self.sections.append((product, kind, text))
+                    counts = defaultdict(int)
+                    for token in tokenize(text) + product_tokens:
+                        counts[token] += 1
+                    term_frequencies.append(counts)
+
+        # BM25 impact of every (term, section) pair, sorted best-first per term
+        section_count = len(self.sections)
+        lengths = [sum(counts.values()) for counts in term_frequencies]
+        average_length = (sum(lengths) / section_count) if section_count else 0.0
+        document_frequency = defaultdict(int)
+        for counts in term_frequencies:
+            for term in counts:
+                document_frequency[term] += 1
+
+        postings = defaultdict(list)
+        for section_id, counts in enumerate(term_frequencies):
+            norm = k1 * (1 - b + b * lengths[section_id] / average_length) if average_length else k1
+            for term, tf in counts.items():
+                idf = math.log(1 + (section_count - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+                postings[term].append((idf * tf * (k1 + 1) / (tf + norm), section_id))
+        self.postings = {}
+        for term, entries in postings.items():
+            entries.sort(reverse=True)
+            self.postings[term] = tuple(entries)
+
+        # Product name lookup: exact normalized names, then word and trigram indexes for fuzzy matches
+        self.by_normalized_name = {}
+        self.product_tokens = {}
+        self.products_by_token = defaultdict(list)
+        for product in self.products:
+            self.by_normalized_name.setdefault(normalize_product(product), product)
+            tokens = frozenset(normalize_product(product).split())
+            self.product_tokens[product] = tokens
+            for token in tokens:
+                self.products_by_token[token].append(product)
+        # Numbers (versions, model numbers) must match exactly, so they stay out of the typo index
+        self.tokens_by_trigram = defaultdict(list)
+        for token in self.products_by_token:
+            if token.isdigit():
+                continue
+            for trigram in _trigrams(token):
+                self.tokens_by_trigram[trigram].append(token)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def _closest_tokens(self, token, limit=2, min_similarity=0.5):
+        if token in self.products_by_token:
+            return [token]
+        if token.isdigit():
+            return []
+        query_trigrams = _trigrams(token)
+        overlap = defaultdict(int)
+        for trigram in query_trigrams:
+            for candidate in self.tokens_by_trigram.get(trigram, ()):
+                overlap[candidate] += 1
+        scored = []
+        for candidate, shared in overlap.items():
+            similarity = shared / (len(query_trigrams) + len(_trigrams(candidate)) - shared)
+            if similarity >= min_similarity:
+                scored.append((similarity, candidate))
+        return [candidate for _, candidate in heapq.nlargest(limit, scored)]
+
+    def match_products(self, name, limit=3, max_candidates=200):
+        """Products whose names best match `name`, as (score, product) pairs best-first.
+
+        A score of 1.0 means the normalized names are identical; lower scores
+        are the token overlap after mapping misspelled words to known ones.
+        """
+        normalized = normalize_product(name)
+        if normalized in self.by_normalized_name:
+            return [(1.0, self.by_normalized_name[normalized])]
+
+        query_tokens = set()
+        for token in normalized.split():
+            query_tokens.update(self._closest_tokens(token))
+        if not query_tokens:
+            return []
+
+        # Gather candidates from the rarest words first so common words can't blow up the scan
+        candidates = set()
+        for token in sorted(query_tokens, key=lambda t: len(self.products_by_token[t])):
+            candidates.update(self.products_by_token[token][:max_candidates - len(candidates)])
+            if len(candidates) >= max_candidates:
+                break
+
+        scored = []
+        for product in candidates:
+            tokens = self.product_tokens[product]
+            shared = len(tokens & query_tokens)
+            scored.append((shared / len(tokens | query_tokens), product))
+        return heapq.nlargest(limit, scored)
+
+    def resolve_product(self, name, min_score=0.5, margin=0.05):
+        """The single product `name` refers to, or None when nothing (or more than one) fits"""
+        matches = self.match_products(name)
+        if not matches or matches[0][0] < min_score:
+            return None
+        if len(matches) > 1 and matches[0][0] - matches[1][0] < margin:
+            return None
+        return matches[0][1]
+
+    def search(self, query, top_k=5, product=None):
+        """Top-k sections for `query` as (score, product, kind, text), best first"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            for impact, section_id in self.postings.get(term, ())[:self.max_postings_per_term]:
+                scores[section_id] += impact
+        if product is not None:
+            scores = {section_id: score for section_id, score in scores.items() if self.sections[section_id][0] == product}
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, *self.sections[section_id]) for section_id, score in best]
+
+
+def format_search_results(query, results, suggestions=()):
+    """Render search hits the way the check_knowledge_base tool reports them"""
+    if not results:
+        return f"Knowledge base information for product '{query}' not found"
+    lines = [f"No exact knowledge base entry for '{query}'. Closest matching sections:"]
+    for _, product, kind, text in results:
+        lines.append(f"- [{product}] {kind}: {text}")
+    if suggestions:
+        lines.append("\nDid you mean: " + ", ".join(f"'{product}'" for product in suggestions) + "?")
+    return "\n".join(lines)
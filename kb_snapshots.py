@@ -0,0 +1,176 @@
+# Knowledge Base and Case Data Snapshots
+#
+# The knowledge base and the sample case data live in JSON files under data/
+# instead of Python literals, so they can be edited without a redeploy.
+#
+# Each load of the knowledge base builds an immutable, versioned snapshot: the
+# entries (read-only), the search index and the formatted check_knowledge_base
+# response of every product, all computed up front. Readers take the current
+# snapshot with a single attribute read and use it for the whole tool call;
+# a reload builds the next snapshot off to the side and swaps the reference,
+# so a call in flight never blocks and never sees a half-updated knowledge
+# base.
+#
+# Case records are owned by the case store (case_store.py), which also holds
+# changes made at runtime, so a case file change is applied as a bulk upsert
+# of just the records that changed in the file. The store remembers a digest
+# of every file entry it applied, so entries edited while no process was
+# running are applied on the next start too.
+#
+# A background watcher polls the files (every SNAPSHOT_WATCH_INTERVAL seconds,
+# default 2; 0 disables it) and reloads whichever changed. A file that fails
+# to parse is reported and the previous version stays in use.
+import hashlib
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from kb_search import KnowledgeBaseIndex, format_search_results
+from storage import BASE_DIR
+
+DEFAULT_WATCH_INTERVAL = 2.0
+
+
+def knowledge_base_path():
+    return os.environ.get("KNOWLEDGE_BASE_PATH", os.path.join(BASE_DIR, "data", "knowledge_base.json"))
+
+
+def support_cases_path():
+    return os.environ.get("SUPPORT_CASES_PATH", os.path.join(BASE_DIR, "data", "support_cases.json"))
+
+
+def format_knowledge_base_entry(product, entry):
+    common_issues = "\n".join([f"- {issue}" for issue in entry["common_issues"]])
+    troubleshooting = "\n".join([f"- {step}" for step in entry["troubleshooting"]])
+    return f"Product '{product}' knowledge base:\n\nCommon issues:\n{common_issues}\n\nTroubleshooting steps:\n{troubleshooting}"
+
+
+class KnowledgeBaseSnapshot:
+    """One immutable version of the knowledge base with its index and prebuilt tool responses"""
+
+    def __init__(self, knowledge_base, version=1, digest=None):
+        self.version = version
+        self.digest = digest
+        self.loaded_at = time.time()
+        self.entries = MappingProxyType({
+            product: MappingProxyType({field: tuple(values) for field, values in entry.items()})
+            for product, entry in knowledge_base.items()
+        })
+        self.index = KnowledgeBaseIndex(self.entries)
+        self.responses = MappingProxyType({
+            product: format_knowledge_base_entry(product, entry) for product, entry in self.entries.items()
+        })
+
+    def lookup(self, product):
+        """The check_knowledge_base response for a product name or issue keywords"""
+        if product in self.responses:
+            return self.responses[product]
+        # Tolerate case, filler words and typos in the product name
+        resolved = self.index.resolve_product(product)
+        if resolved is not None:
+            return self.responses[resolved]
+        # Otherwise fall back to ranked search over the issue and troubleshooting text
+        suggestions = [name for score, name in self.index.match_products(product) if score >= 0.3]
+        return format_search_results(product, self.index.search(product, top_k=5), suggestions)
+
+
+def entry_digest(entry):
+    return hashlib.sha256(json.dumps(entry, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class CaseFileSnapshot:
+    """One version of the case file, applied to the case store when it is built.
+
+    Only entries whose digest differs from the one the store last applied are
+    written, so records updated at runtime survive a restart unless their
+    entry in the file changed. Cases the store has but never recorded a
+    digest for are left as they are.
+    """
+
+    def __init__(self, cases, version, digest, store, previous=None):
+        self.version = version
+        self.digest = digest
+        self.loaded_at = time.time()
+        self.cases = MappingProxyType({case_id: dict(case) for case_id, case in cases.items()})
+        applied = store.file_digests()
+        digests = {case_id: entry_digest(case) for case_id, case in self.cases.items()}
+        self.changed = {case_id: case for case_id, case in self.cases.items() if applied.get(case_id) != digests[case_id]}
+        store.import_cases({case_id: case for case_id, case in self.changed.items() if case_id in applied})
+        store.import_cases({case_id: case for case_id, case in self.changed.items() if case_id not in applied}, replace=False)
+        store.record_file_digests({case_id: digests[case_id] for case_id in self.changed})
+
+
+class FileSource:
+    """A JSON file and the snapshot built from its current contents"""
+
+    def __init__(self, name, path, build):
+        self.name = name
+        self.path = path
+        self.build = build
+        self.current = None
+        self.version = 0
+        self._signature = None
+        self._digest = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Build and swap in a new snapshot if the file changed; returns True if it did"""
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return False
+        with self._lock:
+            self._signature = signature
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            if digest == self._digest:
+                return False
+            snapshot = self.build(json.loads(raw), self.version + 1, digest, self.current)
+            self.version += 1
+            self._digest = digest
+            self.current = snapshot
+        print(f"Loaded {self.name} version {self.version} from {self.path}")
+        return True
+
+
+def knowledge_base_source(path=None):
+    return FileSource("knowledge base", path or knowledge_base_path(),
+                      lambda data, version, digest, previous: KnowledgeBaseSnapshot(data, version, digest))
+
+
+def case_file_source(store, path=None):
+    return FileSource("support cases", path or support_cases_path(),
+                      lambda data, version, digest, previous: CaseFileSnapshot(data, version, digest, store, previous))
+
+
+class SnapshotWatcher:
+    """Daemon thread that refreshes file sources every `interval` seconds"""
+
+    def __init__(self, sources, interval=DEFAULT_WATCH_INTERVAL):
+        self.sources = list(sources)
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="snapshot-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            for source in self.sources:
+                try:
+                    source.refresh()
+                except Exception as e:
+                    print(f"Could not reload {source.name} from {source.path}, keeping version {source.version}: {e}")
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=5)
+
+
+def start_watcher(sources):
+    """Watch `sources` at SNAPSHOT_WATCH_INTERVAL seconds; returns the watcher, or None when disabled"""
+    interval = float(os.environ.get("SNAPSHOT_WATCH_INTERVAL", DEFAULT_WATCH_INTERVAL))
+    return SnapshotWatcher(sources, interval) if interval > 0 else None
@@ -0,0 +1,183 @@
+# Shared Model Client
+#
+# One configuration point for the HTTP client behind every model call. Each
+# process builds a single AsyncOpenAI client on a tunable httpx connection
+# pool (max connections, keep-alive, HTTP/2, timeouts). It is installed as the
+# SDK default for agents without an explicit model and injected into every
+# OpenAIChatCompletionsModel built through chat_model(), so connections and
+# TLS sessions are reused instead of re-established on the hot path.
+#
+# Settings come from ClientConfig, by default read from the environment:
+#   OPENAI_POOL_MAX_CONNECTIONS, OPENAI_POOL_MAX_KEEPALIVE,
+#   OPENAI_POOL_KEEPALIVE_EXPIRY, OPENAI_HTTP2, OPENAI_CONNECT_TIMEOUT,
+#   OPENAI_READ_TIMEOUT, OPENAI_WRITE_TIMEOUT, OPENAI_POOL_TIMEOUT,
+#   OPENAI_MAX_RETRIES
+import os
+import threading
+import warnings
+from dataclasses import asdict, dataclass
+
+import httpx
+from agents import AsyncOpenAI, OpenAIChatCompletionsModel, set_default_openai_client
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    return default if value is None else value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class ClientConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    connect_timeout: float = 10.0
+    read_timeout: float = 120.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 30.0
+    max_retries: int = 2
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_connections=int(os.environ.get("OPENAI_POOL_MAX_CONNECTIONS", cls.max_connections)),
+            max_keepalive_connections=int(os.environ.get("OPENAI_POOL_MAX_KEEPALIVE", cls.max_keepalive_connections)),
+            keepalive_expiry=float(os.environ.get("OPENAI_POOL_KEEPALIVE_EXPIRY", cls.keepalive_expiry)),
+            http2=_env_bool("OPENAI_HTTP2", cls.http2),
+            connect_timeout=float(os.environ.get("OPENAI_CONNECT_TIMEOUT", cls.connect_timeout)),
+            read_timeout=float(os.environ.get("OPENAI_READ_TIMEOUT", cls.read_timeout)),
+            write_timeout=float(os.environ.get("OPENAI_WRITE_TIMEOUT", cls.write_timeout)),
+            pool_timeout=float(os.environ.get("OPENAI_POOL_TIMEOUT", cls.pool_timeout)),
+            max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", cls.max_retries)),
+        )
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """Transport wrapper counting requests; a request leaves the in-flight count
+    however it ends, including errors, timeouts and cancellation"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.requests_total = 0
+        self.requests_in_flight = 0
+        self.responses_total = 0
+        self.errors_total = 0
+
+    async def handle_async_request(self, request):
+        self.requests_total += 1
+        self.requests_in_flight += 1
+        try:
+            response = await self.inner.handle_async_request(request)
+        except Exception:
+            self.errors_total += 1
+            raise
+        finally:
+            self.requests_in_flight -= 1
+        self.responses_total += 1
+        return response
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class SharedClient:
+    """An AsyncOpenAI client together with its transport, for stats"""
+
+    def __init__(self, config):
+        http2 = config.http2
+        if http2 and not _http2_available():
+            warnings.warn("OPENAI_HTTP2 is set but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+        self.config = config
+        self.http2 = http2
+        limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        )
+        timeout = httpx.Timeout(
+            connect=config.connect_timeout,
+            read=config.read_timeout,
+            write=config.write_timeout,
+            pool=config.pool_timeout,
+        )
+        self.transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+        self.counters = _CountingTransport(self.transport)
+        self.http_client = httpx.AsyncClient(transport=self.counters, timeout=timeout)
+        self.openai_client = AsyncOpenAI(http_client=self.http_client, max_retries=config.max_retries, timeout=timeout)
+
+    def stats(self):
+        stats = {
+            "max_connections": self.config.max_connections,
+            "max_keepalive_connections": self.config.max_keepalive_connections,
+            "http2": self.http2,
+            "requests_total": self.counters.requests_total,
+            "requests_in_flight": self.counters.requests_in_flight,
+            "responses_total": self.counters.responses_total,
+            "errors_total": self.counters.errors_total,
+        }
+        # httpx exposes no pool statistics, so read the underlying httpcore pool when it is there
+        pool = getattr(self.transport, "_pool", None)
+        connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for connection in connections if connection.is_idle())
+        stats.update({
+            "connections_open": len(connections),
+            "connections_idle": idle,
+            "connections_active": len(connections) - idle,
+            "pool_utilization": round((len(connections) - idle) / self.config.max_connections, 3),
+        })
+        return stats
+
+
+_shared = None
+_shared_pid = None
+_shared_lock = threading.Lock()
+
+
+def get_shared(config=None):
+    """The process-wide SharedClient, built on first use (and again after a fork).
+
+    `config` only applies to the first call in a process; later calls return
+    the existing client.
+    """
+    global _shared, _shared_pid
+    with _shared_lock:
+        if _shared is None or _shared_pid != os.getpid():
+            _shared = SharedClient(config or ClientConfig.from_env())
+            _shared_pid = os.getpid()
+        return _shared
+
+
+def get_shared_client(config=None):
+    """The process-wide AsyncOpenAI client"""
+    return get_shared(config).openai_client
+
+
+def install_shared_client(config=None):
+    """Make the shared client the SDK default for agents without an explicit model"""
+    client = get_shared_client(config)
+    set_default_openai_client(client)
+    return client
+
+
+def chat_model(model, config=None):
+    """An OpenAIChatCompletionsModel on the shared client"""
+    return OpenAIChatCompletionsModel(model=model, openai_client=get_shared_client(config))
+
+
+def pool_stats():
+    """Connection pool utilization of the shared client, or {} before it exists"""
+    return get_shared().stats() if _shared is not None and _shared_pid == os.getpid() else {}
+
+
+def pool_config():
+    return asdict(get_shared().config)
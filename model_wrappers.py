@@ -0,0 +1,184 @@
+# Model Wrappers
+#
+# Shared plumbing for layers that sit between an agent and its model (response
+# cache, metrics, resilience, rate limiting). A wrapper is itself a Model, so
+# it plugs in through Agent(model=...) and layers stack by wrapping each other.
+#
+# Once an agent's model is a Model instance the SDK no longer consults
+# RunConfig.model_provider, so an agent without a concrete model gets a
+# DeferredModel at the bottom of its stack. It resolves the model name on each
+# call: against the provider of an enclosing model_provider_scope(), or the
+# default OpenAIProvider otherwise.
+import contextlib
+import contextvars
+import time
+
+from agents import Model, ModelResponse, OpenAIProvider, Usage
+from openai.types.responses import Response, ResponseCompletedEvent
+from openai.types.responses.response_usage import OutputTokensDetails, ResponseUsage
+
+try:
+    from openai.types.responses.response_usage import InputTokensDetails
+except ImportError:  # older openai releases have no input token details
+    InputTokensDetails = None
+
+
+# Clock of the model call attempt the current task is making (see AttemptClock)
+current_attempt = contextvars.ContextVar("current_attempt", default=None)
+# Provider that DeferredModels resolve against in the current task
+current_model_provider = contextvars.ContextVar("current_model_provider", default=None)
+
+
+@contextlib.contextmanager
+def model_provider_scope(provider):
+    """Serve the models of wrapped agents from `provider` inside this block (and tasks it spawns)"""
+    token = current_model_provider.set(provider)
+    try:
+        yield provider
+    finally:
+        current_model_provider.reset(token)
+
+
+class AttemptClock:
+    """Set by a layer that times each attempt (resilience) for the layers beneath it.
+
+    A layer that holds the request back before sending it (rate limiting) adds
+    the time it waits to `queued`, and the timing layer excludes that from the
+    attempt's timeout and latency.
+    """
+
+    def __init__(self):
+        self.queued = 0.0
+
+    def add_queued(self, seconds):
+        self.queued += seconds
+
+
+class DeferredModel(Model):
+    """An agent's model name (or None), resolved against the current provider on every call"""
+
+    def __init__(self, name=None):
+        self.name = name
+        self._default = None
+
+    def resolve(self):
+        provider = current_model_provider.get()
+        if provider is not None:
+            return provider.get_model(self.name)
+        if self._default is None:
+            self._default = OpenAIProvider().get_model(self.name)
+        return self._default
+
+    @property
+    def model(self):
+        return model_name(self.resolve())
+
+    async def get_response(self, *args, **kwargs):
+        return await self.resolve().get_response(*args, **kwargs)
+
+    def stream_response(self, *args, **kwargs):
+        return self.resolve().stream_response(*args, **kwargs)
+
+
+class WrappedModel(Model):
+    """Model that forwards every call to `inner`; subclasses override what they need"""
+
+    def __init__(self, inner, agent_name):
+        self.inner = inner
+        self.agent_name = agent_name
+
+    @property
+    def model_name(self):
+        return model_name(self.inner)
+
+    async def get_response(self, *args, **kwargs):
+        return await self.inner.get_response(*args, **kwargs)
+
+    def stream_response(self, *args, **kwargs):
+        return self.inner.stream_response(*args, **kwargs)
+
+
+def model_name(model):
+    """Best-effort name of the underlying model, looking through wrappers"""
+    while isinstance(model, WrappedModel):
+        model = model.inner
+    return str(getattr(model, "model", type(model).__name__))
+
+
+def find_wrapper(model, wrapper_type):
+    """Return the first layer of type `wrapper_type` in a wrapper stack, or None"""
+    while model is not None:
+        if isinstance(model, wrapper_type):
+            return model
+        model = getattr(model, "inner", None)
+    return None
+
+
+def resolve_model(agent, provider=None):
+    """The Model instance to wrap for an agent: its own, one from `provider`, or a DeferredModel"""
+    if isinstance(agent.model, Model):
+        return agent.model
+    if provider is not None:
+        return provider.get_model(agent.model)
+    return DeferredModel(agent.model)
+
+
+def wrap_agent_models(agents, factory, wrapper_type, provider=None):
+    """Wrap each agent's model with `factory(inner_model, agent)`.
+
+    Agents that already have a `wrapper_type` layer are left alone, so calling
+    this again (for example on a Streamlit rerun) does not stack duplicates.
+    Returns the wrapper of every agent, keyed by agent name.
+    """
+    wrappers = {}
+    for agent in agents:
+        existing = find_wrapper(agent.model, wrapper_type)
+        if existing is None:
+            existing = factory(resolve_model(agent, provider), agent)
+            agent.model = existing
+        wrappers[agent.name] = existing
+    return wrappers
+
+
+def usage_from_response(response):
+    """Usage of a Responses API object (as carried by response.completed events)"""
+    if response.usage is None:
+        return Usage()
+    return Usage(
+        requests=1,
+        input_tokens=response.usage.input_tokens,
+        output_tokens=response.usage.output_tokens,
+        total_tokens=response.usage.total_tokens,
+    )
+
+
+def model_response_from_event(event):
+    """Build the ModelResponse the runner derives from a response.completed event"""
+    return ModelResponse(event.response.output, usage_from_response(event.response), event.response.id)
+
+
+def completed_event(output, usage, response_id, model, sequence_number=0):
+    """A response.completed stream event carrying `output`, for replaying a finished response"""
+    usage_fields = {
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "total_tokens": usage.total_tokens,
+        "output_tokens_details": OutputTokensDetails(reasoning_tokens=0),
+    }
+    if InputTokensDetails is not None:
+        usage_fields["input_tokens_details"] = InputTokensDetails(cached_tokens=0)
+    response = Response.model_construct(
+        id=response_id,
+        object="response",
+        created_at=time.time(),
+        model=model,
+        status="completed",
+        output=list(output),
+        usage=ResponseUsage.model_construct(**usage_fields),
+        tools=[],
+        tool_choice="auto",
+        parallel_tool_calls=False,
+    )
+    return ResponseCompletedEvent.model_construct(
+        type="response.completed", response=response, sequence_number=sequence_number
+    )
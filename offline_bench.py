@@ -0,0 +1,350 @@
+# Offline Benchmark for the Agent Graphs
+#
+# Runs handle_support_case, handle_customer_query and plan_trip end to end
+# against the scripted model backend, so orchestration overhead can be
+# measured (and regressions caught) without network access:
+#
+#   python offline_bench.py --runs 20 --concurrency 4 --latency 0.05
+#
+# --resilience puts the resilience layer in front of the scripted models and
+# --hedge enables hedged requests, so their effect on p99 can be compared.
+# --check runs the behaviour checks below instead and exits non-zero on failure.
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import time
+
+from agents import set_tracing_disabled
+
+from agent_metrics import enable_metrics, write_metrics_file
+from case_budget import BudgetExceeded, CaseBudget, enable_budget_metering, enable_case_budgets
+from model_wrappers import DeferredModel, WrappedModel, find_wrapper, model_provider_scope, wrap_agent_models
+from resilience import ResiliencePolicy, enable_resilience, resilience_stats
+from scripted_model import ScriptedModelProvider, lognormal_latency, restore_models, use_scripted_models
+from ticket_dedup import TicketDeduplicator
+from ticket_store import InMemoryTicketStore
+
+
+def _find(pattern, text, default=""):
+    match = re.search(pattern, text)
+    return match.group(1).strip() if match else default
+
+
+# Support system scripts
+def _support_engineer_start(context):
+    case_id = _find(r"Case ID: (\S+)", context.input_text)
+    if not case_id:
+        # Synthesis requests carry no case, answer straight away
+        return {"text": "Here is a summary of our findings and next steps for your case."}
+    return {"tool": "check_case_details", "arguments": {"case_id": case_id}}
+
+def _support_engineer_route(context):
+    text = context.input_text
+    if "Web Dashboard" in text:
+        return {"handoff": "consult_product_engineer"}
+    if "Data Synchronizer" in text:
+        return {"handoff": "consult_service_engineer"}
+    return {"text": "Please check your firewall settings and verify that your API key is valid."}
+
+def _product_argument(context):
+    return {"product": _find(r"Product: (.+)", context.input_text, "Enterprise Dashboard")}
+
+def _bug_ticket_arguments(context):
+    return {
+        "title": _find(r"Issue: (.+)", context.input_text, "Customer reported defect"),
+        "description": context.last_user_message[:500],
+        "product": _find(r"Product: (.+)", context.input_text, "Enterprise Dashboard"),
+        "severity": "High",
+    }
+
+def _doc_ticket_arguments(context):
+    return {
+        "title": _find(r"Missing Documentation: (.+)", context.input_text, "Missing documentation"),
+        "description": context.last_user_message[:500],
+        "product": _find(r"Product: (.+)", context.input_text, "Enterprise Dashboard"),
+    }
+
+SUPPORT_SCRIPTS = {
+    "Support Engineer": [
+        _support_engineer_start,
+        {"tool": "check_knowledge_base", "arguments": _product_argument},
+        _support_engineer_route,
+    ],
+    "Service Engineer": [
+        {"tool": "check_knowledge_base", "arguments": _product_argument},
+        {"text": "Service analysis based on the knowledge base:\n{tool_output}"},
+    ],
+    "Product Engineer": [
+        {"tool": "check_knowledge_base", "arguments": _product_argument},
+        {"text": "This looks like a bug. Severity: High.\n{tool_output}"},
+    ],
+    "Bug Ticketing Agent": [
+        {"tool": "create_bug_ticket", "arguments": _bug_ticket_arguments},
+        {"text": "{tool_output}"},
+    ],
+    "Documentation Ticketing Agent": [
+        {"tool": "create_doc_request", "arguments": _doc_ticket_arguments},
+        {"text": "{tool_output}"},
+    ],
+}
+
+SUPPORT_CASES = [
+    ("CASE001", "Our team cannot connect to the API service, it keeps showing connection timeout."),
+    ("CASE002", "We encountered a SYNC-404 error when using the data synchronization feature."),
+    ("CASE003", "The 'Refresh Data' button on the dashboard doesn't respond at all."),
+    ("CASE004", "We're experiencing issues with our Enterprise Dashboard. The data visualization components are not displaying correctly, API calls are timing out intermittently, and we can't find documentation on how to configure the advanced filtering options."),
+]
+
+
+# E-commerce system scripts
+def _front_desk_route(context):
+    query = context.last_user_message
+    if "退款" in query or "退货" in query:
+        return {"handoff": "transfer_to_refund_specialist"}
+    if "不满" in query or "投诉" in query or "糟糕" in query:
+        return {"handoff": "transfer_to_complaint_specialist"}
+    return {"handoff": "transfer_to_order_specialist"}
+
+def _order_lookup(context):
+    order_id = _find(r"(ORD\d+)", context.input_text)
+    if not order_id:
+        return {"text": "请提供您的订单号，我来帮您查询。"}
+    return {"tool": "check_order_status", "arguments": {"order_id": order_id}}
+
+ECOMMERCE_SCRIPTS = {
+    "客服前台": [_front_desk_route],
+    "订单查询专员": [
+        _order_lookup,
+        {"tool": "get_tracking_info", "arguments": lambda context: {"order_id": _find(r"(ORD\d+)", context.input_text)}},
+        {"text": "{tool_output}"},
+    ],
+    "退款处理专员": [
+        _order_lookup,
+        {"text": "已确认订单信息，退款将在3-5个工作日内原路退回。{tool_output}"},
+    ],
+    "客户投诉专员": [
+        {"text": "非常抱歉给您带来不便，我们会立即跟进，并为您补偿一张优惠券。"},
+    ],
+}
+
+ECOMMERCE_QUERIES = [
+    "你好，我想查询一下我的订单状态",
+    "我的订单号是ORD12345",
+    "我想申请退款，订单ORD12345中的耳机质量有问题",
+    "我对你们的配送速度非常不满，已经等了一周还没收到货！",
+]
+
+
+# Travel system scripts
+TRAVEL_PLAN = {
+    "destination": "Nepal",
+    "duration": "3 days",
+    "itinerary": "Day 1: Kathmandu. Day 2: Bhaktapur. Day 3: Nagarkot sunrise.",
+    "local_recommendations": "Try momos in Thamel and visit Patan Durbar Square early.",
+    "language_tips": "Namaste (hello), Dhanyabad (thank you).",
+    "summary": "A compact cultural tour of the Kathmandu valley.",
+}
+
+TRAVEL_SCRIPTS = {
+    "旅行规划师": [{"handoff": "consult_local_expert"}],
+    "当地专家": [{"handoff": "consult_language_guide"}],
+    "语言指南": [{"handoff": "compile_travel_plan"}],
+    "旅行计划编译器": [{"text": json.dumps(TRAVEL_PLAN)}],
+}
+
+TRAVEL_PROMPTS = ["规划一个3天的尼泊尔旅行。"]
+
+
+async def _timed_runs(label, make_call, inputs, runs, concurrency, quiet):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(item):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            result = await make_call(item)
+            latencies.append(time.perf_counter() - start)
+            if result is None:
+                failures += 1
+
+    jobs = [inputs[i % len(inputs)] for i in range(runs)]
+    start = time.perf_counter()
+    sink = io.StringIO()
+    with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+        await asyncio.gather(*(one(item) for item in jobs))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<10} runs={runs:<4} failures={failures:<3} elapsed={elapsed:.3f}s "
+          f"throughput={runs / elapsed:.1f}/s p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+
+
+async def run_benchmark(runs=10, concurrency=4, latency=0.0, seed=0, quiet=True, metrics_file=None,
+                        resilience=False, hedge=False):
+    # The agent modules build the shared OpenAI client at import time, which needs a key to exist
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline")
+    from agent_modules import load_ecommerce_agents, load_travel_agents
+    import support_agents
+    ecommerce = load_ecommerce_agents()
+    travel = load_travel_agents()
+
+    model_latency = lognormal_latency(latency) if latency > 0 else None
+    providers = {
+        "support": ScriptedModelProvider(SUPPORT_SCRIPTS, model_latency, seed),
+        "ecommerce": ScriptedModelProvider(ECOMMERCE_SCRIPTS, model_latency, seed),
+        "travel": ScriptedModelProvider(TRAVEL_SCRIPTS, model_latency, seed),
+    }
+    use_scripted_models(support_agents.all_agents, providers["support"])
+    use_scripted_models(ecommerce.all_agents, providers["ecommerce"])
+    use_scripted_models(travel.all_agents, providers["travel"])
+    enable_budget_metering(support_agents.all_agents)
+    resilient = {}
+    if resilience or hedge:
+        policy = ResiliencePolicy(hedge=hedge, hedge_min_delay=0.0)
+        resilient = enable_resilience(support_agents.all_agents + ecommerce.all_agents + travel.all_agents, policy)
+    enable_case_budgets(support_agents.all_agents)
+    if metrics_file:
+        enable_metrics(support_agents.all_agents + ecommerce.all_agents + travel.all_agents)
+
+    print("===== Offline Benchmark =====")
+    print(f"runs={runs} concurrency={concurrency} simulated model latency (median)={latency}s")
+    await _timed_runs("support", lambda case: support_agents.handle_support_case(*case),
+                      SUPPORT_CASES, runs, concurrency, quiet)
+    await _timed_runs("ecommerce", ecommerce.handle_customer_query, ECOMMERCE_QUERIES, runs, concurrency, quiet)
+    await _timed_runs("travel", travel.plan_trip, TRAVEL_PROMPTS, runs, concurrency, quiet)
+    for name, provider in providers.items():
+        print(f"{name} model calls: {provider.total_calls}")
+    if resilient:
+        stats = resilience_stats(resilient).values()
+        totals = {key: sum(agent[key] for agent in stats) for key in ("calls", "retries", "timeouts", "hedges", "hedge_wins", "failures")}
+        print("resilience: " + " ".join(f"{key}={value}" for key, value in totals.items()))
+    if metrics_file:
+        write_metrics_file(metrics_file)
+        print(f"metrics written to {metrics_file}")
+
+
+# Behaviour checks against the scripted models
+async def check_provider_scope(support_agents):
+    """Wrapped agents run against the provider of model_provider_scope, not the live API"""
+    assert all(find_wrapper(agent.model, DeferredModel) for agent in support_agents.all_agents), \
+        "agent models were resolved at import"
+    provider = ScriptedModelProvider(SUPPORT_SCRIPTS, agents=support_agents.all_agents)
+    with model_provider_scope(provider):
+        result = await support_agents.handle_support_case(*SUPPORT_CASES[0], raise_errors=True)
+    assert result is not None and provider.total_calls > 0, "the scripted provider was not used"
+    return f"{provider.total_calls} scripted calls"
+
+
+async def check_case_reruns(support_agents):
+    """Handling a case again, with a new or the same query, files that run's own tickets"""
+    case_id, query = SUPPORT_CASES[3]
+    store = InMemoryTicketStore()
+    saved = support_agents.ticket_store, support_agents.ticket_dedup
+    previous_models = use_scripted_models(support_agents.all_agents, ScriptedModelProvider(SUPPORT_SCRIPTS))
+    # No near-duplicate linking, so only the idempotency keys decide whether a ticket is new
+    support_agents.ticket_store, support_agents.ticket_dedup = store, TicketDeduplicator(store, threshold=1.1)
+    try:
+        seen = set()
+        for customer_query in (query, query + " It is still happening after a restart.", query):
+            result = await support_agents.handle_support_case(case_id, customer_query, raise_errors=True)
+            assert result is not None, "case failed"
+            tickets = {ticket["id"] for ticket in store.list_tickets(case_id=case_id)} - seen
+            assert len(tickets) == 2, f"expected a new bug and doc ticket, got {sorted(tickets)}"
+            seen |= tickets
+    finally:
+        support_agents.ticket_store, support_agents.ticket_dedup = saved
+        restore_models(support_agents.all_agents, previous_models)
+    return f"{len(seen)} tickets over 3 runs"
+
+
+async def check_case_budget(support_agents):
+    """Runs in flight share the case's calls, and every call is capped and charged through the budget layer"""
+    budget = CaseBudget(max_model_calls=12, max_turns_per_run=10)
+    first = await budget.admit()
+    second = asyncio.ensure_future(budget.admit())
+    await asyncio.sleep(0)
+    assert not second.done(), "a run started while the turns it may need were reserved"
+    budget.release(first)
+    second = await second
+    assert second.turns == 10, f"the waiting run got {second.turns} turns after the first gave back its 10"
+    budget.release(second)
+    budget.model_calls = budget.max_model_calls
+    try:
+        await budget.admit()
+        raise AssertionError("a run was admitted with no model calls left")
+    except BudgetExceeded:
+        pass
+
+    sent = []
+
+    class SettingsRecorder(WrappedModel):
+        async def get_response(self, system_instructions, input, model_settings, *args, **kwargs):
+            sent.append(model_settings.max_tokens)
+            return await self.inner.get_response(system_instructions, input, model_settings, *args, **kwargs)
+
+    agents = support_agents.all_agents
+    previous_models = use_scripted_models(agents, ScriptedModelProvider(SUPPORT_SCRIPTS))
+    try:
+        wrap_agent_models(agents, lambda inner, agent: SettingsRecorder(inner, agent.name), SettingsRecorder)
+        enable_case_budgets(agents)
+        budget = CaseBudget(max_output_tokens=2000)
+        run_step = budget.wrap_step(support_agents.run_agent)
+        result = await run_step(1, "Support Engineer Assessment", support_agents.support_engineer, SUPPORT_CASES[0][1], None)
+        assert sent and all(cap is not None and cap <= 2000 for cap in sent), f"max_tokens sent: {sent}"
+        assert budget.model_calls == len(sent) == len(result.raw_responses), "calls were not charged one by one"
+        assert budget._reserved_turns == 0 and budget._reserved_output == 0, "reservations were not released"
+        budget.max_output_tokens = budget.output_tokens
+        try:
+            await run_step(2, "Support Engineer Assessment", support_agents.support_engineer, SUPPORT_CASES[0][1], None)
+            raise AssertionError("a run was admitted with no output tokens left")
+        except BudgetExceeded:
+            pass
+    finally:
+        restore_models(agents, previous_models)
+    return f"{len(sent)} calls capped at {max(sent)} output tokens"
+
+
+async def run_checks(quiet=True):
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline")
+    import support_agents
+    set_tracing_disabled(True)
+    failed = 0
+    for check in (check_provider_scope, check_case_reruns, check_case_budget):
+        sink = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+                detail = await check(support_agents)
+            print(f"{check.__name__}: ok ({detail})")
+        except Exception as e:
+            failed += 1
+            print(f"{check.__name__}: FAILED: {e!r}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the agent graphs against scripted offline models")
+    parser.add_argument("--runs", type=int, default=10, help="runs per entry point")
+    parser.add_argument("--concurrency", type=int, default=4, help="runs in flight at once")
+    parser.add_argument("--latency", type=float, default=0.0, help="median simulated model latency in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the latency distribution")
+    parser.add_argument("--verbose", action="store_true", help="show the entry points' own output")
+    parser.add_argument("--metrics-file", help="instrument the agents and write Prometheus metrics to this file")
+    parser.add_argument("--resilience", action="store_true", help="run model calls through the resilience layer")
+    parser.add_argument("--hedge", action="store_true", help="hedge slow model calls (implies --resilience)")
+    parser.add_argument("--check", action="store_true", help="run the behaviour checks instead of the benchmark")
+    args = parser.parse_args()
+    if args.check:
+        raise SystemExit(1 if asyncio.run(run_checks(quiet=not args.verbose)) else 0)
+    asyncio.run(run_benchmark(args.runs, args.concurrency, args.latency, args.seed, quiet=not args.verbose,
+                              metrics_file=args.metrics_file, resilience=args.resilience, hedge=args.hedge))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# 电商订单库
+#
+# 订单保存在 SQLite（WAL 模式）中，按订单号（主键）、客户邮箱和订单状态建索引，
+# 多个进程共享、重启后仍在。除了单个订单查询，还支持一次查多个订单号或某个客户
+# 的全部订单，并把结果渲染成一张紧凑的表格，让一次工具调用代替 N 次。
+#
+# 数据库默认位于数据目录下的 orders.sqlite3，可用 ORDER_STORE_PATH 修改。
+import json
+import os
+import threading
+
+from storage import connect_sqlite, data_path
+
+ORDER_FIELDS = ("status", "date", "total", "tracking", "customer_email", "items")
+# 一次批量查询最多返回的订单数
+MAX_BATCH = 50
+
+_COLUMNS = ", ".join(("order_id",) + ORDER_FIELDS)
+_GET_SQL = f"SELECT {_COLUMNS} FROM orders WHERE order_id = ?"
+_BY_CUSTOMER_SQL = f"SELECT {_COLUMNS} FROM orders WHERE customer_email = ? ORDER BY date DESC, order_id LIMIT ?"
+_PLACEHOLDERS = ", ".join("?" * (len(ORDER_FIELDS) + 1))
+_REPLACE_SQL = f"INSERT OR REPLACE INTO orders ({_COLUMNS}) VALUES ({_PLACEHOLDERS})"
+_INSERT_IGNORE_SQL = f"INSERT OR IGNORE INTO orders ({_COLUMNS}) VALUES ({_PLACEHOLDERS})"
+_BY_CUSTOMER_STATUS_SQL = (
+    f"SELECT {_COLUMNS} FROM orders WHERE customer_email = ? AND status = ? ORDER BY date DESC, order_id LIMIT ?"
+)
+
+
+def _row_to_order(row):
+    order = dict(zip(ORDER_FIELDS, row[1:]))
+    order["items"] = json.loads(order["items"]) if order["items"] else []
+    return order
+
+
+def _order_values(order_id, order):
+    values = [order.get(field) for field in ORDER_FIELDS]
+    values[ORDER_FIELDS.index("items")] = json.dumps(order.get("items", []), ensure_ascii=False)
+    return (order_id,) + tuple(values)
+
+
+class OrderStore:
+    """SQLite 订单库；每个线程使用自己的连接"""
+
+    def __init__(self, path=None):
+        self.path = path or data_path("orders.sqlite3")
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                order_id TEXT PRIMARY KEY,
+                status TEXT,
+                date TEXT,
+                total REAL,
+                tracking TEXT,
+                customer_email TEXT,
+                items TEXT
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders (customer_email, date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, date)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def get(self, order_id):
+        row = self._conn().execute(_GET_SQL, (order_id,)).fetchone()
+        return _row_to_order(row) if row is not None else None
+
+    def get_many(self, order_ids):
+        """{订单号: 订单}，只含存在的订单；一条 IN 查询完成"""
+        order_ids = list(dict.fromkeys(order_ids))
+        if not order_ids:
+            return {}
+        placeholders = ", ".join("?" * len(order_ids))
+        rows = self._conn().execute(f"SELECT {_COLUMNS} FROM orders WHERE order_id IN ({placeholders})", order_ids).fetchall()
+        return {row[0]: _row_to_order(row) for row in rows}
+
+    def by_customer(self, customer_email, status=None, limit=MAX_BATCH):
+        """客户的订单，按下单日期从新到旧：[(订单号, 订单), ...]"""
+        if status:
+            rows = self._conn().execute(_BY_CUSTOMER_STATUS_SQL, (customer_email, status, limit)).fetchall()
+        else:
+            rows = self._conn().execute(_BY_CUSTOMER_SQL, (customer_email, limit)).fetchall()
+        return [(row[0], _row_to_order(row)) for row in rows]
+
+    def import_orders(self, orders, replace=True):
+        """批量导入 {订单号: 订单}；replace=False 时已存在的订单保持不变"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(_REPLACE_SQL if replace else _INSERT_IGNORE_SQL,
+                             [_order_values(order_id, order) for order_id, order in orders.items()])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def format_order_table(orders, missing=()):
+    """把 [(订单号, 订单), ...] 渲染成一张紧凑的表格，并列出未找到的订单号"""
+    lines = []
+    if orders:
+        lines.append("订单号 | 状态 | 下单日期 | 金额 | 物流单号 | 商品")
+        for order_id, order in orders:
+            lines.append(f"{order_id} | {order['status']} | {order['date']} | ¥{order['total']} | "
+                         f"{order.get('tracking') or '-'} | {'、'.join(order['items'])}")
+    if missing:
+        lines.append(f"未找到订单: {', '.join(missing)}")
+    return "\n".join(lines) if lines else "没有找到任何订单"
+
+
+def create_order_store():
+    """位于 ORDER_STORE_PATH（默认数据目录下的 orders.sqlite3）的订单库"""
+    return OrderStore(os.environ.get("ORDER_STORE_PATH"))
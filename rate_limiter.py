@@ -0,0 +1,241 @@
+# Client-Side Rate Limiter
+#
+# Meters model calls against the provider's requests-per-minute and
+# tokens-per-minute quotas, so that many concurrent cases queue for capacity
+# instead of all receiving 429s at once. One pair of token buckets is kept per
+# model and shared by every agent in the process that uses it.
+#
+# Every request sent reserves one request and its estimated tokens
+# (instructions and input counted with the local tokenizer, plus the expected
+# output). The layer sits beneath the resilience layer, so each retry and
+# hedge is metered as the request it is. Reservations may run a bucket into
+# debt; each caller then sleeps until the bucket has refilled past its
+# reservation, so waiting calls are served in arrival order at exactly the
+# quota rate. Once the response arrives, the estimate is replaced by the actual
+# usage; a request that failed gives its tokens back.
+#
+# Quotas come from the environment; models without a quota are not limited:
+#   RATE_LIMIT_RPM, RATE_LIMIT_TPM          default quota of every model
+#   RATE_LIMITS                             per model, '{"gpt-4o": {"rpm": 500, "tpm": 30000}}'
+#   RATE_LIMIT_BURST_SECONDS                seconds of quota that may be used at once (default 10)
+import asyncio
+import json
+import os
+import threading
+import time
+
+from openai.types.responses import ResponseCompletedEvent
+
+from agent_metrics import registry as default_registry
+from context_compaction import count_tokens
+from model_wrappers import WrappedModel, current_attempt, wrap_agent_models
+
+# Output tokens assumed for a call whose model settings set no max_tokens
+ESTIMATED_OUTPUT_TOKENS = 500
+DEFAULT_BURST_SECONDS = 10.0
+
+
+class TokenBucket:
+    """Refills `per_minute` units a minute up to `capacity`; reservations may run it into debt"""
+
+    def __init__(self, per_minute, capacity):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """Take `amount` (at most a full bucket); returns seconds until the bucket covers it"""
+        self._refill(now)
+        self.level -= min(amount, self.capacity)
+        return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount, now):
+        """Take `amount` more (or give back a negative amount) without waiting"""
+        self._refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+
+class RateLimiter:
+    """Request and token buckets of one model; None quotas are unlimited"""
+
+    def __init__(self, model, rpm=None, tpm=None, burst_seconds=DEFAULT_BURST_SECONDS, registry=default_registry):
+        self.model = model
+        self.rpm = rpm
+        self.tpm = tpm
+        self.registry = registry
+        self.requests = TokenBucket(rpm, max(1.0, rpm * burst_seconds / 60)) if rpm else None
+        self.tokens = TokenBucket(tpm, max(1.0, tpm * burst_seconds / 60)) if tpm else None
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.estimated_tokens = 0
+        self.actual_tokens = 0
+
+    @property
+    def limited(self):
+        return self.requests is not None or self.tokens is not None
+
+    def _adjust(self, requests, tokens):
+        with self._lock:
+            now = time.monotonic()
+            if self.requests is not None:
+                self.requests.adjust(requests, now)
+            if self.tokens is not None:
+                self.tokens.adjust(tokens, now)
+
+    async def acquire(self, tokens):
+        """Wait until one request of about `tokens` tokens fits in the quota"""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.requests is not None:
+                wait = self.requests.reserve(1, now)
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            self.calls += 1
+            self.estimated_tokens += tokens
+            if wait > 0:
+                self.delayed += 1
+                self.wait_seconds += wait
+        self.registry.histogram("model_rate_limit_wait_seconds", "Time model calls waited for rate limit capacity",
+                                model=self.model).observe(wait)
+        clock = current_attempt.get()
+        if clock is not None:
+            # Queueing does not count against the attempt's timeout
+            clock.add_queued(wait)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # A call that never went out gives its reservation back
+                self._adjust(-1, -tokens)
+                raise
+
+    def settle(self, estimated, actual):
+        """Replace a call's estimated tokens with what it actually used"""
+        with self._lock:
+            self.actual_tokens += actual
+        self._adjust(0, actual - estimated)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "model": self.model,
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "calls": self.calls,
+                "delayed": self.delayed,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "estimated_tokens": self.estimated_tokens,
+                "actual_tokens": self.actual_tokens,
+            }
+
+
+class RateLimits:
+    """Quotas by model name and the process-wide limiter of each model"""
+
+    def __init__(self, default=None, per_model=None, burst_seconds=DEFAULT_BURST_SECONDS, registry=default_registry):
+        self.default = dict(default or {})
+        self.per_model = dict(per_model or {})
+        self.burst_seconds = burst_seconds
+        self.registry = registry
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        default = {}
+        if os.environ.get("RATE_LIMIT_RPM"):
+            default["rpm"] = float(os.environ["RATE_LIMIT_RPM"])
+        if os.environ.get("RATE_LIMIT_TPM"):
+            default["tpm"] = float(os.environ["RATE_LIMIT_TPM"])
+        per_model = json.loads(os.environ["RATE_LIMITS"]) if os.environ.get("RATE_LIMITS") else {}
+        return cls(default, per_model, float(os.environ.get("RATE_LIMIT_BURST_SECONDS", DEFAULT_BURST_SECONDS)))
+
+    def for_model(self, model):
+        with self._lock:
+            limiter = self._limiters.get(model)
+            if limiter is None:
+                quota = dict(self.default, **self.per_model.get(model, {}))
+                limiter = self._limiters[model] = RateLimiter(model, quota.get("rpm"), quota.get("tpm"),
+                                                              self.burst_seconds, self.registry)
+            return limiter
+
+    def stats(self):
+        with self._lock:
+            limiters = list(self._limiters.values())
+        return {limiter.model: limiter.stats() for limiter in limiters if limiter.limited}
+
+
+# Shared by every agent in the process
+rate_limits = RateLimits.from_env()
+
+
+def estimate_tokens(system_instructions, input, model_settings):
+    """Tokens a call is expected to use: its instructions and input plus the expected output"""
+    text = input if isinstance(input, str) else json.dumps(input, default=str, ensure_ascii=False)
+    output = getattr(model_settings, "max_tokens", None) or ESTIMATED_OUTPUT_TOKENS
+    return count_tokens(system_instructions or "") + count_tokens(text) + output
+
+
+class RateLimitedModel(WrappedModel):
+    """Holds every call of the wrapped model until its model's quota has room"""
+
+    def __init__(self, inner, agent_name, limits=rate_limits):
+        super().__init__(inner, agent_name)
+        self.limits = limits
+
+    async def get_response(self, system_instructions, input, model_settings, *args, **kwargs):
+        limiter = self.limits.for_model(self.model_name)
+        if not limiter.limited:
+            return await self.inner.get_response(system_instructions, input, model_settings, *args, **kwargs)
+        estimated = estimate_tokens(system_instructions, input, model_settings)
+        await limiter.acquire(estimated)
+        # A cancelled request (such as a hedge that lost) was already sent and keeps its estimate
+        actual = estimated
+        try:
+            response = await self.inner.get_response(system_instructions, input, model_settings, *args, **kwargs)
+            actual = response.usage.input_tokens + response.usage.output_tokens
+            return response
+        except Exception:
+            actual = 0
+            raise
+        finally:
+            limiter.settle(estimated, actual)
+
+    async def stream_response(self, system_instructions, input, model_settings, *args, **kwargs):
+        limiter = self.limits.for_model(self.model_name)
+        if not limiter.limited:
+            async for event in self.inner.stream_response(system_instructions, input, model_settings, *args, **kwargs):
+                yield event
+            return
+        estimated = estimate_tokens(system_instructions, input, model_settings)
+        await limiter.acquire(estimated)
+        actual = None
+        try:
+            async for event in self.inner.stream_response(system_instructions, input, model_settings, *args, **kwargs):
+                if isinstance(event, ResponseCompletedEvent) and event.response.usage is not None:
+                    actual = event.response.usage.input_tokens + event.response.usage.output_tokens
+                yield event
+        except Exception:
+            actual = 0 if actual is None else actual
+            raise
+        finally:
+            limiter.settle(estimated, estimated if actual is None else actual)
+
+
+def enable_rate_limits(agents, limits=rate_limits, provider=None):
+    """Meter every agent's model calls against `limits`; returns the limits.
+
+    Apply it before enable_resilience, so every retry and hedge reserves its
+    own quota; the resilience layer leaves time spent queueing out of each
+    attempt's timeout.
+    """
+    wrap_agent_models(agents, lambda inner, agent: RateLimitedModel(inner, agent.name, limits), RateLimitedModel, provider)
+    return limits
@@ -0,0 +1,248 @@
+# Model Call Resilience
+#
+# A wrapper layer that keeps one slow or failed completion from stalling or
+# killing a whole case. Every model call an agent makes gets
+#   - a per-attempt timeout, started once the attempt has left the rate
+#     limiter's queue (see AttemptClock),
+#   - retries with exponential backoff and full jitter for retryable errors
+#     (timeouts, connection errors, 408/409/429 and 5xx responses; a
+#     Retry-After header is honoured), and
+#   - optionally a hedged request: when an attempt has not answered within the
+#     agent's recent p95 latency, a duplicate is sent and whichever returns
+#     first wins. Model calls have no side effects (tools run afterwards, in
+#     the runner), so the loser is simply cancelled.
+# Streamed calls get the timeout (per event) and are retried only until their
+# first event has been passed on; they are never hedged.
+#
+# Policies come from ResiliencePolicy.from_env():
+#   RESILIENCE_TIMEOUT, RESILIENCE_MAX_ATTEMPTS, RESILIENCE_BACKOFF_BASE,
+#   RESILIENCE_BACKOFF_MAX, RESILIENCE_HEDGE, RESILIENCE_HEDGE_QUANTILE,
+#   RESILIENCE_HEDGE_MIN_DELAY, RESILIENCE_MAX_HEDGES
+# and may be overridden per agent, in code or with RESILIENCE_AGENT_POLICIES
+# ('{"Product Engineer": {"timeout": 120, "hedge": true}}'). Retries, timeouts,
+# hedges and hedge wins are counted per agent in the metrics registry.
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, replace
+
+import openai
+
+from agent_metrics import registry as default_registry
+from model_wrappers import AttemptClock, WrappedModel, current_attempt, wrap_agent_models
+
+RETRYABLE_STATUS = {408, 409, 429}
+# Latencies kept per agent for the hedge delay
+LATENCY_WINDOW = 200
+
+
+def _env_bool(name, default):
+    value = os.environ.get(name)
+    return default if value is None else value.strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class ResiliencePolicy:
+    timeout: float = 60.0
+    max_attempts: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_delay: float = 1.0
+    hedge_min_samples: int = 20
+    max_hedges: int = 1
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            timeout=float(os.environ.get("RESILIENCE_TIMEOUT", cls.timeout)),
+            max_attempts=int(os.environ.get("RESILIENCE_MAX_ATTEMPTS", cls.max_attempts)),
+            backoff_base=float(os.environ.get("RESILIENCE_BACKOFF_BASE", cls.backoff_base)),
+            backoff_max=float(os.environ.get("RESILIENCE_BACKOFF_MAX", cls.backoff_max)),
+            hedge=_env_bool("RESILIENCE_HEDGE", cls.hedge),
+            hedge_quantile=float(os.environ.get("RESILIENCE_HEDGE_QUANTILE", cls.hedge_quantile)),
+            hedge_min_delay=float(os.environ.get("RESILIENCE_HEDGE_MIN_DELAY", cls.hedge_min_delay)),
+            max_hedges=int(os.environ.get("RESILIENCE_MAX_HEDGES", cls.max_hedges)),
+        )
+
+
+def agent_policies_from_env():
+    """Per-agent overrides from RESILIENCE_AGENT_POLICIES, as {agent name: {field: value}}"""
+    value = os.environ.get("RESILIENCE_AGENT_POLICIES")
+    return json.loads(value) if value else {}
+
+
+def is_retryable(error):
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return False
+
+
+def _retry_after(error):
+    """Seconds requested by a Retry-After header, if the error carries one"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class ResilientModel(WrappedModel):
+    """Applies a ResiliencePolicy to every call of the wrapped model"""
+
+    def __init__(self, inner, agent_name, policy, registry=default_registry):
+        super().__init__(inner, agent_name)
+        self.policy = policy
+        self.registry = registry
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {"calls": 0, "attempts": 0, "retries": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+
+    def _count(self, name, help):
+        self.stats[name] += 1
+        self.registry.counter(f"model_{name}_total", help, agent=self.agent_name).inc()
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging: the policy quantile of recent latencies, or None (no hedge)"""
+        if not self.policy.hedge or len(self.latencies) < self.policy.hedge_min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.policy.hedge_quantile))
+        return max(self.policy.hedge_min_delay, ordered[index])
+
+    def backoff(self, attempt, error):
+        """Full-jitter exponential backoff before retry `attempt` (1-based), at least any Retry-After"""
+        ceiling = min(self.policy.backoff_max, self.policy.backoff_base * 2 ** (attempt - 1))
+        delay = random.uniform(0, ceiling)
+        retry_after = _retry_after(error)
+        return max(delay, min(retry_after, self.policy.backoff_max)) if retry_after is not None else delay
+
+    def _start(self, make_awaitable):
+        """Start one attempt as a task with its own AttemptClock; returns (task, clock, start time)"""
+        clock = AttemptClock()
+        token = current_attempt.set(clock)
+        try:
+            task = asyncio.ensure_future(make_awaitable())
+        finally:
+            current_attempt.reset(token)
+        return task, clock, time.perf_counter()
+
+    async def _within_timeout(self, task, clock, start):
+        """Result of an attempt's task; time it spent queued for rate limit capacity extends the timeout"""
+        try:
+            while True:
+                remaining = start + clock.queued + self.policy.timeout - time.perf_counter()
+                if remaining <= 0:
+                    self._count("timeouts", "Model call attempts that timed out")
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait({task}, timeout=remaining)
+                if done:
+                    return task.result()
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def _timed(self, call):
+        self._count("attempts", "Model call attempts, including retries and hedges")
+        task, clock, start = self._start(call)
+        response = await self._within_timeout(task, clock, start)
+        self.latencies.append(time.perf_counter() - start - clock.queued)
+        return response
+
+    async def _hedged(self, call):
+        """One attempt; when it is slower than the hedge delay, duplicates race it"""
+        first = asyncio.ensure_future(self._timed(call))
+        running = [first]
+        hedges = 0
+        error = None
+        try:
+            while running:
+                delay = self.hedge_delay() if hedges < self.policy.max_hedges else None
+                done, _ = await asyncio.wait(running, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedges += 1
+                    self._count("hedges", "Duplicate model requests sent after the hedge delay")
+                    running.append(asyncio.ensure_future(self._timed(call)))
+                    continue
+                winner = None
+                for task in done:
+                    running.remove(task)
+                    if task.exception() is None:
+                        winner = winner or task
+                    else:
+                        error = task.exception()
+                if winner is not None:
+                    if winner is not first:
+                        self._count("hedge_wins", "Hedged model requests that answered first")
+                    return winner.result()
+            raise error
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _call(self, call):
+        self._count("calls", "Model calls made through the resilience layer")
+        for attempt in range(1, self.policy.max_attempts + 1):
+            try:
+                return await self._hedged(call)
+            except Exception as error:
+                if attempt >= self.policy.max_attempts or not is_retryable(error):
+                    self._count("failures", "Model calls that failed after all retries")
+                    raise
+                self._count("retries", "Model call retries after a retryable error")
+                await asyncio.sleep(self.backoff(attempt, error))
+
+    async def get_response(self, *args, **kwargs):
+        return await self._call(lambda: self.inner.get_response(*args, **kwargs))
+
+    async def stream_response(self, *args, **kwargs):
+        self._count("calls", "Model calls made through the resilience layer")
+        attempt = 1
+        while True:
+            self._count("attempts", "Model call attempts, including retries and hedges")
+            stream = self.inner.stream_response(*args, **kwargs)
+            started = False
+            try:
+                while True:
+                    try:
+                        event = await self._within_timeout(*self._start(stream.__anext__))
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield event
+            except Exception as error:
+                if started or attempt >= self.policy.max_attempts or not is_retryable(error):
+                    self._count("failures", "Model calls that failed after all retries")
+                    raise
+                self._count("retries", "Model call retries after a retryable error")
+                await asyncio.sleep(self.backoff(attempt, error))
+                attempt += 1
+            finally:
+                await stream.aclose()
+
+
+def enable_resilience(agents, policy=None, overrides=None, provider=None, registry=default_registry):
+    """Wrap every agent's model in a ResilientModel; returns the wrappers by agent name.
+
+    `overrides` maps agent names to policy fields that differ from `policy`
+    (default: ResiliencePolicy.from_env() with RESILIENCE_AGENT_POLICIES).
+    Agents that already have a resilience layer keep it.
+    """
+    policy = policy or ResiliencePolicy.from_env()
+    overrides = dict(agent_policies_from_env(), **(overrides or {}))
+
+    def factory(inner, agent):
+        return ResilientModel(inner, agent.name, replace(policy, **overrides.get(agent.name, {})), registry)
+
+    return wrap_agent_models(agents, factory, ResilientModel, provider)
+
+
+def resilience_stats(wrappers):
+    """Per-agent counters and policy of the wrappers returned by enable_resilience"""
+    return {name: dict(model.stats, policy=asdict(model.policy)) for name, model in wrappers.items()}
@@ -0,0 +1,273 @@
+# Persistent Model Response Cache
+#
+# Opt-in cache in front of the model call. Identical requests (same agent,
+# instructions, tool schema, model settings and input items) are answered from
+# a local SQLite file instead of paying for the completion again.
+#
+# The cache can be switched on or off for one caller's runs only (for example
+# one UI session) with response_cache_scope, without touching the other
+# callers sharing the same wrapped agents.
+import contextlib
+import contextvars
+import dataclasses
+import hashlib
+import json
+import pickle
+import threading
+import time
+
+from model_wrappers import WrappedModel, completed_event, model_response_from_event, wrap_agent_models
+from openai.types.responses import ResponseCompletedEvent
+from storage import connect_sqlite, data_path
+
+# Least recently used entries evicted per statement once the cache is over its bounds
+EVICT_BATCH = 64
+
+
+# Overrides ResponseCache.enabled for the model calls of the current task and the tasks it starts
+cache_enabled = contextvars.ContextVar("cache_enabled", default=None)
+
+
+@contextlib.contextmanager
+def response_cache_scope(enabled):
+    """Switch the response cache on or off for the model calls started inside the block"""
+    token = cache_enabled.set(enabled)
+    try:
+        yield
+    finally:
+        cache_enabled.reset(token)
+
+
+def _json_default(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    return str(value)
+
+
+def _tool_schema(tool):
+    schema = {"name": getattr(tool, "name", type(tool).__name__)}
+    for field in ("description", "params_json_schema", "strict_json_schema"):
+        if hasattr(tool, field):
+            schema[field] = getattr(tool, field)
+    return schema
+
+
+def cache_key(agent_name, model, system_instructions, input, model_settings, tools, output_schema, handoffs, previous_response_id=None):
+    """Stable hash of everything that determines a completion"""
+    payload = {
+        "agent": agent_name,
+        "model": model,
+        "instructions": system_instructions,
+        "tools": [_tool_schema(tool) for tool in tools],
+        "handoffs": [
+            {"tool_name": h.tool_name, "description": h.tool_description, "parameters": h.input_json_schema}
+            for h in handoffs
+        ],
+        "output_schema": (
+            output_schema.json_schema() if output_schema is not None and not output_schema.is_plain_text() else None
+        ),
+        "model_settings": model_settings,
+        "input": input,
+        "previous_response_id": previous_response_id,
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=_json_default, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed response store with TTL expiry and LRU size bounds.
+
+    Entries older than `ttl` seconds are treated as misses and removed. When the
+    cache holds more than `max_entries` entries or `max_bytes` of payload, the
+    least recently used entries are evicted. Entry and byte totals are kept
+    as running counts, read from the file when it is opened and refreshed by
+    `stats()`, so a put never scans the table. Setting `enabled` to False makes
+    every cached model call straight through without reading or writing,
+    except inside a response_cache_scope, which takes precedence.
+    """
+
+    def __init__(self, path=None, max_entries=10000, max_bytes=256 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path or data_path("response_cache.sqlite3")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+        self._conn = connect_sqlite(self.path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                agent TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at)")
+        self._entries, self._bytes = self._totals()
+
+    def _totals(self):
+        return self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def get(self, key):
+        """Return the cached ModelResponse for `key`, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at, size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                if self._conn.execute("DELETE FROM responses WHERE key = ?", (key,)).rowcount:
+                    self._entries -= 1
+                    self._bytes -= row[2]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def put(self, key, agent_name, response):
+        value = pickle.dumps(response)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, agent, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, agent_name, value, len(value), now, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if old is None:
+                self._entries += 1
+            self._bytes += len(value) - (old[0] if old else 0)
+            self.stores += 1
+            self._evict()
+
+    def _evict(self):
+        # Oldest first through the accessed_at index, one bounded batch per statement
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at LIMIT ?", (EVICT_BATCH,)
+                ).fetchall()
+                evict = []
+                entries, total_bytes = self._entries, self._bytes
+                for key, size in rows:
+                    if entries <= self.max_entries and total_bytes <= self.max_bytes:
+                        break
+                    evict.append(key)
+                    entries -= 1
+                    total_bytes -= size
+                if evict:
+                    self._conn.execute(
+                        f"DELETE FROM responses WHERE key IN ({', '.join('?' * len(evict))})", evict
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if not rows:
+                # Another process emptied the file; start counting from what is there
+                self._entries, self._bytes = self._totals()
+                return
+            self._entries, self._bytes = entries, total_bytes
+            self.evictions += len(evict)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._entries, self._bytes = 0, 0
+
+    def stats(self):
+        with self._lock:
+            # Also picks up entries written or removed by other processes sharing the file
+            self._entries, self._bytes = self._totals()
+            entries, total_bytes = self._entries, self._bytes
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "stores": self.stores,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
+
+
+class CachedModel(WrappedModel):
+    """Answers repeated requests from a ResponseCache, calling the wrapped model on misses"""
+
+    def __init__(self, inner, agent_name, cache):
+        super().__init__(inner, agent_name)
+        self.cache = cache
+
+    def _enabled(self):
+        enabled = cache_enabled.get()
+        return self.cache.enabled if enabled is None else enabled
+
+    def _key(self, system_instructions, input, model_settings, tools, output_schema, handoffs, kwargs):
+        return cache_key(self.agent_name, self.model_name, system_instructions, input, model_settings,
+                         tools, output_schema, handoffs, kwargs.get("previous_response_id"))
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs):
+        if not self._enabled():
+            return await self.inner.get_response(
+                system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs
+            )
+        key = self._key(system_instructions, input, model_settings, tools, output_schema, handoffs, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        response = await self.inner.get_response(
+            system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs
+        )
+        self.cache.put(key, self.agent_name, response)
+        return response
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs):
+        if not self._enabled():
+            async for event in self.inner.stream_response(
+                system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs
+            ):
+                yield event
+            return
+        key = self._key(system_instructions, input, model_settings, tools, output_schema, handoffs, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            # Replay the finished response as a single completed event
+            yield completed_event(cached.output, cached.usage, f"resp_cached_{key[:16]}", self.model_name)
+            return
+        async for event in self.inner.stream_response(
+            system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs
+        ):
+            if isinstance(event, ResponseCompletedEvent):
+                self.cache.put(key, self.agent_name, model_response_from_event(event))
+            yield event
+
+
+def enable_response_cache(agents, cache=None, provider=None):
+    """Put a response cache in front of every agent's model and return the cache.
+
+    Agents that are already cached keep their existing cache, which is the one
+    returned in that case.
+    """
+    cache = cache or ResponseCache()
+    wrappers = wrap_agent_models(agents, lambda inner, agent: CachedModel(inner, agent.name, cache), CachedModel, provider)
+    return next(iter(wrappers.values())).cache if wrappers else cache
@@ -0,0 +1,314 @@
+# Offline Scripted Model Backend
+#
+# A deterministic stand-in for the OpenAI models used by the agent graphs, so
+# handle_support_case, handle_customer_query and plan_trip can run end to end
+# without network access. Responses, tool calls and handoffs come from a
+# per-agent script, and every call sleeps for a configurable simulated latency.
+import asyncio
+import hashlib
+import json
+import math
+import random
+import zlib
+
+from agents import Model, ModelProvider, ModelResponse, Usage, set_tracing_disabled
+from openai.types.responses import (
+    ResponseFunctionToolCall,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+)
+
+from model_wrappers import completed_event
+
+
+# Latency distributions: callables taking a random.Random and returning seconds
+def constant_latency(seconds):
+    return lambda rng: seconds
+
+def uniform_latency(low, high):
+    return lambda rng: rng.uniform(low, high)
+
+def lognormal_latency(median, sigma=0.5):
+    """Right-skewed latency, closer to real completion times than a uniform spread"""
+    return lambda rng: rng.lognormvariate(math.log(median), sigma)
+
+
+def _resolve_latency(latency):
+    if latency is None:
+        return constant_latency(0.0)
+    if callable(latency):
+        return latency
+    if isinstance(latency, (tuple, list)):
+        return uniform_latency(*latency)
+    return constant_latency(float(latency))
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class ScriptContext:
+    """What a scripted step can see about the turn it is answering"""
+
+    def __init__(self, agent_name, step, input_text, last_user_message, last_tool_output, tool_names, handoff_names):
+        self.agent_name = agent_name
+        self.step = step
+        self.input_text = input_text
+        self.last_user_message = last_user_message
+        self.last_tool_output = last_tool_output
+        self.tool_names = tool_names
+        self.handoff_names = handoff_names
+
+
+class ScriptedModel(Model):
+    """Model that replays a script instead of calling an API.
+
+    `script` is a list of steps played in order for one agent run. Each step is a
+    dict, or a callable taking a ScriptContext and returning a dict (or None for
+    the default reply):
+
+        {"text": "..."}                            final answer; "{input}" and
+                                                   "{tool_output}" are substituted
+        {"tool": "name", "arguments": {...}}       call a function tool; arguments
+                                                   may be a callable of the context
+        {"handoff": "transfer_tool_name"}          hand off to another agent
+
+    The current step is derived from the conversation itself (how many calls this
+    agent has made since the last user message), never from instance state, so one model can serve
+    many concurrent runs deterministically.
+    """
+
+    def __init__(self, agent_name, script=None, latency=None, seed=0):
+        self.agent_name = agent_name
+        self.script = list(script or [])
+        self.latency = _resolve_latency(latency)
+        self._rng = random.Random(seed ^ zlib.crc32(agent_name.encode("utf-8")))
+        self._call_prefix = "call_" + hashlib.md5(agent_name.encode("utf-8")).hexdigest()[:8] + "_"
+        self.calls = 0
+
+    async def get_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs):
+        output, usage = await self._respond(input, tools, output_schema, handoffs)
+        return ModelResponse(output, usage, None)
+
+    async def stream_response(self, system_instructions, input, model_settings, tools, output_schema, handoffs, tracing, *args, **kwargs):
+        output, usage = await self._respond(input, tools, output_schema, handoffs)
+        sequence_number = 0
+        for output_index, item in enumerate(output):
+            if isinstance(item, ResponseOutputMessage):
+                text = item.content[0].text
+                for start in range(0, len(text), 16):
+                    yield ResponseTextDeltaEvent.model_construct(
+                        type="response.output_text.delta",
+                        item_id=item.id,
+                        output_index=output_index,
+                        content_index=0,
+                        delta=text[start:start + 16],
+                        logprobs=[],
+                        sequence_number=sequence_number,
+                    )
+                    sequence_number += 1
+        yield completed_event(output, usage, f"resp_scripted_{self.calls}", f"scripted:{self.agent_name}", sequence_number)
+
+    async def _respond(self, input, tools, output_schema, handoffs):
+        self.calls += 1
+        delay = self.latency(self._rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        items = [{"role": "user", "content": input}] if isinstance(input, str) else list(input)
+        context = self._build_context(items, tools, handoffs)
+        step = self._next_step(context)
+        output = [self._render_step(step, context, output_schema)]
+
+        input_text = context.input_text
+        output_text = json.dumps([_item_text(item) for item in output], ensure_ascii=False)
+        input_tokens = estimate_tokens(input_text)
+        output_tokens = estimate_tokens(output_text)
+        usage = Usage(requests=1, input_tokens=input_tokens, output_tokens=output_tokens,
+                      total_tokens=input_tokens + output_tokens)
+        return output, usage
+
+    def _build_context(self, items, tools, handoffs):
+        step = 0
+        last_user_message = ""
+        last_tool_output = ""
+        texts = []
+        for item in items:
+            item = _as_dict(item)
+            item_type = item.get("type")
+            if item_type == "function_call" and str(item.get("call_id", "")).startswith(self._call_prefix):
+                step += 1
+            elif item_type == "function_call_output":
+                last_tool_output = str(item.get("output", ""))
+                texts.append(last_tool_output)
+            elif item.get("role") == "user":
+                # Each new user message starts the script over (multi-turn conversations)
+                step = 0
+                last_user_message = _content_text(item.get("content"))
+                texts.append(last_user_message)
+            elif item.get("role") == "assistant":
+                texts.append(_content_text(item.get("content")))
+        return ScriptContext(
+            agent_name=self.agent_name,
+            step=step,
+            input_text="\n".join(texts),
+            last_user_message=last_user_message,
+            last_tool_output=last_tool_output,
+            tool_names=[tool.name for tool in tools],
+            handoff_names=[handoff.tool_name for handoff in handoffs],
+        )
+
+    def _next_step(self, context):
+        if context.step >= len(self.script):
+            return None
+        step = self.script[context.step]
+        return step(context) if callable(step) else step
+
+    def _render_step(self, step, context, output_schema):
+        if step is None:
+            return self._message(self._default_text(context, output_schema))
+
+        if "tool" in step or "handoff" in step:
+            name = step.get("tool") or step.get("handoff")
+            allowed = context.tool_names if "tool" in step else context.handoff_names
+            if name not in allowed:
+                raise ValueError(
+                    f"Script for '{self.agent_name}' calls '{name}', which is not one of its "
+                    f"{'tools' if 'tool' in step else 'handoffs'}: {allowed}"
+                )
+            arguments = step.get("arguments", {})
+            if callable(arguments):
+                arguments = arguments(context)
+            return ResponseFunctionToolCall(
+                id=f"fc_{self._call_prefix}{context.step}",
+                call_id=f"{self._call_prefix}{context.step}",
+                type="function_call",
+                name=name,
+                arguments=json.dumps(arguments, ensure_ascii=False),
+                status="completed",
+            )
+
+        text = step["text"]
+        if callable(text):
+            text = text(context)
+        text = text.replace("{input}", context.last_user_message[:200]).replace("{tool_output}", context.last_tool_output)
+        return self._message(text)
+
+    def _default_text(self, context, output_schema):
+        if output_schema is not None and not output_schema.is_plain_text():
+            properties = output_schema.json_schema().get("properties", {})
+            return json.dumps({key: f"Scripted {key} from {self.agent_name}" for key in properties}, ensure_ascii=False)
+        return f"[{self.agent_name}] Scripted response to: {context.last_user_message[:80]}"
+
+    def _message(self, text):
+        return ResponseOutputMessage(
+            id=f"msg_{self._call_prefix}{self.calls}",
+            type="message",
+            role="assistant",
+            status="completed",
+            content=[ResponseOutputText(type="output_text", text=text, annotations=[])],
+        )
+
+
+class ScriptedModelProvider(ModelProvider):
+    """Hands out one ScriptedModel per agent.
+
+    `scripts` maps agent names to scripts. Use it either by assigning models to
+    agents directly (use_scripted_models) or by running the agents inside
+    model_wrappers.model_provider_scope(provider). In the latter case only the
+    model name reaches the provider, so register the agents with `agents=` and
+    each request is matched to its agent by its system instructions.
+
+    RunConfig(model_provider=...) only reaches agents without a model layer;
+    the agent modules wrap every model (resilience, rate limits) at import, so
+    use the scope for them.
+    """
+
+    def __init__(self, scripts=None, latency=None, seed=0, agents=None):
+        self.scripts = dict(scripts or {})
+        self.latency = latency
+        self.seed = seed
+        self._models = {}
+        self._names_by_instructions = {}
+        for agent in agents or []:
+            if isinstance(agent.instructions, str):
+                self._names_by_instructions[agent.instructions] = agent.name
+
+    def get_model(self, model_name):
+        if model_name is None and self._names_by_instructions:
+            return _InstructionRoutedModel(self)
+        name = model_name or "default"
+        if name not in self._models:
+            self._models[name] = ScriptedModel(name, self.scripts.get(name), self.latency, self.seed)
+        return self._models[name]
+
+    @property
+    def total_calls(self):
+        return sum(model.calls for model in self._models.values())
+
+
+class _InstructionRoutedModel(Model):
+    """Picks the scripted model for whichever registered agent owns the instructions"""
+
+    def __init__(self, provider):
+        self.provider = provider
+
+    def _model_for(self, system_instructions):
+        name = self.provider._names_by_instructions.get(system_instructions)
+        return self.provider.get_model(name) if name else self.provider.get_model("default")
+
+    async def get_response(self, system_instructions, *args, **kwargs):
+        return await self._model_for(system_instructions).get_response(system_instructions, *args, **kwargs)
+
+    def stream_response(self, system_instructions, *args, **kwargs):
+        return self._model_for(system_instructions).stream_response(system_instructions, *args, **kwargs)
+
+
+def use_scripted_models(agents, provider, disable_tracing=True):
+    """Point every agent at its scripted model, replacing any live model it had.
+
+    Returns the previous models so a caller can restore them afterwards. Trace
+    export is disabled by default because it would otherwise try to reach the
+    OpenAI backend.
+    """
+    previous = {agent.name: agent.model for agent in agents}
+    for agent in agents:
+        agent.model = provider.get_model(agent.name)
+    if disable_tracing:
+        set_tracing_disabled(True)
+    return previous
+
+
+def restore_models(agents, previous):
+    for agent in agents:
+        agent.model = previous.get(agent.name, agent.model)
+
+
+def _as_dict(item):
+    if isinstance(item, dict):
+        return item
+    if hasattr(item, "model_dump"):
+        return item.model_dump()
+    return {}
+
+
+def _content_text(content):
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            part = _as_dict(part)
+            parts.append(str(part.get("text", "")))
+        return "".join(parts)
+    return ""
+
+
+def _item_text(item):
+    if isinstance(item, ResponseOutputMessage):
+        return item.content[0].text
+    if isinstance(item, ResponseFunctionToolCall):
+        return f"{item.name}({item.arguments})"
+    return ""
@@ -0,0 +1,30 @@
+# Local Storage Helpers
+#
+# The caches and stores in this project keep their data in SQLite files under
+# one data directory, which can be moved with the AGENT_DATA_DIR variable.
+import os
+import sqlite3
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.environ.get("AGENT_DATA_DIR", os.path.join(BASE_DIR, ".agent_data"))
+
+
+def data_path(filename):
+    """Path of `filename` inside the data directory, creating the directory if needed"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, filename)
+
+
+def connect_sqlite(path):
+    """Open a SQLite connection shared across threads, in WAL mode for concurrent readers.
+
+    The connection runs in autocommit mode; group statements with explicit
+    BEGIN/COMMIT where they must be atomic. Callers sharing one connection
+    between threads must serialize access themselves.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+    if path != ":memory:":
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
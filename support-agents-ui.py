@@ -1,5 +1,4 @@
 import streamlit as st
-import asyncio
 import uuid
 from datetime import datetime
 import graphviz
@@ -8,9 +7,16 @@ import os
 
 # Import from support-agents.py
 from support_agents import (
-    support_engineer, handle_support_case, 
-    support_cases, knowledge_base, devops_tickets
+    support_engineer, 
+    case_store, ticket_store, all_agents, resilience
 )
+from response_cache import enable_response_cache, response_cache_scope
+from support_streaming import stream_support_case
+from agent_runtime import get_runtime
+from model_client import pool_stats
+from rate_limiter import rate_limits
+from resilience import resilience_stats
+from agent_metrics import enable_metrics, start_metrics_server
 
 # Page configuration
 st.set_page_config(
@@ -18,6 +24,26 @@ st.set_page_config(
     layout="wide"
 )
 
+# One event loop and OpenAI client per process, shared by every rerun and session.
+# The agent graph itself lives in the support_agents module, which Python imports once.
+# Agents are instrumented once; set METRICS_PORT to serve Prometheus metrics at /metrics.
+@st.cache_resource
+def get_agent_runtime():
+    enable_metrics(all_agents)
+    if os.environ.get("METRICS_PORT"):
+        start_metrics_server(int(os.environ["METRICS_PORT"]))
+    return get_runtime()
+
+runtime = get_agent_runtime()
+
+# The response cache is installed once per process and off by default;
+# each session switches it on for its own runs only (see response_cache_scope)
+@st.cache_resource
+def get_response_cache():
+    cache = enable_response_cache(all_agents)
+    cache.enabled = False
+    return cache
+
 # Title and description
 st.title("Support Case Handling System")
 st.markdown("Enter your case details below to get assistance from our support team.")
@@ -43,6 +69,31 @@ with st.sidebar:
         for key in list(st.session_state.keys()):
             del st.session_state[key]
         st.experimental_rerun()
+    
+    # Opt-in response cache: identical requests (e.g. the demo case) are answered locally
+    st.header("Response Cache")
+    use_cache = st.checkbox("Cache model responses", value=False)
+    if use_cache:
+        cache_stats = get_response_cache().stats()
+        st.markdown(f"Hits: {cache_stats['hits']} | Misses: {cache_stats['misses']} | Entries: {cache_stats['entries']}")
+
+    # Utilization of the shared HTTP connection pool behind every model call
+    st.header("Connection Pool")
+    stats = pool_stats()
+    if stats:
+        st.markdown(f"Open: {stats['connections_open']} / {stats['max_connections']} | "
+                    f"Active: {stats['connections_active']} | Idle: {stats['connections_idle']} | "
+                    f"Requests: {stats['requests_total']}")
+
+    # Retries, timeouts and hedged requests of the resilience layer around every model call
+    st.header("Model Calls")
+    call_stats = resilience_stats(resilience).values()
+    totals = {key: sum(agent[key] for agent in call_stats) for key in ("calls", "retries", "timeouts", "hedges", "hedge_wins", "failures")}
+    st.markdown(f"Calls: {totals['calls']} | Retries: {totals['retries']} | Timeouts: {totals['timeouts']} | "
+                f"Hedges: {totals['hedges']} (won {totals['hedge_wins']}) | Failures: {totals['failures']}")
+    for model, limiter_stats in rate_limits.stats().items():
+        st.markdown(f"{model} quota: {limiter_stats['delayed']} of {limiter_stats['calls']} calls queued, "
+                    f"{limiter_stats['wait_seconds']}s waiting")
 
 # Main interface
 col1, col2 = st.columns([1, 1])
@@ -92,60 +143,100 @@ if submit_button and case_description:
         case_id = f"CASE-{uuid.uuid4().hex[:6].upper()}"
     st.session_state.case_id = case_id
     
-    # Display processing status
-    with st.spinner("Processing your case..."):
-        # Create temporary case
-        temp_case = {
-            "title": "Support Case",
-            "description": case_description,
-            "status": "New",
-            "customer_email": "user@example.com",
-            "created_at": datetime.now().strftime("%Y-%m-%d"),
-            "product": "General Support",
-            "service": "User Service"
-        }
+    # Create temporary case
+    temp_case = {
+        "title": "Support Case",
+        "description": case_description,
+        "status": "New",
+        "customer_email": "user@example.com",
+        "created_at": datetime.now().strftime("%Y-%m-%d"),
+        "product": "General Support",
+        "service": "User Service"
+    }
+    
+    # Add to case database (the demo case keeps its stored record)
+    if not (run_demo_case and case_store.exists(case_id)):
+        case_store.put(case_id, temp_case)
+    
+    # Render agent output live while the case is processed
+    with col2:
+        st.header("Live Progress")
+        status_placeholder = st.empty()
+        status_placeholder.info("Processing your case...")
+        step_placeholders = {}
+        step_text = {}
+    
+    def render_event(event):
+        step = event.get("step")
+        if event["type"] == "step_started":
+            with col2:
+                step_placeholders[step] = st.empty()
+            step_text[step] = f"**Step {step}: {event['title']}** ({event['agent']})\n\n"
+        elif event["type"] == "text_delta":
+            step_text[step] += event["delta"]
+        elif event["type"] == "tool_call":
+            step_text[step] += f"\n\n`{event['agent']} → {event['tool']}({event['arguments']})`\n\n"
+        elif event["type"] == "handoff":
+            step_text[step] += f"\n\n_Handoff: {event['source']} → {event['target']}_\n\n"
+        elif event["type"] == "step_completed":
+            status_placeholder.info(f"Step {step} completed")
+        if step in step_placeholders:
+            step_placeholders[step].markdown(step_text[step])
+    
+    # Process case, consuming the event stream as it arrives
+    try:
+        # Run on the shared background loop so connections survive between submissions
+        result = None
+        # The cache toggle applies to this session's runs only
+        with response_cache_scope(use_cache):
+            for event in runtime.iterate(stream_support_case(case_id, case_description)):
+                if event["type"] == "case_completed":
+                    result = event["result"]
+                elif event["type"] == "error":
+                    raise event["error"]
+                else:
+                    render_event(event)
+        status_placeholder.success("Case processed")
         
-        # Add to case database
-        support_cases[case_id] = temp_case
+        # Store result in session state
+        st.session_state.result = result
+        st.session_state.case_processed = True
         
-        # Clear previous tickets
-        devops_tickets.clear()
+        # Extract handoff information
+        if hasattr(result, 'all_handoffs'):
+            # Use all_handoffs from complex case handler
+            st.session_state.handoffs_occurred = result.all_handoffs
+        elif hasattr(result, 'new_items') and result.new_items:
+            # Use standard handoff mechanism
+            handoffs_occurred = [item for item in result.new_items if item.type == "handoff_output_item"]
+            st.session_state.handoffs_occurred = handoffs_occurred
+        else:
+            st.session_state.handoffs_occurred = []
         
-        # Process case asynchronously
-        try:
-            # Create and run event loop
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            result = loop.run_until_complete(handle_support_case(case_id, case_description))
-            loop.close()
-            
-            # Store result in session state
-            st.session_state.result = result
-            st.session_state.case_processed = True
-            
-            # Extract handoff information
-            if hasattr(result, 'all_handoffs'):
-                # Use all_handoffs from complex case handler
-                st.session_state.handoffs_occurred = result.all_handoffs
-            elif hasattr(result, 'new_items') and result.new_items:
-                # Use standard handoff mechanism
-                handoffs_occurred = [item for item in result.new_items if item.type == "handoff_output_item"]
-                st.session_state.handoffs_occurred = handoffs_occurred
-            else:
-                st.session_state.handoffs_occurred = []
-            
-            # Store tickets
-            st.session_state.tickets = devops_tickets.copy()
-            
-        except Exception as e:
-            st.error(f"Error processing case: {str(e)}")
-            st.session_state.case_processed = False
+        # Store the tickets created for this case only
+        st.session_state.tickets = ticket_store.list_tickets(case_id=case_id)
+        
+    except Exception as e:
+        st.error(f"Error processing case: {str(e)}")
+        st.session_state.case_processed = False
 
 # Display results in the second column
 with col2:
     if st.session_state.case_processed and st.session_state.result:
         st.header("Support Response")
         st.markdown(st.session_state.result.final_output)
+        if getattr(st.session_state.result, 'budget_exhausted', False):
+            st.warning(f"This case was cut short by its processing budget: {st.session_state.result.budget_reason}")
+        
+        # Per-case latency and token summary
+        case_metrics = getattr(st.session_state.result, 'metrics', None)
+        if case_metrics:
+            with st.expander("Case Metrics"):
+                totals = case_metrics['totals']
+                st.markdown(f"Wall time: {case_metrics['wall_seconds']:.2f}s | Model time: {totals['model_seconds']:.2f}s | "
+                            f"Tool time: {totals['tool_seconds']:.2f}s | Tokens: {totals['input_tokens']} in / {totals['output_tokens']} out")
+                if case_metrics['steps']:
+                    st.table(case_metrics['steps'])
         
         # Display handoff path
         if st.session_state.handoffs_occurred:
@@ -233,8 +324,8 @@ with col2:
         with st.expander("View detailed process logs", expanded=False):
             # Display case details
             st.subheader("Case Details")
-            if st.session_state.case_id in support_cases:
-                case = support_cases[st.session_state.case_id]
+            case = case_store.get(st.session_state.case_id)
+            if case is not None:
                 st.code(f"Case ID: {st.session_state.case_id}\nTitle: {case['title']}\nDescription: {case['description']}\nProduct: {case['product']}\nService: {case['service']}")
             
             # Display initial assessment
@@ -1,168 +1,88 @@
 # Support Case Handling System Module
-from agents import Agent, Runner, handoff, AsyncOpenAI, function_tool
+from agents import Agent, Runner, handoff, function_tool
 from agents.extensions.handoff_prompt import prompt_with_handoff_instructions
 import asyncio
 import json
 import os
-from datetime import datetime
 from dotenv import load_dotenv
+from agent_metrics import case_metrics, timed_step
+from case_store import create_case_store
+from case_checkpoints import CaseCheckpoint, create_checkpoint_store, run_key
+from case_budget import BudgetExceeded, CaseBudget, enable_budget_metering, enable_case_budgets, max_turns
+from context_compaction import ContextCompactor
+from workflow import Step, Workflow, run_workflow
+from model_client import install_shared_client
+from rate_limiter import enable_rate_limits
+from resilience import enable_resilience
+from kb_snapshots import case_file_source, knowledge_base_source, start_watcher
+from ticket_dedup import TicketDeduplicator
+from ticket_store import case_context, create_ticket_store, current_case_id, run_context, step_scoped, ticket_url
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Mock Database
-support_cases = {
-    "CASE001": {
-        "title": "Unable to connect to service",
-        "description": "Customer reports unable to connect to our API service, connection timeout.",
-        "status": "Pending",
-        "customer_email": "customer@example.com",
-        "created_at": "2025-03-10",
-        "product": "API Gateway",
-        "service": "Connection Service"
-    },
-    "CASE002": {
-        "title": "Data synchronization failure",
-        "description": "Customer encountered an error when using the data synchronization feature, error code: SYNC-404.",
-        "status": "Pending",
-        "customer_email": "client@example.com",
-        "created_at": "2025-03-11",
-        "product": "Data Synchronizer",
-        "service": "Sync Service"
-    },
-    "CASE003": {
-        "title": "User interface button not responding",
-        "description": "Customer reports that the 'Refresh Data' button on the dashboard page does not respond after clicking.",
-        "status": "Pending",
-        "customer_email": "user@example.com",
-        "created_at": "2025-03-12",
-        "product": "Web Dashboard",
-        "service": "Frontend Service"
-    },
-    "CASE004": {
-        "title": "Complex issue with multiple components",
-        "description": "Customer reports a complex issue that involves both frontend and backend components, with potential documentation gaps.",
-        "status": "Pending",
-        "customer_email": "enterprise@example.com",
-        "created_at": "2025-03-13",
-        "product": "Enterprise Dashboard",
-        "service": "Full Stack Service"
-    }
-}
+# All agents share one pooled OpenAI client per process (tuned via model_client.py)
+install_shared_client()
 
-# Mock Knowledge Base
-knowledge_base = {
-    "API Gateway": {
-        "common_issues": [
-            "Connection timeouts are usually caused by firewall settings or network configuration issues",
-            "API key validation failures may be due to expired keys or insufficient permissions"
-        ],
-        "troubleshooting": [
-            "Check network connections and firewall settings",
-            "Verify if the API key is valid",
-            "Check the service status page to confirm if the service is running normally"
-        ]
-    },
-    "Data Synchronizer": {
-        "common_issues": [
-            "SYNC-404 error indicates that the source data to be synchronized cannot be found",
-            "Synchronization failures may be due to data format incompatibility or permission issues"
-        ],
-        "troubleshooting": [
-            "Confirm that the source data exists and is accessible",
-            "Check if the data format meets the requirements",
-            "Verify user permission settings"
-        ]
-    },
-    "Web Dashboard": {
-        "common_issues": [
-            "Unresponsive buttons may be caused by JavaScript errors",
-            "Slow page loading is usually related to large data volumes or network latency"
-        ],
-        "troubleshooting": [
-            "Clear browser cache and cookies",
-            "Try using a different browser",
-            "Check the browser console for error messages"
-        ]
-    },
-    "Enterprise Dashboard": {
-        "common_issues": [
-            "Integration issues between frontend and backend components",
-            "Performance degradation with large datasets",
-            "Authentication and authorization problems across multiple services"
-        ],
-        "troubleshooting": [
-            "Check system logs for errors in both frontend and backend components",
-            "Verify API endpoints are correctly configured",
-            "Ensure all required services are running",
-            "Check user permissions across all integrated systems"
-        ]
-    }
-}
+# Case records in SQLite, shared across processes and restarts (see case_store.py)
+case_store = create_case_store()
+
+# Knowledge base snapshots and case data, loaded from data/*.json and reloaded when the files change
+# (see kb_snapshots.py); the sample cases are seeded into the case store
+kb_source = knowledge_base_source()
+case_source = case_file_source(case_store)
+snapshot_watcher = start_watcher([kb_source, case_source])
 
-# Mock Azure DevOps Ticket System
-devops_tickets = []
-ticket_counter = 1001
+# Mock Azure DevOps Ticket System (in-memory by default, TICKET_STORE=sqlite for a shared durable store)
+ticket_store = create_ticket_store()
+
+# Reports that closely match an open ticket of the same type and product are linked to it
+ticket_dedup = TicketDeduplicator(ticket_store)
+
+# Completed complex-case steps, so a failed case resumes where it stopped (CHECKPOINT_STORE=sqlite|memory)
+checkpoint_store = create_checkpoint_store()
 
 # Define Tool Functions
 @function_tool
 def check_case_details(case_id: str) -> str:
     """Query support case details"""
-    if case_id in support_cases:
-        case = support_cases[case_id]
+    case = case_store.get(case_id)
+    if case is not None:
         return f"Case {case_id} details:\nTitle: {case['title']}\nDescription: {case['description']}\nStatus: {case['status']}\nProduct: {case['product']}\nService: {case['service']}\nCreated at: {case['created_at']}"
     return f"Case {case_id} not found"
 
 @function_tool
 def check_knowledge_base(product: str) -> str:
-    """Query product knowledge base information"""
-    if product in knowledge_base:
-        kb = knowledge_base[product]
-        common_issues = "\n".join([f"- {issue}" for issue in kb["common_issues"]])
-        troubleshooting = "\n".join([f"- {step}" for step in kb["troubleshooting"]])
-        return f"Product '{product}' knowledge base:\n\nCommon issues:\n{common_issues}\n\nTroubleshooting steps:\n{troubleshooting}"
-    return f"Knowledge base information for product '{product}' not found"
+    """Query product knowledge base information by product name or issue keywords"""
+    return kb_source.current.lookup(product)
+
+# How the current case is attached to a near-duplicate ticket, for the tool replies
+def duplicate_link(ticket):
+    case_id = current_case_id.get()
+    if case_id is not None and ticket.get("case_id") == case_id:
+        return "this case filed it earlier, so no new occurrence was recorded"
+    occurrences = [o["case_id"] for o in ticket.get("occurrences", ())]
+    if case_id in occurrences:
+        return f"this case is linked to it as occurrence #{occurrences.index(case_id) + 1}"
+    return f"this case was linked to it as occurrence #{len(occurrences)}"
 
 @function_tool
 def create_bug_ticket(title: str, description: str, product: str, severity: str) -> str:
     """Create Bug ticket"""
-    global ticket_counter
-    ticket_id = f"BUG-{ticket_counter}"
-    ticket_counter += 1
-    
-    ticket = {
-        "id": ticket_id,
-        "type": "Bug",
-        "title": title,
-        "description": description,
-        "product": product,
-        "severity": severity,
-        "status": "New",
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    
-    devops_tickets.append(ticket)
-    return f"Bug ticket created: {ticket_id}\nTitle: {title}\nProduct: {product}\nSeverity: {severity}\nStatus: New\nAzure DevOps URL: https://dev.azure.com/company/project/_workitems/edit/{ticket_id}"
+    ticket, duplicate = ticket_dedup.file_ticket("Bug", title, description, product, severity=severity)
+    ticket_id = ticket["id"]
+    if duplicate:
+        return f"Existing bug ticket {ticket_id} already tracks this issue; {duplicate_link(ticket)}\nTitle: {ticket['title']}\nProduct: {ticket['product']}\nSeverity: {ticket.get('severity')}\nStatus: {ticket['status']}\nAzure DevOps URL: {ticket_url(ticket_id)}"
+    return f"Bug ticket created: {ticket_id}\nTitle: {ticket['title']}\nProduct: {ticket['product']}\nSeverity: {ticket.get('severity')}\nStatus: {ticket['status']}\nAzure DevOps URL: {ticket_url(ticket_id)}"
 
 @function_tool
 def create_doc_request(title: str, description: str, product: str) -> str:
     """Create documentation request ticket"""
-    global ticket_counter
-    ticket_id = f"DOC-{ticket_counter}"
-    ticket_counter += 1
-    
-    ticket = {
-        "id": ticket_id,
-        "type": "Documentation",
-        "title": title,
-        "description": description,
-        "product": product,
-        "status": "New",
-        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-    
-    devops_tickets.append(ticket)
-    return f"Documentation request ticket created: {ticket_id}\nTitle: {title}\nProduct: {product}\nStatus: New\nAzure DevOps URL: https://dev.azure.com/company/project/_workitems/edit/{ticket_id}"
+    ticket, duplicate = ticket_dedup.file_ticket("Documentation", title, description, product)
+    ticket_id = ticket["id"]
+    if duplicate:
+        return f"Existing documentation request {ticket_id} already covers this; {duplicate_link(ticket)}\nTitle: {ticket['title']}\nProduct: {ticket['product']}\nStatus: {ticket['status']}\nAzure DevOps URL: {ticket_url(ticket_id)}"
+    return f"Documentation request ticket created: {ticket_id}\nTitle: {ticket['title']}\nProduct: {ticket['product']}\nStatus: {ticket['status']}\nAzure DevOps URL: {ticket_url(ticket_id)}"
 
 # Define additional tool functions for complex case handling
 @function_tool
@@ -372,36 +292,86 @@ support_engineer.handoffs = [
     create_bug_ticket_handoff
 ]
 
+# Every agent in the graph, for code that needs to configure all of their models
+all_agents = [support_engineer, service_engineer, product_engineer, documentation_agent, bug_agent]
+
+# Timeouts, retries with backoff and optional hedging around every model call (see resilience.py);
+# every attempt and hedge queues against the process-wide requests/tokens-per-minute quotas (see rate_limiter.py)
+enable_rate_limits(all_agents)
+# Every attempt and hedge is charged to the case budget; every model call of a case is checked against
+# and capped by it (see case_budget.py)
+enable_budget_metering(all_agents)
+resilience = enable_resilience(all_agents)
+enable_case_budgets(all_agents)
+
+# Print the tickets created while handling a case
+def print_case_tickets(case_id):
+    tickets = ticket_store.list_tickets(case_id=case_id)
+    if tickets:
+        print("\n===== Created Tickets =====")
+        for ticket in tickets:
+            print(f"ID: {ticket['id']}")
+            print(f"Type: {ticket['type']}")
+            print(f"Title: {ticket['title']}")
+            print(f"Product: {ticket['product']}")
+            if 'severity' in ticket:
+                print(f"Severity: {ticket['severity']}")
+            print(f"Status: {ticket['status']}")
+            if ticket.get('occurrences'):
+                print(f"Linked occurrences: {len(ticket['occurrences'])}")
+            print(f"Created at: {ticket['created_at']}")
+            print(f"URL: {ticket_url(ticket['id'])}")
+            print("---")
+
 # Main function
-async def handle_support_case(case_id, customer_query=None):
+async def handle_support_case(case_id, customer_query=None, concurrent=True, raise_errors=False, budget=None):
+    # Tickets created and metrics recorded while handling this case are attributed to it
+    budget = budget or CaseBudget.from_env()
+    with case_context(case_id), case_metrics(case_id) as metrics:
+        result = await _handle_support_case(case_id, customer_query, concurrent, raise_errors, budget)
+        if result is not None:
+            result.metrics = metrics.summary()
+            result.budget = budget.summary()
+        return result
+
+# Case details as presented to the agents
+def build_case_details(case_id):
+    case = case_store.get(case_id)
+    if case is not None:
+        return f"Case ID: {case_id}\nTitle: {case['title']}\nDescription: {case['description']}\nProduct: {case['product']}\nService: {case['service']}"
+    return f"Case {case_id} not found"
+
+# Opening request for the Support Engineer
+def build_case_query(case_details, customer_query=None):
+    if customer_query:
+        return f"Please handle the following support case:\n{case_details}\n\nCustomer query: {customer_query}"
+    return f"Please handle the following support case:\n{case_details}"
+
+# Cases that go through the multi-step complex case handler: those whose product has a complex-case playbook
+def is_complex_case(case_id):
+    case = case_store.get(case_id)
+    return case is not None and case.get("product") in complex_case_playbooks
+
+async def _handle_support_case(case_id, customer_query, concurrent, raise_errors, budget):
     print(f"\n===== New Support Case =====")
     
     # Get case details
-    case_details = ""
-    if case_id in support_cases:
-        case = support_cases[case_id]
-        case_details = f"Case ID: {case_id}\nTitle: {case['title']}\nDescription: {case['description']}\nProduct: {case['product']}\nService: {case['service']}"
-    else:
-        case_details = f"Case {case_id} not found"
-    
+    case_details = build_case_details(case_id)
     print(case_details)
     
     # Build query
-    if customer_query:
-        query = f"Please handle the following support case:\n{case_details}\n\nCustomer query: {customer_query}"
-    else:
-        query = f"Please handle the following support case:\n{case_details}"
-    
+    query = build_case_query(case_details, customer_query)
     print(f"\nCustomer query: {customer_query if customer_query else 'No additional query'}")
 
-    # For complex case (CASE004), use the specialized handler
-    if case_id == "CASE004":
-        return await handle_complex_case(case_id, case_details, customer_query)
+    # For complex cases, use the specialized handler
+    if is_complex_case(case_id):
+        return await handle_complex_case(case_id, case_details, customer_query, concurrent=concurrent, raise_errors=raise_errors, budget=budget)
 
     # For regular cases, use the standard handler
     try:
         # Run support engineer agent
-        result = await Runner.run(support_engineer, query)
+        run_step = timed_step(budget.wrap_step(run_agent))
+        result = await run_step(1, "Support Engineer Assessment", support_engineer, query, None)
         print(f"\nSupport Engineer response: {result.final_output}")
 
         # Print handoff path information
@@ -419,72 +389,39 @@ async def handle_support_case(case_id, customer_query=None):
                 print("\nNo handoff occurred, Support Engineer handled the request directly")
 
         # Print created tickets (if any)
-        if devops_tickets:
-            print("\n===== Created Tickets =====")
-            for ticket in devops_tickets:
-                print(f"ID: {ticket['id']}")
-                print(f"Type: {ticket['type']}")
-                print(f"Title: {ticket['title']}")
-                print(f"Product: {ticket['product']}")
-                if 'severity' in ticket:
-                    print(f"Severity: {ticket['severity']}")
-                print(f"Status: {ticket['status']}")
-                print(f"Created at: {ticket['created_at']}")
-                print(f"URL: https://dev.azure.com/company/project/_workitems/edit/{ticket['id']}")
-                print("---")
+        print_case_tickets(case_id)
 
         return result
+    except BudgetExceeded as e:
+        print(f"\nBudget exhausted for case {case_id}: {e}")
+        return budget.degraded_result(str(e))
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error processing case: {e}")
         return None
 
-# Specialized handler for complex cases with multiple handoffs
-async def handle_complex_case(case_id, case_details, customer_query=None):
-    print(f"\n===== Complex Case Handler =====")
-    print(f"Processing complex case: {case_id}")
-    
-    # Build initial query
-    if customer_query:
-        query = f"Please handle the following complex support case:\n{case_details}\n\nCustomer query: {customer_query}"
-    else:
-        query = f"Please handle the following complex support case:\n{case_details}"
-    
-    # Track all handoffs for visualization
-    all_handoffs = []
-    
-    try:
+# Run an agent without logging
+async def run_agent(step, title, agent, prompt, label):
+    return await Runner.run(agent, prompt, max_turns=max_turns())
+
+# Complex case playbooks: the steps, agents and prompts used for each product
+enterprise_dashboard_playbook = Workflow(
+    "Enterprise Dashboard complex case",
+    [
         # Step 1: Initial consultation with Support Engineer
-        print("\n----- Step 1: Initial Support Engineer Assessment -----")
-        initial_result = await Runner.run(support_engineer, query)
-        print(f"Support Engineer initial assessment: {initial_result.final_output}")
-        
-        # Extract handoffs from initial consultation
-        if hasattr(initial_result, 'new_items') and initial_result.new_items:
-            initial_handoffs = [item for item in initial_result.new_items if item.type == "handoff_output_item"]
-            all_handoffs.extend(initial_handoffs)
-        
-        # Step 2: First consultation with Service Engineer about backend issues
-        print("\n----- Step 2: First Service Engineer Consultation -----")
-        service_query = f"""
+        Step("initial", "Initial Support Engineer Assessment", support_engineer,
+             "Please handle the following complex support case:\n{case_details}{customer_query_section}",
+             label="Support Engineer initial assessment"),
+        # Steps 2-4: Service Engineer consultation chain about backend issues
+        Step("service_1", "First Service Engineer Consultation", service_engineer, """
         I need your expertise on a complex case:
         {case_details}
         
         The customer is experiencing API calls timing out intermittently. 
         Can you provide an initial assessment of what might be causing these backend issues?
-        """
-        service_result_1 = await Runner.run(service_engineer, service_query)
-        print(f"Service Engineer initial response: {service_result_1.final_output}")
-        
-        # Record this handoff manually since we're not using the handoff mechanism
-        all_handoffs.append({
-            "source_agent": {"name": "Support Engineer"},
-            "target_agent": {"name": "Service Engineer"},
-            "tool_name": "direct_consultation_1"
-        })
-        
-        # Step 3: Support Engineer requests more information from Service Engineer
-        print("\n----- Step 3: Support Engineer Follows Up with Service Engineer -----")
-        followup_query = f"""
+        """, label="Service Engineer initial response"),
+        Step("service_2", "Support Engineer Follows Up with Service Engineer", service_engineer, """
         Thank you for your initial assessment. I need more specific information:
         
         1. What logs should we request from the customer to diagnose the API timeout issues?
@@ -493,20 +430,8 @@ async def handle_complex_case(case_id, case_details, customer_query=None):
         
         Original case details:
         {case_details}
-        """
-        service_result_2 = await Runner.run(service_engineer, followup_query)
-        print(f"Service Engineer follow-up response: {service_result_2.final_output}")
-        
-        # Record this handoff
-        all_handoffs.append({
-            "source_agent": {"name": "Support Engineer"},
-            "target_agent": {"name": "Service Engineer"},
-            "tool_name": "direct_consultation_2"
-        })
-        
-        # Step 4: Support Engineer provides additional information to Service Engineer
-        print("\n----- Step 4: Support Engineer Provides Additional Information -----")
-        additional_info = f"""
+        """, label="Service Engineer follow-up response", depends_on=["service_1"]),
+        Step("service_3", "Support Engineer Provides Additional Information", service_engineer, """
         I've gathered the following information from the customer:
         
         - API timeouts occur approximately every 15 minutes
@@ -518,39 +443,16 @@ async def handle_complex_case(case_id, case_details, customer_query=None):
         
         Original case details:
         {case_details}
-        """
-        service_result_3 = await Runner.run(service_engineer, additional_info)
-        print(f"Service Engineer detailed response: {service_result_3.final_output}")
-        
-        # Record this handoff
-        all_handoffs.append({
-            "source_agent": {"name": "Support Engineer"},
-            "target_agent": {"name": "Service Engineer"},
-            "tool_name": "direct_consultation_3"
-        })
-        
-        # Step 5: First consultation with Product Engineer about frontend issues
-        print("\n----- Step 5: First Product Engineer Consultation -----")
-        product_query = f"""
+        """, label="Service Engineer detailed response", depends_on=["service_2"]),
+        # Steps 5-7: Product Engineer consultation chain about frontend issues
+        Step("product_1", "First Product Engineer Consultation", product_engineer, """
         I need your expertise on a complex case:
         {case_details}
         
         The customer is experiencing issues with data visualization components not displaying correctly.
         Can you analyze whether this is a bug, documentation issue, or user error?
-        """
-        product_result_1 = await Runner.run(product_engineer, product_query)
-        print(f"Product Engineer initial response: {product_result_1.final_output}")
-        
-        # Record this handoff
-        all_handoffs.append({
-            "source_agent": {"name": "Support Engineer"},
-            "target_agent": {"name": "Product Engineer"},
-            "tool_name": "direct_consultation_1"
-        })
-        
-        # Step 6: Support Engineer requests more information from Product Engineer
-        print("\n----- Step 6: Support Engineer Follows Up with Product Engineer -----")
-        product_followup = f"""
+        """, label="Product Engineer initial response"),
+        Step("product_2", "Support Engineer Follows Up with Product Engineer", product_engineer, """
         Thank you for your initial assessment. I need more specific information:
         
         1. What browser console errors should we look for related to the visualization issues?
@@ -559,20 +461,8 @@ async def handle_complex_case(case_id, case_details, customer_query=None):
         
         Original case details:
         {case_details}
-        """
-        product_result_2 = await Runner.run(product_engineer, product_followup)
-        print(f"Product Engineer follow-up response: {product_result_2.final_output}")
-        
-        # Record this handoff
-        all_handoffs.append({
-            "source_agent": {"name": "Support Engineer"},
-            "target_agent": {"name": "Product Engineer"},
-            "tool_name": "direct_consultation_2"
-        })
-        
-        # Step 7: Support Engineer provides additional information to Product Engineer
-        print("\n----- Step 7: Support Engineer Provides Additional Information to Product Engineer -----")
-        product_additional_info = f"""
+        """, label="Product Engineer follow-up response", depends_on=["product_1"]),
+        Step("product_3", "Support Engineer Provides Additional Information to Product Engineer", product_engineer, """
         I've gathered the following information from the customer:
         
         - The visualization issues occur in Chrome, Firefox, and Edge browsers
@@ -584,20 +474,9 @@ async def handle_complex_case(case_id, case_details, customer_query=None):
         
         Original case details:
         {case_details}
-        """
-        product_result_3 = await Runner.run(product_engineer, product_additional_info)
-        print(f"Product Engineer detailed response: {product_result_3.final_output}")
-        
-        # Record this handoff
-        all_handoffs.append({
-            "source_agent": {"name": "Support Engineer"},
-            "target_agent": {"name": "Product Engineer"},
-            "tool_name": "direct_consultation_3"
-        })
-        
+        """, label="Product Engineer detailed response", depends_on=["product_2"]),
         # Step 8: Create bug ticket based on Product Engineer's assessment
-        print("\n----- Step 8: Create Bug Ticket -----")
-        bug_query = f"""
+        Step("bug_ticket", "Create Bug Ticket", bug_agent, """
         Based on the Product Engineer's assessment, I need to create a bug ticket for the following issue:
         
         Product: Enterprise Dashboard
@@ -607,20 +486,9 @@ async def handle_complex_case(case_id, case_details, customer_query=None):
         Reproducible: Yes, consistently when filtering by date range
         
         Please create a formal bug ticket with appropriate severity.
-        """
-        bug_result = await Runner.run(bug_agent, bug_query)
-        print(f"Bug Ticket Agent response: {bug_result.final_output}")
-        
-        # Record this handoff
-        all_handoffs.append({
-            "source_agent": {"name": "Support Engineer"},
-            "target_agent": {"name": "Bug Ticketing Agent"},
-            "tool_name": "create_bug_ticket_handoff"
-        })
-        
+        """, label="Bug Ticket Agent response", handoff_tool="create_bug_ticket_handoff"),
         # Step 9: Create documentation ticket for missing documentation
-        print("\n----- Step 9: Create Documentation Ticket -----")
-        doc_query = f"""
+        Step("doc_ticket", "Create Documentation Ticket", documentation_agent, """
         I need to create a documentation request ticket for the following issue:
         
         Product: Enterprise Dashboard
@@ -630,37 +498,152 @@ async def handle_complex_case(case_id, case_details, customer_query=None):
                 which is critical for their business operations.
         
         Please create a formal documentation request ticket.
-        """
-        doc_result = await Runner.run(documentation_agent, doc_query)
-        print(f"Documentation Ticket Agent response: {doc_result.final_output}")
-        
-        # Record this handoff
-        all_handoffs.append({
-            "source_agent": {"name": "Support Engineer"},
-            "target_agent": {"name": "Documentation Ticketing Agent"},
-            "tool_name": "create_documentation_ticket"
-        })
-        
+        """, label="Documentation Ticket Agent response", handoff_tool="create_documentation_ticket"),
         # Step 10: Final response from Support Engineer
-        print("\n----- Step 10: Final Support Engineer Response -----")
-        final_query = f"""
+        Step("final", "Final Support Engineer Response", support_engineer, """
         Now that I've consulted with multiple engineers and created necessary tickets, I need to provide a comprehensive response to the customer.
         
-        Service Engineer identified: {service_result_3.final_output}
+        Service Engineer identified: {service}
         
-        Product Engineer identified: {product_result_3.final_output}
+        Product Engineer identified: {product}
         
-        Bug ticket created: {bug_result.final_output}
+        Bug ticket created: {bug}
         
-        Documentation ticket created: {doc_result.final_output}
+        Documentation ticket created: {doc}
         
         Please synthesize all this information into a clear, professional response for the customer that addresses all aspects of their complex issue.
-        """
-        final_result = await Runner.run(support_engineer, final_query)
-        print(f"\nFinal Support Engineer response: {final_result.final_output}")
+        """, label="Final Support Engineer response",
+             inputs={"service": "service_3", "product": "product_3", "bug": "bug_ticket", "doc": "doc_ticket"}),
+    ],
+    coordinator=support_engineer,
+    final_step="final",
+    fallback_steps=("initial", "product_3", "service_3", "product_2", "service_2", "product_1", "service_1"),
+)
+
+# Any other product: one consultation with each engineer, then a synthesis
+general_complex_playbook = Workflow(
+    "General complex case",
+    [
+        Step("initial", "Initial Support Engineer Assessment", support_engineer,
+             "Please handle the following complex support case:\n{case_details}{customer_query_section}",
+             label="Support Engineer initial assessment"),
+        Step("service", "Service Engineer Consultation", service_engineer, """
+        I need your expertise on a complex case:
+        {case_details}
+        
+        Can you assess whether any backend service, configuration or API issue contributes to this problem?
+        """, label="Service Engineer response"),
+        Step("product", "Product Engineer Consultation", product_engineer, """
+        I need your expertise on a complex case:
+        {case_details}
+        
+        Can you analyze whether this is a bug, documentation issue, or user error?
+        """, label="Product Engineer response"),
+        Step("final", "Final Support Engineer Response", support_engineer, """
+        I've consulted with our engineers about this case:
+        {case_details}
+        
+        Initial assessment: {initial}
+        
+        Service Engineer identified: {service}
+        
+        Product Engineer identified: {product}
+        
+        Please synthesize all this information into a clear, professional response for the customer.
+        """, label="Final Support Engineer response",
+             inputs={"initial": "initial", "service": "service", "product": "product"}),
+    ],
+    coordinator=support_engineer,
+    final_step="final",
+    fallback_steps=("initial", "product", "service"),
+)
+
+complex_case_playbooks = {
+    "Enterprise Dashboard": enterprise_dashboard_playbook,
+}
+
+# Playbook for a case, chosen by its product
+def playbook_for(case_id):
+    product = case_store.get(case_id, {}).get("product")
+    return complex_case_playbooks.get(product, general_complex_playbook)
+
+# Run one step of a complex case and log its outcome
+async def run_case_step(step, title, agent, prompt, label):
+    print(f"\n----- Step {step}: {title} -----")
+    result = await Runner.run(agent, prompt, max_turns=max_turns())
+    print(f"{label}: {result.final_output}")
+    return result
+
+# Specialized handler for complex cases with multiple handoffs
+async def handle_complex_case(case_id, case_details, customer_query=None, concurrent=True, raise_errors=False, run_step=run_case_step, compactor=None, budget=None, playbook=None):
+    """Handle a complex case by running its product's playbook workflow.
+
+    With concurrent=True independent steps run together, up to
+    WORKFLOW_MAX_PARALLEL at once (default: no limit); otherwise steps run one
+    at a time in playbook order. Handoffs are always recorded in step order so
+    the interaction graph is the same in both modes.
+
+    With raise_errors=True failures propagate to the caller instead of being
+    printed and turned into None. Every agent run goes through
+    `run_step(step, title, agent, prompt, label)`, which returns the run result;
+    the streaming handler swaps in a streamed implementation.
+
+    Every step prompt is fitted to a token budget by `compactor` (by default
+    configured from CONTEXT_TOKEN_BUDGET / CONTEXT_STEP_BUDGETS); the tokens
+    saved are reported and attached to the result as `compaction`.
+
+    Every run is also checked against `budget` (CaseBudget.from_env() by
+    default); once it is exhausted the case stops and returns the best answer
+    produced so far, marked with `budget_exhausted`.
+
+    Completed steps are checkpointed in `checkpoint_store`; calling this again
+    after a failure resumes from the first incomplete step, and tickets filed
+    by a step are not filed twice. Checkpoints and ticket idempotency keys
+    are dropped once the case completes, so the next run files its own
+    tickets.
+    """
+    playbook = playbook or playbook_for(case_id)
+    print(f"\n===== Complex Case Handler =====")
+    print(f"Processing complex case: {case_id} with playbook '{playbook.name}' ({'concurrent' if concurrent else 'sequential'} mode)")
+    
+    # Fit every prompt to its step's token budget, then record wall time, model time, tool time and tokens
+    compactor = compactor or ContextCompactor.from_env(case_id)
+    budget = budget or CaseBudget.from_env()
+    run_step = timed_step(compactor.wrap_step(budget.wrap_step(step_scoped(run_step))))
+    
+    checkpoint = CaseCheckpoint(checkpoint_store, case_id, run_key(playbook.name, case_details, customer_query))
+    if checkpoint.restored:
+        print(f"Resuming case {case_id}: {len(checkpoint.restored)} of {len(playbook.steps)} steps restored from checkpoint")
+        for step in playbook.steps:
+            if step.id in checkpoint.restored:
+                budget.completed_steps[step.number] = checkpoint.restored[step.id]
+    
+    context = {
+        "case_id": case_id,
+        "case_details": case_details,
+        "customer_query": customer_query or "",
+        "customer_query_section": f"\n\nCustomer query: {customer_query}" if customer_query else "",
+    }
+    if concurrent:
+        max_parallel = int(os.environ["WORKFLOW_MAX_PARALLEL"]) if os.environ.get("WORKFLOW_MAX_PARALLEL") else None
+    else:
+        max_parallel = 1
+    
+    try:
+        # Tickets are idempotent per step of this run; once the run completes its keys are released
+        with run_context(checkpoint.key):
+            workflow_run = await run_workflow(playbook, context, run_step, max_parallel=max_parallel,
+                                              compactor=compactor, checkpoint=checkpoint)
+        checkpoint.clear()
+        ticket_store.release_run(case_id, checkpoint.key)
+        final_result = workflow_run.final_result
+        all_handoffs = workflow_run.handoffs
         
         # Add all_handoffs to final_result for UI to use
         final_result.all_handoffs = all_handoffs
+        final_result.trace = workflow_run.trace
+        final_result.compaction = compactor.report.summary()
+        final_result.budget = budget.summary()
         
         # Print handoff path information
         print("\n===== Handoff Path =====")
@@ -673,32 +656,23 @@ async def handle_complex_case(case_id, case_details, customer_query=None):
                 if hasattr(handoff_item, 'tool_name') and handoff_item.tool_name:
                     print(f"   Tool used: {handoff_item.tool_name}")
         
+        compactor.report.print_summary()
+        
         # Print created tickets
-        if devops_tickets:
-            print("\n===== Created Tickets =====")
-            for ticket in devops_tickets:
-                print(f"ID: {ticket['id']}")
-                print(f"Type: {ticket['type']}")
-                print(f"Title: {ticket['title']}")
-                print(f"Product: {ticket['product']}")
-                if 'severity' in ticket:
-                    print(f"Severity: {ticket['severity']}")
-                print(f"Status: {ticket['status']}")
-                print(f"Created at: {ticket['created_at']}")
-                print(f"URL: https://dev.azure.com/company/project/_workitems/edit/{ticket['id']}")
-                print("---")
+        print_case_tickets(case_id)
         
         return final_result
+    except BudgetExceeded as e:
+        print(f"\nBudget exhausted for case {case_id}: {e}")
+        return budget.degraded_result(str(e), playbook.answer_preference())
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"Error processing complex case: {e}")
         return None
 
 # Example queries for testing
 async def run_demo():
-    # Clear ticket list to ensure each run starts fresh
-    global devops_tickets
-    devops_tickets = []
-    
     # Only run the complex case for demonstration
     complex_case = {
         "case_id": "CASE004",
@@ -0,0 +1,194 @@
+# Batch Support Case Processing
+import asyncio
+import math
+import time
+
+from support_agents import handle_support_case
+
+
+class CaseOutcome:
+    """Result of one case in a batch: either a result or the error that stopped it"""
+
+    def __init__(self, case_id, query, result=None, error=None, latency=0.0):
+        self.case_id = case_id
+        self.query = query
+        self.result = result
+        self.error = error
+        self.latency = latency
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"error={self.error!r}"
+        return f"CaseOutcome({self.case_id}, {status}, latency={self.latency:.2f}s)"
+
+
+class BatchReport:
+    """Aggregate throughput and latency statistics for a batch run"""
+
+    def __init__(self):
+        self.latencies = []
+        self.succeeded = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, outcome):
+        self.latencies.append(outcome.latency)
+        if outcome.ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+    @property
+    def total(self):
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    @property
+    def throughput(self):
+        """Completed cases per second of wall-clock time"""
+        return self.total / self.elapsed if self.elapsed > 0 else 0.0
+
+    def percentile(self, p):
+        """Nearest-rank percentile of case latency, in seconds"""
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        rank = max(1, math.ceil(p / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+    def summary(self):
+        return {
+            "cases": self.total,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "elapsed_s": round(self.elapsed, 3),
+            "throughput_cases_per_s": round(self.throughput, 3),
+            "latency_p50_s": round(self.percentile(50), 3),
+            "latency_p90_s": round(self.percentile(90), 3),
+            "latency_p99_s": round(self.percentile(99), 3),
+            "latency_max_s": round(max(self.latencies), 3) if self.latencies else 0.0,
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print("\n===== Batch Summary =====")
+        print(f"Cases: {summary['cases']} ({summary['succeeded']} succeeded, {summary['failed']} failed)")
+        print(f"Elapsed: {summary['elapsed_s']}s")
+        print(f"Throughput: {summary['throughput_cases_per_s']} cases/s")
+        print(f"Latency p50/p90/p99/max: {summary['latency_p50_s']}s / {summary['latency_p90_s']}s / "
+              f"{summary['latency_p99_s']}s / {summary['latency_max_s']}s")
+
+
+async def _process_case(case_id, query, handler):
+    start = time.perf_counter()
+    try:
+        result = await handler(case_id, query, raise_errors=True)
+        return CaseOutcome(case_id, query, result=result, latency=time.perf_counter() - start)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        return CaseOutcome(case_id, query, error=e, latency=time.perf_counter() - start)
+
+
+async def process_cases(cases, concurrency=8, report=None, handler=handle_support_case, print_report=True):
+    """Process (case_id, query) pairs with at most `concurrency` cases in flight.
+
+    Yields a CaseOutcome for every case as soon as it finishes, so results come
+    back in completion order, not submission order. A failing case produces an
+    outcome carrying its exception and never affects the other cases.
+
+    `cases` is consumed lazily, so it can be a generator over a large queue.
+    An entry that is not a (case_id, query) pair produces a failed outcome. If
+    iterating `cases` raises, no new cases are started; the error is raised
+    to the consumer once the cases in flight have finished.
+    Pass a BatchReport to read the aggregate statistics after the run; the
+    summary is printed at the end unless print_report is False.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    report = report if report is not None else BatchReport()
+    report.started_at = time.perf_counter()
+    case_iter = iter(cases)
+    outcomes = asyncio.Queue()
+    done = object()
+    source_errors = []
+
+    # Each worker pulls the next pair from the shared iterator, so no more than
+    # `concurrency` cases are ever materialized or running at once
+    async def worker():
+        try:
+            while not source_errors:
+                try:
+                    entry = next(case_iter)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    source_errors.append(e)
+                    return
+                try:
+                    case_id, query = entry
+                except (TypeError, ValueError):
+                    case_id = entry[0] if isinstance(entry, (tuple, list)) and entry else entry
+                    await outcomes.put(CaseOutcome(case_id, None, error=ValueError(
+                        f"expected a (case_id, query) pair, got {entry!r}")))
+                    continue
+                await outcomes.put(await _process_case(case_id, query, handler))
+        finally:
+            await outcomes.put(done)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        running = len(workers)
+        while running:
+            outcome = await outcomes.get()
+            if outcome is done:
+                running -= 1
+                continue
+            report.record(outcome)
+            yield outcome
+        if source_errors:
+            raise source_errors[0]
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        report.finished_at = time.perf_counter()
+        if print_report:
+            report.print_summary()
+
+
+async def run_batch(cases, concurrency=8, handler=handle_support_case):
+    """Process all cases and return (outcomes, report) once the batch is finished"""
+    report = BatchReport()
+    outcomes = [outcome async for outcome in process_cases(cases, concurrency, report, handler)]
+    return outcomes, report
+
+
+# Example batch run
+async def run_demo():
+    cases = [
+        ("CASE001", "Our team cannot connect to the API service, it keeps showing connection timeout."),
+        ("CASE002", "We encountered a SYNC-404 error when using the data synchronization feature."),
+        ("CASE003", "The 'Refresh Data' button on the dashboard doesn't respond at all."),
+        ("CASE003", "We can't find documentation on how to configure the dashboard's auto-refresh feature."),
+    ]
+
+    async for outcome in process_cases(cases, concurrency=2):
+        if outcome.ok:
+            print(f"[done] {outcome.case_id} in {outcome.latency:.2f}s")
+        else:
+            print(f"[failed] {outcome.case_id} in {outcome.latency:.2f}s: {outcome.error}")
+
+if __name__ == "__main__":
+    asyncio.run(run_demo())
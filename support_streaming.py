@@ -0,0 +1,131 @@
+# Streaming Support Case Handling
+#
+# Streamed variants of handle_support_case / handle_complex_case built on
+# Runner.run_streamed. Instead of one result at the end, callers iterate over
+# events as they happen:
+#
+#   {"type": "step_started", "step", "title", "agent"}
+#   {"type": "text_delta", "step", "agent", "delta"}
+#   {"type": "tool_call", "step", "agent", "tool", "arguments"}
+#   {"type": "tool_output", "step", "agent", "output"}
+#   {"type": "handoff", "step", "source", "target", "tool_name"}
+#   {"type": "step_completed", "step", "agent", "output"}
+#   {"type": "case_completed", "result"}
+#   {"type": "error", "error"}
+#
+# When the complex case runs its chains concurrently, events of different
+# steps interleave; the "step" field tells them apart.
+import asyncio
+
+from agents import Runner
+from openai.types.responses import ResponseTextDeltaEvent
+
+from support_agents import (
+    build_case_details, build_case_query, handle_complex_case, is_complex_case, support_engineer
+)
+from agent_metrics import case_metrics, timed_step
+from case_budget import BudgetExceeded, CaseBudget, max_turns
+from ticket_store import case_context
+
+_DONE = object()
+
+
+async def stream_run(agent, prompt, emit, step=1, title=None):
+    """Run `agent` with streaming, forwarding its events to `emit`; returns the finished run result"""
+    emit({"type": "step_started", "step": step, "title": title or agent.name, "agent": agent.name})
+    result = Runner.run_streamed(agent, prompt, max_turns=max_turns())
+    current_agent = agent.name
+    pending_handoff_tool = None
+    async for event in result.stream_events():
+        if event.type == "raw_response_event":
+            if isinstance(event.data, ResponseTextDeltaEvent) and event.data.delta:
+                emit({"type": "text_delta", "step": step, "agent": current_agent, "delta": event.data.delta})
+        elif event.type == "agent_updated_stream_event":
+            current_agent = event.new_agent.name
+        elif event.type == "run_item_stream_event":
+            item = event.item
+            if item.type == "tool_call_item":
+                emit({"type": "tool_call", "step": step, "agent": current_agent,
+                      "tool": getattr(item.raw_item, "name", None), "arguments": getattr(item.raw_item, "arguments", None)})
+            elif item.type == "tool_call_output_item":
+                emit({"type": "tool_output", "step": step, "agent": current_agent, "output": item.output})
+            elif item.type == "handoff_call_item":
+                pending_handoff_tool = getattr(item.raw_item, "name", None)
+            elif item.type == "handoff_output_item":
+                emit({"type": "handoff", "step": step, "source": item.source_agent.name,
+                      "target": item.target_agent.name, "tool_name": pending_handoff_tool})
+    emit({"type": "step_completed", "step": step, "agent": current_agent, "output": result.final_output})
+    return result
+
+
+def streaming_step_runner(emit):
+    """A handle_complex_case `run_step` that streams each step's events to `emit`"""
+    async def run_step(step, title, agent, prompt, label):
+        print(f"\n----- Step {step}: {title} -----")
+        result = await stream_run(agent, prompt, emit, step, title)
+        print(f"{label}: {result.final_output}")
+        return result
+    return run_step
+
+
+async def stream_support_case(case_id, customer_query=None, concurrent=True):
+    """Async generator over the events of handling one support case.
+
+    The last event is either "case_completed", carrying the same result object
+    handle_support_case would return, or "error". Closing the generator early
+    cancels the case.
+    """
+    queue = asyncio.Queue()
+    emit = queue.put_nowait
+
+    async def produce():
+        try:
+            budget = CaseBudget.from_env()
+            with case_context(case_id), case_metrics(case_id) as metrics:
+                case_details = build_case_details(case_id)
+                if is_complex_case(case_id):
+                    result = await handle_complex_case(
+                        case_id, case_details, customer_query, concurrent=concurrent,
+                        raise_errors=True, run_step=streaming_step_runner(emit), budget=budget
+                    )
+                else:
+                    query = build_case_query(case_details, customer_query)
+                    run_step = timed_step(budget.wrap_step(
+                        lambda step, title, agent, prompt, label: stream_run(agent, prompt, emit, step, title)
+                    ))
+                    try:
+                        result = await run_step(1, "Support Engineer Assessment", support_engineer, query, None)
+                    except BudgetExceeded as e:
+                        result = budget.degraded_result(str(e))
+                result.metrics = metrics.summary()
+                result.budget = budget.summary()
+            emit({"type": "case_completed", "result": result})
+        except Exception as e:
+            emit({"type": "error", "error": e})
+        finally:
+            emit(_DONE)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            event = await queue.get()
+            if event is _DONE:
+                break
+            yield event
+    finally:
+        if not producer.done():
+            producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+
+# Example: print a case as it streams
+async def run_demo():
+    query = "We're experiencing issues with our Enterprise Dashboard. The data visualization components are not displaying correctly, API calls are timing out intermittently, and we can't find documentation on how to configure the advanced filtering options."
+    async for event in stream_support_case("CASE004", query):
+        if event["type"] == "text_delta":
+            print(event["delta"], end="", flush=True)
+        elif event["type"] != "case_completed":
+            print(f"\n[{event['type']}] {({k: v for k, v in event.items() if k != 'type'})}")
+
+if __name__ == "__main__":
+    asyncio.run(run_demo())
@@ -0,0 +1,378 @@
+# Azure DevOps Ticket Store
+#
+# Replaces the module-level ticket list and counter. Ticket IDs are allocated
+# atomically, every ticket is attributed to the support case that created it,
+# and every change is appended to an append-only event log. Two
+# implementations are provided: an in-memory store for single-process use and
+# a SQLite store that stays correct with concurrent writers across threads and
+# processes.
+import contextlib
+import contextvars
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from storage import connect_sqlite, data_path
+
+TICKET_PREFIXES = {"Bug": "BUG", "Documentation": "DOC"}
+FIRST_TICKET_NUMBER = 1001
+
+# Case being handled by the current task; tools read it to attribute tickets
+current_case_id = contextvars.ContextVar("current_case_id", default=None)
+# Workflow step being run by the current task; makes ticket creation idempotent per step
+current_step = contextvars.ContextVar("current_step", default=None)
+# Run key (see case_checkpoints.run_key) of the case run the current task belongs to
+current_run = contextvars.ContextVar("current_run", default=None)
+
+
+@contextlib.contextmanager
+def case_context(case_id):
+    """Attribute tickets created inside this block (and tasks it spawns) to `case_id`"""
+    token = current_case_id.set(case_id)
+    try:
+        yield
+    finally:
+        current_case_id.reset(token)
+
+
+@contextlib.contextmanager
+def step_context(step):
+    """Tickets created inside this block belong to workflow step `step` of the current case"""
+    token = current_step.set(step)
+    try:
+        yield
+    finally:
+        current_step.reset(token)
+
+
+@contextlib.contextmanager
+def run_context(key):
+    """Idempotency keys created inside this block belong to case run `key`"""
+    token = current_run.set(key)
+    try:
+        yield
+    finally:
+        current_run.reset(token)
+
+
+def step_scoped(run_step):
+    """Wrap a handle_complex_case `run_step` so each step runs inside its step_context"""
+    async def run(step, title, agent, prompt, label):
+        with step_context(step):
+            return await run_step(step, title, agent, prompt, label)
+    return run
+
+
+def run_key_prefix(case_id, run=None):
+    """Common prefix of the idempotency keys of one run of a case"""
+    return f"{case_id}/{run}/" if run is not None else f"{case_id}/"
+
+
+def idempotency_key(ticket_type, case_id=None):
+    """Key under which a step of a case run may create at most one ticket of a type, or None outside a step"""
+    case_id = case_id if case_id is not None else current_case_id.get()
+    step = current_step.get()
+    if case_id is None or step is None:
+        return None
+    return f"{run_key_prefix(case_id, current_run.get())}step-{step}/{ticket_type}"
+
+
+def ticket_url(ticket_id):
+    return f"https://dev.azure.com/company/project/_workitems/edit/{ticket_id}"
+
+
+def _new_ticket(ticket_id, ticket_type, title, description, product, severity, case_id):
+    ticket = {
+        "id": ticket_id,
+        "type": ticket_type,
+        "title": title,
+        "description": description,
+        "product": product
+    }
+    if severity is not None:
+        ticket["severity"] = severity
+    ticket.update({
+        "status": "New",
+        "case_id": case_id,
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
+    return ticket
+
+
+def _add_occurrence(ticket, title, description, case_id):
+    """Record a linked report on a ticket dict; False if the case is already on it"""
+    occurrences = ticket.setdefault("occurrences", [])
+    if case_id is not None and (ticket.get("case_id") == case_id or any(o["case_id"] == case_id for o in occurrences)):
+        return False
+    occurrences.append({
+        "case_id": case_id,
+        "title": title,
+        "description": description,
+        "reported_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
+    return True
+
+
+def _reported_by(ticket, case_id):
+    return ticket.get("case_id") == case_id or any(o["case_id"] == case_id for o in ticket.get("occurrences", ()))
+
+
+class TicketStore(ABC):
+    """Interface shared by the ticket store implementations"""
+
+    @abstractmethod
+    def create_ticket(self, ticket_type, title, description, product, severity=None, case_id=None):
+        """Allocate an ID, store the ticket and log its creation; returns the ticket dict.
+
+        case_id defaults to the case of the current task (see case_context).
+        Inside a step_context a step of a case run (see run_context) creates at
+        most one ticket per type: repeating the call (for example when a failed
+        case is resumed) returns the ticket created the first time.
+        """
+
+    @abstractmethod
+    def get_ticket_by_key(self, key):
+        """The ticket created under an idempotency key, or None"""
+
+    @abstractmethod
+    def release_run(self, case_id, run=None):
+        """Forget the idempotency keys of a finished case run, so the next run files its own tickets"""
+
+    @abstractmethod
+    def add_occurrence(self, ticket_id, title, description, case_id=None):
+        """Attach another report of the same issue to an existing ticket; returns the ticket or None.
+
+        A case that already created or reported the ticket is not added twice.
+        """
+
+    @abstractmethod
+    def get_ticket(self, ticket_id):
+        """The ticket with this ID, or None"""
+
+    @abstractmethod
+    def list_tickets(self, case_id=None):
+        """Tickets in creation order, optionally only those a case created or reported"""
+
+    @abstractmethod
+    def events(self, ticket_id=None):
+        """The append-only event log, oldest first"""
+
+
+class InMemoryTicketStore(TicketStore):
+    """Thread-safe in-process store; optionally mirrors its event log to a JSON-lines file"""
+
+    def __init__(self, log_path=None, first_number=FIRST_TICKET_NUMBER):
+        self._lock = threading.Lock()
+        self._next_number = first_number
+        self._tickets = {}
+        self._keys = {}
+        self._events = []
+        self._log_file = open(log_path, "a", encoding="utf-8") if log_path else None
+
+    def _append_event(self, event, ticket):
+        entry = {"seq": len(self._events) + 1, "event": event, "ticket_id": ticket["id"],
+                 "case_id": ticket.get("case_id"), "at": datetime.now().isoformat(), "ticket": dict(ticket)}
+        self._events.append(entry)
+        if self._log_file is not None:
+            self._log_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._log_file.flush()
+
+    def create_ticket(self, ticket_type, title, description, product, severity=None, case_id=None):
+        case_id = case_id if case_id is not None else current_case_id.get()
+        key = idempotency_key(ticket_type, case_id)
+        with self._lock:
+            if key in self._keys:
+                return dict(self._tickets[self._keys[key]])
+            ticket_id = f"{TICKET_PREFIXES[ticket_type]}-{self._next_number}"
+            self._next_number += 1
+            ticket = _new_ticket(ticket_id, ticket_type, title, description, product, severity, case_id)
+            self._tickets[ticket_id] = ticket
+            if key is not None:
+                self._keys[key] = ticket_id
+            self._append_event("created", ticket)
+            return dict(ticket)
+
+    def get_ticket_by_key(self, key):
+        with self._lock:
+            ticket_id = self._keys.get(key)
+            return dict(self._tickets[ticket_id]) if ticket_id else None
+
+    def release_run(self, case_id, run=None):
+        prefix = run_key_prefix(case_id, run)
+        with self._lock:
+            for key in [key for key in self._keys if key.startswith(prefix)]:
+                del self._keys[key]
+
+    def add_occurrence(self, ticket_id, title, description, case_id=None):
+        case_id = case_id if case_id is not None else current_case_id.get()
+        with self._lock:
+            ticket = self._tickets.get(ticket_id)
+            if ticket is None:
+                return None
+            if _add_occurrence(ticket, title, description, case_id):
+                self._append_event("occurrence", ticket)
+            return dict(ticket)
+
+    def get_ticket(self, ticket_id):
+        with self._lock:
+            ticket = self._tickets.get(ticket_id)
+            return dict(ticket) if ticket else None
+
+    def list_tickets(self, case_id=None):
+        with self._lock:
+            return [dict(ticket) for ticket in self._tickets.values()
+                    if case_id is None or _reported_by(ticket, case_id)]
+
+    def events(self, ticket_id=None):
+        with self._lock:
+            return [dict(entry) for entry in self._events if ticket_id is None or entry["ticket_id"] == ticket_id]
+
+
+class SQLiteTicketStore(TicketStore):
+    """Durable store safe for concurrent writers.
+
+    IDs come from a counter row incremented inside a BEGIN IMMEDIATE
+    transaction, which takes SQLite's write lock up front, so two writers can
+    never read the same value. Each thread uses its own connection.
+    """
+
+    def __init__(self, path=None, first_number=FIRST_TICKET_NUMBER):
+        self.path = path or data_path("tickets.sqlite3")
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS tickets (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT NOT NULL UNIQUE,
+                case_id TEXT,
+                data TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tickets_case_id ON tickets (case_id)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ticket_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                event TEXT NOT NULL,
+                ticket_id TEXT NOT NULL,
+                case_id TEXT,
+                at TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ticket_links (
+                ticket_id TEXT NOT NULL,
+                case_id TEXT NOT NULL,
+                PRIMARY KEY (case_id, ticket_id)
+            )
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS ticket_keys (key TEXT PRIMARY KEY, ticket_id TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('ticket', ?)", (first_number,))
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def _append_event(self, conn, event, ticket):
+        conn.execute(
+            "INSERT INTO ticket_events (event, ticket_id, case_id, at, data) VALUES (?, ?, ?, ?, ?)",
+            (event, ticket["id"], ticket.get("case_id"), datetime.now().isoformat(), json.dumps(ticket, ensure_ascii=False)),
+        )
+
+    def create_ticket(self, ticket_type, title, description, product, severity=None, case_id=None):
+        case_id = case_id if case_id is not None else current_case_id.get()
+        key = idempotency_key(ticket_type, case_id)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if key is not None:
+                row = conn.execute(
+                    "SELECT t.data FROM ticket_keys k JOIN tickets t ON t.id = k.ticket_id WHERE k.key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return json.loads(row[0])
+            number = conn.execute("SELECT value FROM counters WHERE name = 'ticket'").fetchone()[0]
+            conn.execute("UPDATE counters SET value = ? WHERE name = 'ticket'", (number + 1,))
+            ticket_id = f"{TICKET_PREFIXES[ticket_type]}-{number}"
+            ticket = _new_ticket(ticket_id, ticket_type, title, description, product, severity, case_id)
+            conn.execute("INSERT INTO tickets (id, case_id, data) VALUES (?, ?, ?)",
+                         (ticket_id, case_id, json.dumps(ticket, ensure_ascii=False)))
+            if key is not None:
+                conn.execute("INSERT INTO ticket_keys (key, ticket_id) VALUES (?, ?)", (key, ticket_id))
+            self._append_event(conn, "created", ticket)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return ticket
+
+    def add_occurrence(self, ticket_id, title, description, case_id=None):
+        case_id = case_id if case_id is not None else current_case_id.get()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            ticket = json.loads(row[0])
+            if _add_occurrence(ticket, title, description, case_id):
+                conn.execute("UPDATE tickets SET data = ? WHERE id = ?", (json.dumps(ticket, ensure_ascii=False), ticket_id))
+                if case_id is not None:
+                    conn.execute("INSERT OR IGNORE INTO ticket_links (ticket_id, case_id) VALUES (?, ?)", (ticket_id, case_id))
+                self._append_event(conn, "occurrence", ticket)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return ticket
+
+    def get_ticket(self, ticket_id):
+        row = self._conn().execute("SELECT data FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_ticket_by_key(self, key):
+        row = self._conn().execute(
+            "SELECT t.data FROM ticket_keys k JOIN tickets t ON t.id = k.ticket_id WHERE k.key = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def release_run(self, case_id, run=None):
+        prefix = run_key_prefix(case_id, run)
+        self._conn().execute("DELETE FROM ticket_keys WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def list_tickets(self, case_id=None):
+        if case_id is None:
+            rows = self._conn().execute("SELECT data FROM tickets ORDER BY seq").fetchall()
+        else:
+            rows = self._conn().execute(
+                "SELECT data FROM tickets WHERE case_id = ? OR id IN (SELECT ticket_id FROM ticket_links WHERE case_id = ?) ORDER BY seq",
+                (case_id, case_id),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def events(self, ticket_id=None):
+        query = "SELECT seq, event, ticket_id, case_id, at, data FROM ticket_events"
+        params = ()
+        if ticket_id is not None:
+            query += " WHERE ticket_id = ?"
+            params = (ticket_id,)
+        rows = self._conn().execute(query + " ORDER BY seq", params).fetchall()
+        return [{"seq": seq, "event": event, "ticket_id": tid, "case_id": cid, "at": at, "ticket": json.loads(data)}
+                for seq, event, tid, cid, at, data in rows]
+
+
+def create_ticket_store():
+    """Store selected by TICKET_STORE ("memory", the default, or "sqlite" at TICKET_STORE_PATH)"""
+    kind = os.environ.get("TICKET_STORE", "memory").lower()
+    if kind == "sqlite":
+        return SQLiteTicketStore(os.environ.get("TICKET_STORE_PATH"))
+    if kind == "memory":
+        return InMemoryTicketStore(os.environ.get("TICKET_LOG_PATH"))
+    raise ValueError(f"Unknown TICKET_STORE '{kind}', expected 'memory' or 'sqlite'")
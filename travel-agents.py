@@ -1,12 +1,15 @@
 # 旅游智能体
-from agents import Agent, Runner, AsyncOpenAI, OpenAIChatCompletionsModel, ModelSettings, handoff
+from agents import Agent, Runner, OpenAIChatCompletionsModel, ModelSettings, handoff
 from agents.extensions.handoff_prompt import prompt_with_handoff_instructions
 import asyncio
 import json
 from pydantic import BaseModel, ValidationError
+from model_client import install_shared_client
+from rate_limiter import enable_rate_limits
+from resilience import enable_resilience
 
-# 设置OpenAI客户端
-openai_client = AsyncOpenAI()
+# 设置OpenAI客户端（进程内共享的连接池，参数见 model_client.py）
+openai_client = install_shared_client()
 
 # 最终旅行计划的输出类型
 class TravelPlan(BaseModel):
@@ -138,6 +141,14 @@ planner_agent.handoffs = [to_local_expert, to_language_guide]
 local_agent.handoffs = [to_language_guide, to_travel_compiler]
 language_agent.handoffs = [to_travel_compiler]
 
+# 系统中的全部代理，便于统一配置模型
+all_agents = [planner_agent, local_agent, language_agent, summary_agent]
+
+# 每次模型调用的超时、退避重试和可选的对冲请求（见 resilience.py），
+# 每次尝试和对冲请求都按进程共享的每分钟请求数/令牌数配额排队（见 rate_limiter.py）
+enable_rate_limits(all_agents)
+resilience = enable_resilience(all_agents)
+
 # 入口点函数
 async def plan_trip(destination_prompt):
     # 添加错误处理
@@ -0,0 +1,194 @@
+# Workflow Engine
+#
+# Declarative multi-step agent workflows. A Workflow is a DAG of Steps; each
+# step names its agent, a prompt template, the earlier steps whose output it
+# uses (`inputs`) and any further ordering dependencies (`depends_on`). The
+# scheduler starts every step whose dependencies are done, up to a
+# parallelism cap, and records what happened: real handoff items from each run,
+# a consultation record for every step that asks a specialist directly, and a
+# timing trace. With a checkpoint, completed steps are saved as they finish
+# and steps saved by an earlier, failed run are restored instead of re-run.
+#
+# Prompt templates are str.format strings over the run context (for example
+# {case_details}) plus one name per input, bound to that step's final output.
+# A template may also be a callable taking the same values as keyword
+# arguments.
+import asyncio
+import time
+
+
+class WorkflowError(Exception):
+    """A workflow definition is invalid (unknown step, duplicate ID or a cycle)"""
+
+
+class Step:
+    """One agent run in a workflow.
+
+    `inputs` maps template names to step IDs whose final output is substituted.
+    `handoff_tool` names the consultation record for this step; by default a
+    step run by a specialist is recorded as "direct_consultation_<n>".
+    """
+
+    def __init__(self, id, title, agent, prompt, label=None, inputs=None, depends_on=(), handoff_tool=None):
+        self.id = id
+        self.title = title
+        self.agent = agent
+        self.prompt = prompt
+        self.label = label or f"{agent.name} response"
+        self.inputs = dict(inputs or {})
+        self.depends_on = tuple(depends_on)
+        self.handoff_tool = handoff_tool
+        self.number = None
+
+    @property
+    def dependencies(self):
+        return set(self.depends_on) | set(self.inputs.values())
+
+    def render(self, context, inputs):
+        """The prompt for this step, given the run context and the text of each input"""
+        values = dict(context)
+        values.update(inputs)
+        if callable(self.prompt):
+            return self.prompt(**values)
+        return self.prompt.format(**values)
+
+
+class Workflow:
+    """A validated DAG of steps; steps are numbered in declaration order.
+
+    `coordinator` is the agent that owns the case: its steps are not recorded
+    as consultations. `final_step` is the step whose result is the workflow's
+    result, and `fallback_steps` lists, best first, the steps whose output can
+    stand in for it when a case is cut short.
+    """
+
+    def __init__(self, name, steps, coordinator, final_step=None, fallback_steps=()):
+        self.name = name
+        self.steps = list(steps)
+        self.coordinator = coordinator
+        self.by_id = {}
+        for number, step in enumerate(self.steps, start=1):
+            if step.id in self.by_id:
+                raise WorkflowError(f"Duplicate step ID '{step.id}' in workflow '{name}'")
+            step.number = number
+            self.by_id[step.id] = step
+        for step in self.steps:
+            unknown = step.dependencies - set(self.by_id)
+            if unknown:
+                raise WorkflowError(f"Step '{step.id}' depends on unknown steps: {', '.join(sorted(unknown))}")
+        self.final_step = final_step or self.steps[-1].id
+        self.fallback_steps = tuple(fallback_steps)
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        done, visiting = set(), set()
+
+        def visit(step_id):
+            if step_id in done:
+                return
+            if step_id in visiting:
+                raise WorkflowError(f"Workflow '{self.name}' has a dependency cycle through '{step_id}'")
+            visiting.add(step_id)
+            for dependency in self.by_id[step_id].dependencies:
+                visit(dependency)
+            visiting.discard(step_id)
+            done.add(step_id)
+
+        for step in self.steps:
+            visit(step.id)
+
+    def answer_preference(self):
+        """Step numbers whose results may stand in for the final answer, best first"""
+        return tuple(self.by_id[step_id].number for step_id in (self.final_step,) + self.fallback_steps)
+
+
+class WorkflowRun:
+    """Results of a finished workflow: per-step results, handoffs in step order and a timing trace"""
+
+    def __init__(self, workflow, results, trace):
+        self.workflow = workflow
+        self.results = results
+        self.trace = sorted(trace, key=lambda entry: entry["step"])
+        self.handoffs = self._collect_handoffs()
+
+    @property
+    def final_result(self):
+        return self.results[self.workflow.final_step]
+
+    def _collect_handoffs(self):
+        handoffs = []
+        consultations = {}
+        for step in self.workflow.steps:
+            result = self.results[step.id]
+            handoffs.extend(getattr(result, "handoff_records", None) or ())
+            handoffs.extend(item for item in getattr(result, "new_items", None) or () if item.type == "handoff_output_item")
+            if step.agent is not self.workflow.coordinator:
+                consultations[step.agent.name] = consultations.get(step.agent.name, 0) + 1
+                tool_name = step.handoff_tool or f"direct_consultation_{consultations[step.agent.name]}"
+                handoffs.append({
+                    "source_agent": {"name": self.workflow.coordinator.name},
+                    "target_agent": {"name": step.agent.name},
+                    "tool_name": tool_name
+                })
+        return handoffs
+
+
+async def run_workflow(workflow, context, run_step, max_parallel=None, compactor=None, checkpoint=None):
+    """Run `workflow`, starting ready steps as soon as their dependencies finish.
+
+    Each step goes through `run_step(number, title, agent, prompt, label)`.
+    At most `max_parallel` steps run at once (None: no limit, 1: sequential in
+    declaration order). With a `compactor`, step inputs share the step's
+    token budget. If a step fails, the other running steps are cancelled and
+    the error propagates. With a `checkpoint` (see case_checkpoints), each
+    completed step is saved and steps already saved are not run again.
+    """
+    results = {}
+    trace = []
+    pending = list(workflow.steps)
+    running = {}
+    limit = max_parallel or len(workflow.steps)
+
+    async def execute(step):
+        values = {name: str(results[step_id].final_output) for name, step_id in step.inputs.items()}
+        if compactor is not None and values:
+            share = compactor.budget(step.number) // (len(values) + 1)
+            values = {name: compactor.compact(step.number, name, text, share) for name, text in values.items()}
+        prompt = step.render(context, values)
+        started = time.perf_counter()
+        result = await run_step(step.number, step.title, step.agent, prompt, step.label)
+        entry = {"step": step.number, "id": step.id, "title": step.title, "agent": step.agent.name,
+                 "started_at": started, "seconds": round(time.perf_counter() - started, 4)}
+        trace.append(entry)
+        if checkpoint is not None:
+            checkpoint.put(step, result, entry)
+        return result
+
+    try:
+        while pending or running:
+            restored = False
+            for step in list(pending):
+                if step.dependencies <= set(results):
+                    saved = checkpoint.get(step.id) if checkpoint is not None else None
+                    if saved is not None:
+                        pending.remove(step)
+                        results[step.id] = saved
+                        trace.append(dict(saved.trace, restored=True))
+                        restored = True
+                    elif len(running) < limit:
+                        pending.remove(step)
+                        running[asyncio.ensure_future(execute(step))] = step
+            if restored and not running:
+                continue
+            if not running:
+                raise WorkflowError(f"Workflow '{workflow.name}' cannot make progress")
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                step = running.pop(task)
+                results[step.id] = task.result()
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+    return WorkflowRun(workflow, results, trace)